@@ -1,17 +1,24 @@
 import sys
+import random
+import asyncio
 import numpy as np
 import pandas as pd
 from datetime import datetime
 import matplotlib.pyplot as plt
 
-from Utils.syntised_utils import save_action_sequence, create_directory, save_apl_active_phases
+from Utils.syntised_utils import create_directory, save_action_sequence_files, save_energy_data
+from Utils.checkpoint import save_checkpoint, load_checkpoint
+from Utils.output_writer import OutputWriter
+from Utils.realtime_stream import RealTimeStreamer
 
 
 class SynTiSeD:
     def __init__(self, appliance_dict, permanent_appliance_dict, resident_dict,
                  repetitions: int, start_date: str = '2000-01-01', save_path: str = './TimeSeriesData',
                  variance: int = None, simulation_speed: int = 20, plot_data: bool = False,
-                 save_active_phases: bool = False):
+                 save_active_phases: bool = False, checkpoint_path: str = None, checkpoint_interval: int = 1,
+                 resume_from: str = None, save_data: bool = True, output_workers: int = 1,
+                 output_queue_size: int = 4, output_processes: bool = False, seed: int = None):
         self.appliance_dict = appliance_dict
         self.permanent_appliance_dict = permanent_appliance_dict
         self.resident_dict = resident_dict
@@ -27,12 +34,37 @@ class SynTiSeD:
         self.simulation_speed = simulation_speed
         self.plot_data = plot_data
         self.save_active_phases = save_active_phases
+        self.save_data = save_data
+        self.output_workers = output_workers
+        self.output_queue_size = output_queue_size
+        self.output_processes = output_processes
+        self.output_writer = None
+
+        ## every household has its own random number generators, so households that are simulated in parallel
+        ## threads do not share the global ones; without a seed, they are seeded from the global generator
+        self.seed = seed if seed is not None else random.getrandbits(32)
+        self.random = random.Random(self.seed)
+        self.np_random = np.random.RandomState(self.seed)
+        for key, resident in self.resident_dict.items():
+            resident.random = self.random
+        for key, appliance in self.appliance_dict.items():
+            appliance.random = self.random
+            ## background refills from a pattern service depend on the timing, a seeded simulation refills directly
+            appliance.refill_in_background = seed is None
+        for key, appliance in self.permanent_appliance_dict.items():
+            appliance.np_random = self.np_random
 
         self.simulation_time = 86400
         self.start_timestamp = self.start_date.timestamp()
         self.current_timestamp = self.start_timestamp
         self.used_appliance_list = list()
 
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_interval = checkpoint_interval
+        self.next_day = 0
+        if resume_from is not None:
+            load_checkpoint(self, resume_from)
+
     def __build_energydata(self, time: int, permanent_energy_data):
         ## build energy data
         energy_data = pd.DataFrame(np.empty((time, 0)))
@@ -99,24 +131,78 @@ class SynTiSeD:
             self.__step(second)
 
         ## save action sequence ground truth
-        for key, resident in self.resident_dict.items():
-            save_path = save_action_sequence(resident.current_action_sequence, self.save_path, self.current_timestamp)
-            if self.save_active_phases:
-                save_apl_active_phases(save_path, '')
+        if self.save_data:
+            ## with several residents every resident has its own files, so the writers never write the same file
+            for key, resident in self.resident_dict.items():
+                avatar_name = key if len(self.resident_dict) > 1 else ''
+                self.output_writer.submit(save_action_sequence_files, resident.current_action_sequence,
+                                          self.save_path, self.current_timestamp, self.save_active_phases, avatar_name)
 
         ## build energy data
         energy_data_day = self.__build_energydata(self.simulation_time, permanent_energy_data)
         energy_data_day = energy_data_day.iloc[:self.simulation_time]
         energy_data_day = energy_data_day.round(3)
-        energy_data_day.to_csv(f'{self.save_path}/{date_obj}.csv')
+        if self.save_data:
+            self.output_writer.submit(save_energy_data, energy_data_day, f'{self.save_path}/{date_obj}.csv')
         print(f'Simulation of Day {date_obj} done!')
         self.current_timestamp = self.current_timestamp + self.simulation_time
         return energy_data_day
 
+    def iter_days(self):
+        """
+        Simulate the remaining days one after another and yield the energy data of every simulated day.
+
+        Returns
+        -------
+        generator : generator of pandas dataframes
+            yields the energy data of each day in a pandas dataframe of shape (86400, number of columns)
+        """
+        self.output_writer = OutputWriter(self.output_workers, self.output_queue_size, self.output_processes)
+        try:
+            for day in range(self.next_day, self.repetitions):
+                energy_data_day = self.__simulate_day(day)
+                self.next_day = day + 1
+                if self.checkpoint_path is not None and self.checkpoint_interval > 0 and \
+                        (self.next_day % self.checkpoint_interval == 0 or self.next_day == self.repetitions):
+                    ## the checkpoint must not be ahead of the written data
+                    self.output_writer.flush()
+                    save_checkpoint(self, self.checkpoint_path)
+                yield energy_data_day
+        except GeneratorExit:
+            raise
+        except BaseException:
+            ## an error of the remaining writes must not replace the error of the simulation
+            try:
+                self.output_writer.close()
+            except Exception:
+                pass
+            raise
+        finally:
+            self.output_writer.close()
+
+    def run_streaming(self, sink, include_appliances: bool = False, consumer=None):
+        """
+        Run the whole simulation and stream the smart meter readings in real time, where one wall-clock second
+        corresponds to simulation_speed simulated seconds.
+
+        Parameters
+        ----------
+        sink : QueueSink, TCPSink, UDPSink or FileSink
+            sink the readings are sent to, see Utils.realtime_stream
+
+        include_appliances : bool
+            optional, default = False; if True, the readings also contain the power of every appliance
+
+        consumer : coroutine function
+            coroutine function that is called with the queue of a QueueSink and reads the readings while they are
+            streamed; required for a QueueSink, which has no other consumer in the event loop of run_streaming
+        """
+        streamer = RealTimeStreamer({'household': self}, sink, self.simulation_speed, include_appliances)
+        asyncio.run(streamer.run(consumer))
+
     def run_simulation(self):
         print(' ')
-        for day in range(self.repetitions):
-            energy_data_day = self.__simulate_day(day)
+        for energy_data_day in self.iter_days():
             if self.plot_data:
                 plt.plot(energy_data_day)
                 plt.show()
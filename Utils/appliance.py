@@ -1,18 +1,19 @@
 import glob
 import pickle
 import random
-import requests
 import copy
 import sys
 import numpy as np
 import pandas as pd
 
+from Utils.pattern_service import get_default_client
+
 
 class ApplianceDictionary(dict):
     """
     Initialize a ApplianceDictionary from dict.
     """
-    def add_appliance(self, name, path):
+    def add_appliance(self, name, path, number=None, service=False, client=None):
         """
         Add an appliance with the given parameters to the ApplianceDictionary.
 
@@ -24,6 +25,15 @@ class ApplianceDictionary(dict):
         path : str
             resource path to power consumption pattern data
 
+        number : int
+            optional, default = None; number of power consumption patterns to be loaded
+
+        service : bool
+            optional, default = False; if True, the power consumption patterns are pulled from a pattern service
+
+        client : PatternServiceClient
+            optional; client of the pattern service, by default a shared client for http://localhost:5555/ is used
+
         """
         if name in self:
             print('Error: Appliance was not initialized correctly. '
@@ -31,7 +41,31 @@ class ApplianceDictionary(dict):
                   'Please choose another name.')
             sys.exit()
         else:
-            self[name] = _Appliance(name, path)
+            self[name] = _Appliance(name, path, number, service, client)
+
+    def add_service_appliances(self, appliances, number=None, client=None):
+        """
+        Add several appliances whose power consumption patterns are pulled from a pattern service.
+        The patterns of all appliances are pulled at once before the appliances are initialized.
+
+        Parameters
+        ----------
+        appliances : dict
+            dictionary with the appliance names as keys and the resource paths to the
+            power consumption pattern data as values; the resource paths are used if the service is not available
+
+        number : int
+            optional, default = None; number of power consumption patterns to be loaded per appliance
+
+        client : PatternServiceClient
+            optional; client of the pattern service, by default a shared client for http://localhost:5555/ is used
+
+        """
+        if client is None:
+            client = get_default_client()
+        client.fetch_many(list(appliances), number)
+        for name, path in appliances.items():
+            self.add_appliance(name, path, number, True, client)
 
     def add_permanent_appliance(self, name, path):
         """
@@ -57,7 +91,7 @@ class ApplianceDictionary(dict):
 
 
 class _Appliance:
-    def __init__(self, name, path, number=None, service=False):
+    def __init__(self, name, path, number=None, service=False, client=None, refill_threshold=2):
         """
         Initialize an appliance with the given parameters.
 
@@ -76,17 +110,33 @@ class _Appliance:
             optional, default = False; if True, a check is made to see if a service is
             available for the appliance at http://localhost:5555/
             and if so, energy data is loaded into that endpoint.
+
+        client : PatternServiceClient
+            optional; client of the pattern service, by default a shared client for http://localhost:5555/ is used
+
+        refill_threshold : int
+            optional, default = 2; if service is True and only this number of unused power consumption patterns
+            is left, new patterns are pulled from the service in the background
         """
         self.name = name
         self.path = path
         self.number = number
         self.power_consumption_pattern = pd.DataFrame()
+        self.client = None
+        self.refill_threshold = refill_threshold
+        self._refill_future = None
+        ## if False, new patterns are pulled when all loaded patterns have been used, set by SynTiSeD for a seed
+        self.refill_in_background = True
+        ## random number generator of the appliance, replaced by the one of the household in SynTiSeD
+        self.random = random.Random(random.getrandbits(32))
 
         if service:
+            self.client = client if client is not None else get_default_client()
             try:
                 self.data = self.get_data_from_service()
                 print('--> using synthetic ' + str(self.name) + ' data')
-            except:
+            except Exception:
+                self.client = None
                 self.data = self.load_data()
                 print('--> using real ' + str(self.name) + ' data')
         else:
@@ -130,14 +180,10 @@ class _Appliance:
             returns power consumption data in a pandas dataframe of shape (number, max_pattern_lenght)
         """
         try:
-            r = requests.post('http://localhost:5555/' + str(self.name), json={'number': self.number})
-            data = pd.DataFrame.from_dict(r.json())
-            data = pd.DataFrame(data.to_numpy())
-            print('pulled ' + str(self.name) + ' data')
-            return data
-        except:
+            return self.client.fetch(self.name, self.number)
+        except Exception:
             print('failed pulling ' + str(self.name) + ' data')
-            return self.data
+            raise
 
     def load_data(self):
         """
@@ -150,7 +196,7 @@ class _Appliance:
         """
         with open(self.path, 'rb') as fp:
             data = pickle.load(fp)
-            if data.shape[0] > self.number:
+            if self.number is not None and data.shape[0] > self.number:
                 ## get x random samples of df
                 data = data.sample(n=self.number)
         return data
@@ -165,13 +211,41 @@ class _Appliance:
         bool : pandas dataframe
             returns power consumption pattern in a pandas dataframe of shape (pattern_lenght, 1)
         """
+        if self.client is not None:
+            self.refill_from_service()
         if not self.temp_pick_list:
             self.temp_pick_list = list(range(self.data.shape[0]))
-        number = random.choice(self.temp_pick_list)
+        number = self.random.choice(self.temp_pick_list)
         self.temp_pick_list.remove(number)
         power_consumption_pattern = pd.DataFrame(self.data.iloc[number].transpose())
         return power_consumption_pattern
 
+    def refill_from_service(self):
+        """
+        Pull new power consumption patterns from the service in the background if only a few unused patterns are
+        left, and replace the loaded dataset with them as soon as all loaded patterns have been used.
+        Without refill_in_background, the patterns are pulled directly when all loaded patterns have been used.
+        """
+        if not self.refill_in_background:
+            ## the dataset is always replaced at the same pick, so a seeded simulation does not depend on the timing
+            if not self.temp_pick_list:
+                try:
+                    self.data = self.client.fetch(self.name, self.number, use_cache=False)
+                    self.temp_pick_list = list(range(self.data.shape[0]))
+                except Exception:
+                    print('failed pulling ' + str(self.name) + ' data')
+            return
+        if self._refill_future is None:
+            if len(self.temp_pick_list) <= self.refill_threshold:
+                self._refill_future = self.client.refill_async(self.name, self.number)
+        elif not self.temp_pick_list and self._refill_future.done():
+            try:
+                self.data = self._refill_future.result()
+                self.temp_pick_list = list(range(self.data.shape[0]))
+            except Exception:
+                print('failed pulling ' + str(self.name) + ' data')
+            self._refill_future = None
+
     def refresh_power_consumption_pattern(self):
         self.power_consumption_pattern = pd.DataFrame()
 
@@ -193,6 +267,8 @@ class _PermanentAppliance:
         self.filepath_list = glob.glob(path + '*.csv')
         self.temp_filepath_list = copy.deepcopy(self.filepath_list)
         self.random_filepath = ''
+        ## random number generator of the appliance, replaced by the one of the household in SynTiSeD
+        self.np_random = np.random.RandomState(np.random.randint(2 ** 31))
         self.data = pd.DataFrame()
         self.power_consumption_pattern = pd.DataFrame()
         print('--> ' + str(self.name) + ' data loaded')
@@ -204,7 +280,7 @@ class _PermanentAppliance:
         """
         if not self.temp_filepath_list:
             self.temp_filepath_list = copy.deepcopy(self.filepath_list)
-        self.random_filepath = np.random.choice(self.temp_filepath_list, 1)[0]
+        self.random_filepath = self.np_random.choice(self.temp_filepath_list, 1)[0]
         self.temp_filepath_list.remove(self.random_filepath)
         self.data = pd.read_csv(self.random_filepath, header=None)
         self.power_consumption_pattern = self.data
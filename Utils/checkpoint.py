@@ -0,0 +1,113 @@
+import os
+import sys
+import gzip
+import pickle
+import tempfile
+
+CHECKPOINT_VERSION = 1
+
+
+def save_checkpoint(syntised, filepath: str):
+    """
+    Save the full state of a simulation between two simulated days to a checkpoint file.
+    The file is written to a temporary file first and then moved, so an existing checkpoint
+    is never left half written.
+
+    Parameters
+    ----------
+    syntised : SynTiSeD
+        simulator whose state is stored
+
+    filepath : str
+        path of the checkpoint file
+    """
+    appliance_keys = {id(appliance): key for key, appliance in syntised.appliance_dict.items()}
+    state = {
+        'version': CHECKPOINT_VERSION,
+        'next_day': syntised.next_day,
+        'current_timestamp': syntised.current_timestamp,
+        'used_appliances': [appliance_keys[id(appliance)] for appliance in syntised.used_appliance_list],
+        'appliances': {key: {'power_consumption_pattern': appliance.power_consumption_pattern,
+                             'temp_pick_list': appliance.temp_pick_list,
+                             ## patterns pulled from a service can change during the simulation
+                             'data': appliance.data if appliance.client is not None else None}
+                       for key, appliance in syntised.appliance_dict.items()},
+        'permanent_appliances': {key: {'temp_filepath_list': appliance.temp_filepath_list,
+                                       'random_filepath': appliance.random_filepath}
+                                 for key, appliance in syntised.permanent_appliance_dict.items()},
+        'residents': {key: {'current_action_sequence': resident.current_action_sequence,
+                            'action_seq_iterator': resident.action_seq_iterator,
+                            'next_appliances_to_activate': [appliance_keys[id(appliance)] for appliance
+                                                            in resident.next_appliances_to_activate]}
+                      for key, resident in syntised.resident_dict.items()},
+        'random_state': syntised.random.getstate(),
+        'numpy_random_state': syntised.np_random.get_state(),
+    }
+
+    directory = os.path.dirname(os.path.abspath(filepath))
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.checkpoint_', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as raw_file:
+            with gzip.GzipFile(fileobj=raw_file, mode='wb') as fp:
+                pickle.dump(state, fp, protocol=pickle.HIGHEST_PROTOCOL)
+            raw_file.flush()
+            os.fsync(raw_file.fileno())
+        os.replace(temp_path, filepath)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def load_checkpoint(syntised, filepath: str):
+    """
+    Restore the state of a simulation from a checkpoint file written by save_checkpoint.
+    The simulator has to be initialized with the same appliances, permanent appliances and residents
+    as the simulation the checkpoint was taken from.
+
+    Parameters
+    ----------
+    syntised : SynTiSeD
+        simulator whose state is restored
+
+    filepath : str
+        path of the checkpoint file
+    """
+    with gzip.open(filepath, 'rb') as fp:
+        state = pickle.load(fp)
+
+    if state.get('version') != CHECKPOINT_VERSION:
+        print(f'Error: Checkpoint "{filepath}" has version {state.get("version")}, '
+              f'but version {CHECKPOINT_VERSION} is required.')
+        sys.exit()
+    for dict_name, saved_keys in [('appliance_dict', state['appliances']),
+                                  ('permanent_appliance_dict', state['permanent_appliances']),
+                                  ('resident_dict', state['residents'])]:
+        if set(getattr(syntised, dict_name)) != set(saved_keys):
+            print(f'Error: Checkpoint "{filepath}" does not match the {dict_name} of the simulation.')
+            sys.exit()
+
+    for key, appliance_state in state['appliances'].items():
+        appliance = syntised.appliance_dict[key]
+        appliance.power_consumption_pattern = appliance_state['power_consumption_pattern']
+        appliance.temp_pick_list = appliance_state['temp_pick_list']
+        if appliance_state['data'] is not None:
+            appliance.data = appliance_state['data']
+    for key, appliance_state in state['permanent_appliances'].items():
+        appliance = syntised.permanent_appliance_dict[key]
+        appliance.temp_filepath_list = appliance_state['temp_filepath_list']
+        appliance.random_filepath = appliance_state['random_filepath']
+    for key, resident_state in state['residents'].items():
+        resident = syntised.resident_dict[key]
+        resident.current_action_sequence = resident_state['current_action_sequence']
+        resident.action_seq_iterator = resident_state['action_seq_iterator']
+        resident.next_appliances_to_activate = [syntised.appliance_dict[name] for name
+                                                in resident_state['next_appliances_to_activate']]
+
+    syntised.used_appliance_list = [syntised.appliance_dict[key] for key in state['used_appliances']]
+    syntised.current_timestamp = state['current_timestamp']
+    syntised.next_day = state['next_day']
+    syntised.random.setstate(state['random_state'])
+    syntised.np_random.set_state(state['numpy_random_state'])
+    print(f'Resuming simulation from checkpoint "{filepath}" at day {syntised.next_day}')
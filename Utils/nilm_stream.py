@@ -0,0 +1,119 @@
+import numpy as np
+import pandas as pd
+from nilmtk.prefetch import Prefetcher
+
+
+class NilmChunkStream(Prefetcher):
+    def __init__(self, syntised, appliances: list, days_per_chunk: int = 1, sample_period: int = 1,
+                 prefetch: int = 2, mains_column: str = 'smartMeter'):
+        """
+        Initialize a stream that converts the days simulated by SynTiSeD into training chunks
+        in the format expected by the partial_fit method of the nilmtk_contrib *_val disaggregators.
+        The simulation runs on a background thread, which stays at most prefetch chunks ahead of the consumer.
+
+        Parameters
+        ----------
+        syntised : SynTiSeD
+            simulator whose days are streamed; set save_data=False to avoid writing intermediate files
+
+        appliances : list
+            names of the appliances that are returned as submeters; appliances that were not used
+            on a simulated day are returned with zero power
+
+        days_per_chunk : int
+            optional, default = 1; number of simulated days that are combined to one chunk
+
+        sample_period : int
+            optional, default = 1; sample period in seconds the chunks are resampled to
+
+        prefetch : int
+            optional, default = 2; maximum number of chunks that are simulated ahead of the consumer
+
+        mains_column : str
+            optional, default = 'smartMeter'; column of the simulated data that is used as mains
+        """
+        super().__init__(prefetch)
+        self.syntised = syntised
+        self.appliances = list(appliances)
+        self.days_per_chunk = days_per_chunk
+        self.sample_period = sample_period
+        self.prefetch = prefetch
+        self.mains_column = mains_column
+
+    def __iter__(self):
+        """
+        Iterate over the simulated chunks.
+
+        Returns
+        -------
+        generator : generator of tuples
+            yields tuples (mains, appliances), where mains is a list with one pandas dataframe and
+            appliances is a list of tuples (appliance name, list with one pandas dataframe)
+        """
+        return super().__iter__()
+
+    def produce(self):
+        days = []
+        for energy_data_day in self.syntised.iter_days():
+            days.append(energy_data_day)
+            if len(days) == self.days_per_chunk:
+                yield self.to_chunk(pd.concat(days, axis=0))
+                days = []
+        if days:
+            yield self.to_chunk(pd.concat(days, axis=0))
+
+    def to_chunk(self, energy_data: pd.DataFrame):
+        """
+        Convert simulated energy data to the input format of the *_val disaggregators.
+
+        Parameters
+        ----------
+        energy_data : pandas dataframe
+            simulated energy data as returned by SynTiSeD.iter_days
+
+        Returns
+        -------
+        chunk : tuple
+            tuple (mains, appliances), where mains is a list with one pandas dataframe and
+            appliances is a list of tuples (appliance name, list with one pandas dataframe)
+        """
+        if self.sample_period > 1:
+            energy_data = energy_data.resample(f'{self.sample_period}s').mean()
+        mains = energy_data[[self.mains_column]].astype('float32')
+        submeters = []
+        for appliance in self.appliances:
+            if appliance in energy_data.columns:
+                appliance_df = energy_data[[appliance]].astype('float32')
+            else:
+                appliance_df = pd.DataFrame(np.zeros(len(energy_data), dtype='float32'),
+                                            index=energy_data.index, columns=[appliance])
+            submeters.append((appliance, [appliance_df]))
+        return [mains], submeters
+
+
+def fit_from_stream(clf, stream, validate_main, validate_appliances):
+    """
+    Train a nilmtk_contrib *_val disaggregator chunk by chunk on a stream of simulated data.
+    While the disaggregator trains on one chunk, the stream already simulates the next ones.
+
+    Parameters
+    ----------
+    clf : Disaggregator
+        disaggregator with a partial_fit(train_main, train_appliances, validate_main, validate_appliances) method
+
+    stream : NilmChunkStream
+        stream of training chunks
+
+    validate_main : list
+        list of pandas dataframes with the mains of the validation data
+
+    validate_appliances : list
+        list of tuples (appliance name, list of pandas dataframes) with the validation data
+    """
+    if getattr(clf, 'training_jobs', 1) > 1:
+        raise ValueError('training_jobs > 1 can not be used to train chunk by chunk on a stream')
+    for chunk_number, (train_main, train_appliances) in enumerate(stream):
+        print(f'Training {clf.MODEL_NAME} on simulated chunk {chunk_number}')
+        clf.partial_fit(train_main, train_appliances, validate_main, validate_appliances)
+    if hasattr(clf, 'end_training'):
+        clf.end_training()
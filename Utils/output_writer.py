@@ -0,0 +1,136 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+
+class OutputWriter:
+    def __init__(self, workers: int = 1, queue_size: int = 4, use_processes: bool = False):
+        """
+        Initialize an asynchronous output stage. Write jobs are executed by a pool of writer threads
+        or processes, so the simulation of the next day overlaps with writing the previous one.
+
+        Parameters
+        ----------
+        workers : int
+            optional, default = 1; number of writer threads or processes; if 0, every job is executed
+            directly in the calling thread
+
+        queue_size : int
+            optional, default = 4; maximum number of jobs waiting for a writer; if the queue is full,
+            submit blocks until a writer is free again
+
+        use_processes : bool
+            optional, default = False; if True, the jobs are executed in writer processes instead of threads.
+            Jobs and their arguments must then be picklable.
+        """
+        self.workers = workers
+        self.queue_size = queue_size
+        self.use_processes = use_processes
+
+        self._executor = None
+        if workers > 0:
+            if use_processes:
+                self._executor = ProcessPoolExecutor(max_workers=workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='OutputWriter')
+        self._slots = threading.BoundedSemaphore(max(1, queue_size) + max(0, workers))
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._written_paths = []
+        self._error = None
+        self._closed = False
+
+    def submit(self, job, *args, **kwargs):
+        """
+        Submit a write job. Errors of previously submitted jobs are raised here.
+
+        Parameters
+        ----------
+        job : callable
+            function that writes the output; it should return the path or a list of paths it has written,
+            which are synced to disk when the writer is flushed
+
+        args, kwargs
+            arguments passed to the job
+        """
+        self._raise_error()
+        if self._closed:
+            raise RuntimeError('OutputWriter is already closed.')
+        if self._executor is None:
+            self._store_paths(job(*args, **kwargs))
+            return
+
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(job, *args, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(self._job_done)
+
+    def flush(self):
+        """
+        Wait until all submitted jobs are done and sync the written files to disk.
+        Errors of the submitted jobs are raised here.
+        """
+        while True:
+            with self._lock:
+                pending = list(self._pending)
+            if not pending:
+                break
+            for future in pending:
+                try:
+                    future.result()
+                except BaseException:
+                    pass
+        self._raise_error()
+
+        with self._lock:
+            written_paths, self._written_paths = self._written_paths, []
+        for path in written_paths:
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def close(self):
+        """
+        Flush all outstanding jobs and shut the writers down.
+        """
+        if self._closed:
+            return
+        try:
+            self.flush()
+        finally:
+            self._closed = True
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+
+    def _job_done(self, future):
+        try:
+            self._store_paths(future.result())
+        except BaseException as e:
+            with self._lock:
+                if self._error is None:
+                    self._error = e
+        finally:
+            with self._lock:
+                self._pending.discard(future)
+            self._slots.release()
+
+    def _store_paths(self, paths):
+        if paths is None:
+            return
+        if isinstance(paths, (str, os.PathLike)):
+            paths = [paths]
+        with self._lock:
+            self._written_paths.extend(paths)
+
+    def _raise_error(self):
+        with self._lock:
+            error, self._error = self._error, None
+        if error is not None:
+            raise error
@@ -0,0 +1,236 @@
+import os
+import json
+import atexit
+import pickle
+import hashlib
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+import pandas as pd
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+
+def get_default_client():
+    """
+    Get the pattern service client that is shared by all appliances which do not get their own client.
+
+    Returns
+    -------
+    client : PatternServiceClient
+        shared client for http://localhost:5555/
+    """
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = PatternServiceClient()
+            atexit.register(_default_client.close)
+        return _default_client
+
+
+class PatternServiceClient:
+    def __init__(self, url: str = 'http://localhost:5555/', timeout: float = 10, cache_dir: str = None,
+                 max_workers: int = 8):
+        """
+        Initialize a client for a power consumption pattern service.
+        The client reuses pooled connections, fetches the patterns of several appliances at once
+        and caches the responses in memory and optionally on disk.
+
+        Parameters
+        ----------
+        url : str
+            optional, default = 'http://localhost:5555/'; base url of the service; the patterns of an appliance
+            are requested with a POST request to url + appliance name, the name '_batch' is reserved for
+            batched requests
+
+        timeout : float
+            optional, default = 10; timeout of a request in seconds
+
+        cache_dir : str
+            optional; folder where responses are cached, keyed by url, appliance name and request parameters
+
+        max_workers : int
+            optional, default = 8; number of pooled connections and concurrent requests
+        """
+        self.url = url if url.endswith('/') else url + '/'
+        self.timeout = timeout
+        self.cache_dir = cache_dir
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='PatternService')
+        self._memory_cache = {}
+        self._lock = threading.Lock()
+
+    def cache_key(self, name: str, number: int = None):
+        """
+        Build the cache key of a request.
+
+        Parameters
+        ----------
+        name : str
+            name of the appliance
+
+        number : int
+            number of requested power consumption patterns
+
+        Returns
+        -------
+        key : str
+            hash of url, appliance name and request parameters
+        """
+        key = json.dumps({'url': self.url, 'name': name, 'number': number}, sort_keys=True)
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def fetch(self, name: str, number: int = None, use_cache: bool = True):
+        """
+        Get power consumption patterns of an appliance from the service.
+
+        Parameters
+        ----------
+        name : str
+            name of the appliance
+
+        number : int
+            optional; number of power consumption patterns to be requested
+
+        use_cache : bool
+            optional, default = True; if False, new patterns are requested and the cache is updated
+
+        Returns
+        -------
+        data : pandas dataframe
+            power consumption data in a pandas dataframe of shape (number, max_pattern_lenght)
+        """
+        key = self.cache_key(name, number)
+        if use_cache:
+            data = self._read_cache(key)
+            if data is not None:
+                return data
+        r = self.session.post(self.url + str(name), json={'number': number}, timeout=self.timeout)
+        r.raise_for_status()
+        data = self._to_dataframe(r.json())
+        self._write_cache(key, data)
+        print('pulled ' + str(name) + ' data')
+        return data
+
+    def fetch_many(self, names: list, number: int = None):
+        """
+        Get power consumption patterns of several appliances. Appliances that are not cached yet are requested
+        with one batched request to url + '_batch'; if the service does not support batches,
+        they are requested concurrently.
+
+        Parameters
+        ----------
+        names : list
+            names of the appliances
+
+        number : int
+            optional; number of power consumption patterns to be requested per appliance
+
+        Returns
+        -------
+        data : dict
+            dictionary with the appliance names as keys and the power consumption data as values;
+            appliances that could not be pulled are missing
+        """
+        result = {}
+        missing = []
+        for name in names:
+            data = self._read_cache(self.cache_key(name, number))
+            if data is None:
+                missing.append(name)
+            else:
+                result[name] = data
+        if not missing:
+            return result
+
+        try:
+            r = self.session.post(self.url + '_batch', timeout=self.timeout,
+                                  json={'appliances': [{'name': name, 'number': number} for name in missing]})
+            r.raise_for_status()
+            for name, json_data in r.json().items():
+                data = self._to_dataframe(json_data)
+                self._write_cache(self.cache_key(name, number), data)
+                result[name] = data
+            print('pulled ' + ', '.join(missing) + ' data')
+            return result
+        except (requests.RequestException, ValueError):
+            pass
+
+        futures = {name: self._executor.submit(self.fetch, name, number) for name in missing}
+        for name, future in futures.items():
+            try:
+                result[name] = future.result()
+            except (requests.RequestException, ValueError):
+                print('failed pulling ' + str(name) + ' data')
+        return result
+
+    def refill_async(self, name: str, number: int = None):
+        """
+        Request new power consumption patterns of an appliance in the background.
+
+        Parameters
+        ----------
+        name : str
+            name of the appliance
+
+        number : int
+            optional; number of power consumption patterns to be requested
+
+        Returns
+        -------
+        future : concurrent.futures.Future
+            future of the new power consumption data
+        """
+        return self._executor.submit(self.fetch, name, number, False)
+
+    def close(self):
+        """
+        Close the pooled connections and stop the background requests.
+        """
+        self._executor.shutdown(wait=False)
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _read_cache(self, key: str):
+        with self._lock:
+            if key in self._memory_cache:
+                return self._memory_cache[key]
+        if self.cache_dir is None:
+            return None
+        path = os.path.join(self.cache_dir, key + '.pkl')
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as fp:
+            data = pickle.load(fp)
+        with self._lock:
+            self._memory_cache[key] = data
+        return data
+
+    def _write_cache(self, key: str, data: pd.DataFrame):
+        with self._lock:
+            self._memory_cache[key] = data
+        if self.cache_dir is None:
+            return
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as fp:
+            pickle.dump(data, fp, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, os.path.join(self.cache_dir, key + '.pkl'))
+
+    @staticmethod
+    def _to_dataframe(json_data):
+        data = pd.DataFrame.from_dict(json_data)
+        return pd.DataFrame(data.to_numpy())
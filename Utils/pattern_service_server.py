@@ -0,0 +1,123 @@
+import json
+import pickle
+import random
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import unquote
+
+try:
+    from Utils.syntised_utils import ROOT_DIR
+except ImportError:
+    from syntised_utils import ROOT_DIR
+
+
+class PatternService:
+    def __init__(self, libraries: dict, host: str = 'localhost', port: int = 5555):
+        """
+        Initialize a local stand-in for the power consumption pattern service, which serves existing
+        pattern libraries, so the service mode of the appliances can be used and tested offline.
+
+        Parameters
+        ----------
+        libraries : dict
+            dictionary with the appliance names as keys and the resource paths to the
+            power consumption pattern data as values
+
+        host : str
+            optional, default = 'localhost'; host the service is bound to
+
+        port : int
+            optional, default = 5555; port the service is bound to; if 0, a free port is chosen
+        """
+        self.libraries = libraries
+        self._data = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+        service = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                try:
+                    request = json.loads(self.rfile.read(length) or b'{}')
+                    name = unquote(self.path.strip('/'))
+                    ## '_batch' is reserved for batched requests, so it cannot be the name of an appliance
+                    if name == '_batch':
+                        response = {item['name']: service.get_patterns(item['name'], item.get('number'))
+                                    for item in request['appliances']}
+                    else:
+                        response = service.get_patterns(name, request.get('number'))
+                except KeyError as e:
+                    self.send_error(404, f'Unknown appliance {e}')
+                    return
+                except ValueError as e:
+                    self.send_error(400, str(e))
+                    return
+                body = json.dumps(response).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), _Handler)
+        self.url = f'http://{self.server.server_address[0]}:{self.server.server_address[1]}/'
+
+    def get_patterns(self, name: str, number: int = None):
+        """
+        Get a number of randomly chosen power consumption patterns of an appliance in the response format of the service.
+
+        Parameters
+        ----------
+        name : str
+            name of the appliance
+
+        number : int
+            optional; number of power consumption patterns; if None, all patterns are returned
+
+        Returns
+        -------
+        patterns : dict
+            dictionary with one list of values per time step of the power consumption patterns
+        """
+        with self._lock:
+            if name not in self._data:
+                with open(self.libraries[name], 'rb') as fp:
+                    self._data[name] = pickle.load(fp)
+            data = self._data[name]
+        if number is not None and data.shape[0] > number:
+            data = data.iloc[sorted(random.sample(range(data.shape[0]), number))]
+        return {str(column): data[column].tolist() for column in data.columns}
+
+    def start(self):
+        """
+        Start serving in a background thread.
+        """
+        self._thread = threading.Thread(target=self.server.serve_forever, name='PatternService', daemon=True)
+        self._thread.start()
+        print(f'Pattern service running at {self.url}')
+
+    def stop(self):
+        """
+        Stop serving and close the socket.
+        """
+        self.server.shutdown()
+        self.server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+
+if __name__ == '__main__':
+    appl_resource_path = ROOT_DIR + '/Resources/ApplianceData/GeLaP_Data/hh_04/'
+    service = PatternService({'coffee machine': appl_resource_path + 'CoffeeMachine/df_zero_filled',
+                              'kettle': appl_resource_path + 'Kettle/df_zero_filled',
+                              'microwave': appl_resource_path + 'Microwave/df_zero_filled',
+                              'washing machine': appl_resource_path + 'WashingMachine/df_zero_filled'})
+    try:
+        service.server.serve_forever()
+    except KeyboardInterrupt:
+        service.stop()
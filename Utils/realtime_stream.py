@@ -0,0 +1,215 @@
+import json
+import asyncio
+import numpy as np
+
+
+class QueueSink:
+    def __init__(self, queue: asyncio.Queue = None, maxsize: int = 100000):
+        """
+        Initialize a sink that puts every reading as dictionary into an asyncio queue.
+        The streaming waits while the queue is full, and None is put into the queue when the stream ends.
+
+        Parameters
+        ----------
+        queue : asyncio.Queue
+            optional; queue the readings are put into, by default a new queue with maxsize entries is created
+
+        maxsize : int
+            optional, default = 100000; maximum number of readings in the queue created by the sink
+        """
+        self.queue = queue if queue is not None else asyncio.Queue(maxsize=maxsize)
+
+    async def open(self):
+        pass
+
+    async def send(self, readings: list):
+        for reading in readings:
+            await self.queue.put(reading)
+
+    async def close(self):
+        ## marks the end of the stream for the consumer
+        await self.queue.put(None)
+
+
+class TCPSink:
+    def __init__(self, host: str, port: int):
+        """
+        Initialize a sink that sends every reading as json line over a tcp connection.
+
+        Parameters
+        ----------
+        host : str
+            host of the receiving service
+
+        port : int
+            port of the receiving service
+        """
+        self.host = host
+        self.port = port
+        self._writer = None
+
+    async def open(self):
+        _, self._writer = await asyncio.open_connection(self.host, self.port)
+
+    async def send(self, readings: list):
+        self._writer.write(''.join(json.dumps(reading) + '\n' for reading in readings).encode('utf-8'))
+        await self._writer.drain()
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            await self._writer.wait_closed()
+
+
+class UDPSink:
+    def __init__(self, host: str, port: int):
+        """
+        Initialize a sink that sends every reading as json datagram over udp.
+
+        Parameters
+        ----------
+        host : str
+            host of the receiving service
+
+        port : int
+            port of the receiving service
+        """
+        self.host = host
+        self.port = port
+        self._transport = None
+
+    async def open(self):
+        loop = asyncio.get_running_loop()
+        self._transport, _ = await loop.create_datagram_endpoint(asyncio.DatagramProtocol,
+                                                                 remote_addr=(self.host, self.port))
+
+    async def send(self, readings: list):
+        for reading in readings:
+            self._transport.sendto(json.dumps(reading).encode('utf-8'))
+
+    async def close(self):
+        if self._transport is not None:
+            self._transport.close()
+
+
+class FileSink:
+    def __init__(self, path: str):
+        """
+        Initialize a sink that appends every reading as json line to a file, which can be followed with tail -f.
+
+        Parameters
+        ----------
+        path : str
+            path of the file
+        """
+        self.path = path
+        self._file = None
+
+    async def open(self):
+        self._file = open(self.path, 'a')
+
+    async def send(self, readings: list):
+        self._file.write(''.join(json.dumps(reading) + '\n' for reading in readings))
+        self._file.flush()
+
+    async def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+class RealTimeStreamer:
+    def __init__(self, households: dict, sink, simulation_speed: float = None, include_appliances: bool = False,
+                 max_batch_delay: float = 0.01):
+        """
+        Initialize a streamer that emits the smart meter readings of several simulated households
+        at wall-clock speed multiplied by the simulation speed.
+        The send times are scheduled from one common start time, so delays of single sends do not add up.
+
+        Parameters
+        ----------
+        households : dict
+            dictionary with the household names as keys and SynTiSeD simulators as values
+
+        sink : QueueSink, TCPSink, UDPSink or FileSink
+            sink the readings are sent to; every object with async open, send(readings) and close methods can be used
+
+        simulation_speed : float
+            optional; number of simulated seconds per wall-clock second, by default the
+            simulation_speed of every household is used
+
+        include_appliances : bool
+            optional, default = False; if True, the readings also contain the power of every appliance
+
+        max_batch_delay : float
+            optional, default = 0.01; readings that become due within this number of wall-clock seconds are sent together
+        """
+        self.households = households
+        self.sink = sink
+        self.simulation_speed = simulation_speed
+        self.include_appliances = include_appliances
+        self.max_batch_delay = max_batch_delay
+
+        self.sent_readings = 0
+        self.max_lag = 0.0
+
+    async def run(self, consumer=None):
+        """
+        Stream all remaining days of all households to the sink.
+
+        Parameters
+        ----------
+        consumer : coroutine function
+            coroutine function that is called with the queue of a QueueSink and runs alongside the streaming,
+            until it has read the None that marks the end of the stream; required for a QueueSink, whose bounded
+            queue would otherwise block the streaming once it is full
+        """
+        if isinstance(self.sink, QueueSink) and consumer is None:
+            raise ValueError('A QueueSink needs a consumer that reads its queue while the readings are streamed')
+        loop = asyncio.get_running_loop()
+        consumer_task = asyncio.ensure_future(consumer(self.sink.queue)) if consumer is not None else None
+        await self.sink.open()
+        try:
+            ## the first day of every household is simulated before the common start time is set
+            first_timestamps = {name: syntised.current_timestamp for name, syntised in self.households.items()}
+            days = {name: syntised.iter_days() for name, syntised in self.households.items()}
+            first_days = await asyncio.gather(*[loop.run_in_executor(None, next, days[name], None)
+                                                for name in self.households])
+            start_time = loop.time()
+            await asyncio.gather(*[self._stream_household(name, days[name], first_day, first_timestamps[name],
+                                                          start_time)
+                                   for name, first_day in zip(self.households, first_days)])
+        finally:
+            await self.sink.close()
+        if consumer_task is not None:
+            await consumer_task
+        duration = loop.time() - start_time
+        print(f'Streamed {self.sent_readings} readings in {duration:.1f}s '
+              f'({self.sent_readings / max(duration, 1e-9):.0f} readings/s, maximum lag {self.max_lag * 1000:.1f}ms)')
+
+    async def _stream_household(self, name: str, days, energy_data_day, first_timestamp: float, start_time: float):
+        loop = asyncio.get_running_loop()
+        syntised = self.households[name]
+        speed = self.simulation_speed if self.simulation_speed is not None else syntised.simulation_speed
+        while energy_data_day is not None:
+            ## the next day is simulated in the background while the current one is streamed
+            next_day = loop.run_in_executor(None, next, days, None)
+
+            timestamps = energy_data_day.index.asi8 // 10 ** 9
+            deadlines = start_time + (timestamps - first_timestamp) / speed
+            columns = list(energy_data_day.columns) if self.include_appliances else ['smartMeter']
+            values = energy_data_day[columns].to_numpy(dtype=float)
+
+            position = 0
+            while position < len(deadlines):
+                now = loop.time()
+                if deadlines[position] > now:
+                    await asyncio.sleep(deadlines[position] - now)
+                    now = loop.time()
+                end = int(np.searchsorted(deadlines, now + self.max_batch_delay, side='right'))
+                readings = [dict(zip(columns, row), household=name, timestamp=int(timestamp))
+                            for timestamp, row in zip(timestamps[position:end], values[position:end].tolist())]
+                await self.sink.send(readings)
+                self.max_lag = max(self.max_lag, loop.time() - deadlines[position])
+                self.sent_readings += end - position
+                position = end
+            energy_data_day = await next_day
@@ -58,6 +58,8 @@ class _Resident:
 
         self.current_action_sequence = []
         self.action_seq_iterator = 0
+        ## random number generator of the resident, replaced by the one of the household in SynTiSeD
+        self.random = random.Random(random.getrandbits(32))
 
         self.next_appliances_to_activate = []
 
@@ -125,12 +127,12 @@ class _Resident:
             top_level_variance = self.variance
 
         for action in list(action_seq):
-            if action.probability >= random.uniform(0, 1):
+            if action.probability >= self.random.uniform(0, 1):
                 if top_level_variance is None:
                     variance = action.variance
                 else:
                     variance = top_level_variance
-                action.start_timestamp = action.start_timestamp + random.randint(-variance, variance)
+                action.start_timestamp = action.start_timestamp + self.random.randint(-variance, variance)
             else:
                 action_seq.remove(action)
         ## sort actions by their timestamps in case
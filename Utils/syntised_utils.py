@@ -84,5 +84,61 @@ def save_apl_active_phases(input_filepath: str, output_filepath: str, resampling
 
     file_name = Path(input_filepath).stem
     parent_folder = Path(input_filepath).parent.parent
-    df.to_csv(f'{parent_folder}/ActionSeq_active_phases/{file_name}_active_phases.csv')
+    path = f'{parent_folder}/ActionSeq_active_phases/{file_name}_active_phases.csv'
+    df.to_csv(path)
+    return path
+
+
+def save_action_sequence_files(action_seq: list, filepath: str, timestamp: int, save_active_phases: bool = False,
+                               avatar_name: str = ''):
+    """
+    Save an action sequence of a day and optionally the active phases of its appliances
+
+    Parameters
+    ----------
+    action_seq : list
+        list with a sequence of actions
+
+    filepath : str
+        path to the folder where the data is stored
+
+    timestamp : int
+        00:00:00 timestamp of the stored day
+
+    save_active_phases : bool
+        if True, the active phases of the appliances are saved as well
+
+    avatar_name : str
+        name of the resident; optional, if set resident name part of file name
+
+    Returns
+    -------
+    paths : list
+        paths of the written files
+    """
+    paths = [save_action_sequence(action_seq, filepath, timestamp, avatar_name)]
+    if save_active_phases:
+        paths.append(save_apl_active_phases(paths[0], ''))
+    return paths
+
+
+def save_energy_data(energy_data: pd.DataFrame, path: str):
+    """
+    Save the energy data of a simulated day as csv file
+
+    Parameters
+    ----------
+    energy_data : pandas dataframe
+        energy data of the simulated day
+
+    path : str
+        path of the csv file
+
+    Returns
+    -------
+    path : str
+        path of the written file
+    """
+    energy_data.to_csv(path)
+    return path
 
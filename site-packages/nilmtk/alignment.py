@@ -0,0 +1,98 @@
+import numpy as np
+import pandas as pd
+
+
+def align_readings(mains_df, appliance_dfs=[], dropna=True, artificial_aggregate=False):
+    """
+    Aligns the mains and appliance readings of a building on the index of the mains.
+    All readings are copied once into a single 2-D float32 array and the returned dataframes are views of it.
+
+    mains_df: dataframe with the mains readings
+    appliance_dfs: list of dataframes with the appliance readings
+    dropna: if True, the timestamps with a missing value in the mains or in any appliance are removed,
+            based on a single validity mask of the array
+    artificial_aggregate: if True, the mains are replaced by the sum of the appliance readings
+
+    Returns the aligned mains dataframe and the list of aligned appliance dataframes.
+    """
+    appliance_dfs = [unique_index(app_df) for app_df in appliance_dfs]
+    artificial_aggregate = artificial_aggregate and len(appliance_dfs) > 0
+    if artificial_aggregate:
+        # Meters without readings have no columns, their rows are dropped or missing anyway, so the columns of the
+        # aggregate are those of the first appliance with readings
+        reference = next((app_df for app_df in appliance_dfs if len(app_df.columns) > 0), appliance_dfs[0])
+        for app_df in appliance_dfs:
+            if len(app_df.columns) not in (0, len(reference.columns)):
+                raise ValueError("The artificial aggregate needs the same columns for all appliances, got {} and {}"
+                                 .format(list(reference.columns), list(app_df.columns)))
+    if artificial_aggregate and not dropna:
+        # Without dropping missing values, the aggregate keeps the timestamps of the first appliance with readings
+        index = reference.index
+    else:
+        index = unique_index(mains_df).index
+    frames = [unique_index(mains_df)] + appliance_dfs
+
+    # Column offsets of the frames in the array
+    offsets = np.cumsum([0] + [len(frame.columns) for frame in frames])
+    n_aggregate_columns = len(reference.columns) if artificial_aggregate else 0
+    values = np.empty((len(index), offsets[-1] + n_aggregate_columns), dtype=np.float32, order='F')
+
+    valid = np.ones(len(index), dtype=bool)
+    for frame, start, end in zip(frames, offsets[:-1], offsets[1:]):
+        if end == start:
+            # A meter without readings, e.g. after the end of its data
+            valid[:] = False
+            continue
+        if frame.index.equals(index):
+            values[:, start:end] = frame.values
+        else:
+            indexer = frame.index.get_indexer(index)
+            found = indexer >= 0
+            values[found, start:end] = frame.values[indexer[found]]
+            values[~found, start:end] = np.nan
+            valid &= found
+
+    if dropna:
+        # Only rows that are complete in all frames are kept. The rows are compacted column by column,
+        # so only one additional column is held in memory.
+        valid &= ~np.isnan(values[:, :offsets[-1]]).any(axis=1)
+        n_valid = int(valid.sum())
+        if n_valid < len(index):
+            for column in range(offsets[-1]):
+                values[:n_valid, column] = values[valid, column]
+            values = values[:n_valid]
+            index = index[valid]
+
+    if artificial_aggregate:
+        aggregate = values[:, offsets[-1]:]
+        aggregate[:] = 0
+        for start, end in zip(offsets[1:-1], offsets[2:]):
+            if end > start:
+                # Missing readings, which are only kept without dropna, count as zero like in a sum of the meters
+                readings = values[:, start:end]
+                np.add(aggregate, readings, out=aggregate, where=~np.isnan(readings))
+        mains_df = pd.DataFrame(aggregate, index=index, columns=reference.columns, copy=False)
+    else:
+        mains_df = pd.DataFrame(values[:, offsets[0]:offsets[1]], index=index, columns=frames[0].columns, copy=False)
+
+    new_appliances_list = [pd.DataFrame(values[:, start:end], index=index, columns=frame.columns, copy=False)
+                           for frame, start, end in zip(appliance_dfs, offsets[1:-1], offsets[2:])]
+    return mains_df, new_appliances_list
+
+
+def unique_index(df):
+    """
+    Returns the dataframe with only the first reading of every timestamp.
+    """
+    if df.index.is_unique:
+        return df
+    return df[~df.index.duplicated()]
+
+
+def writeable_frame(df):
+    """
+    Returns the dataframe, or a copy of it if its values are read-only, e.g. memory mapped from the cache.
+    """
+    if df.values.flags.writeable:
+        return df
+    return df.copy()
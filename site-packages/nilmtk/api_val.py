@@ -1,10 +1,20 @@
 from nilmtk.dataset import DataSet
 from nilmtk.metergroup import MeterGroup
+from nilmtk.chunk_pipeline import AlignedChunkStream
+from nilmtk.building_loader import BuildingPrefetcher
+from nilmtk.alignment import align_readings, writeable_frame
+from nilmtk.metrics import MetricAccumulator, ACCUMULATED_METRICS, appliance_moments
+from nilmtk.array_cache import ArrayCache, file_signature
+from nilmtk.model_registry import ModelRegistry
+from nilmtk.chunked_inference import disaggregate_in_chunks
+from nilmtk.profiler import StageProfiler
+from nilmtk.prediction_pool import PredictionPool, limit_backend_threads
 import pandas as pd
 from nilmtk.losses import *
 import numpy as np
 import matplotlib.pyplot as plt
 import datetime
+from collections import deque
 from IPython.display import clear_output
 
 
@@ -43,7 +53,33 @@ class API_val():
         self.display_predictions = params.get('display_predictions', False)
         self.DROP_ALL_NANS = params.get("DROP_ALL_NANS", True)
         self.site_only = params.get('site_only', False)
-        self.experiment()
+        self.prefetch_depth = params.get('prefetch_depth', 1)
+        self.chunk_timings = []
+        self.n_jobs = params.get('n_jobs', 1)
+        self.parallel_backend = params.get('parallel_backend', 'thread')
+        self.threads_per_worker = params.get('threads_per_worker', None)
+        self.inference_chunk_size = params.get('inference_chunk_size', None)
+        # If profile is True, the profiler records time and memory of the stages and prints a report after the
+        # experiment, which is also saved if a profile_path is given. It is on by default if a profile_path or
+        # profile_sinks are given.
+        self.profile_path = params.get('profile_path', None)
+        profile = params.get('profile', bool(self.profile_path or params.get('profile_sinks', None)))
+        self.profiler = StageProfiler(profile, params.get('profile_memory', False), params.get('profile_sinks', None))
+        if self.parallel_backend == 'thread' and self.threads_per_worker:
+            # The models share the process, so the limit has to be set before they are built
+            limit_backend_threads(self.threads_per_worker, self.n_jobs)
+        self.datasets = {}
+        self.joint_data = {}
+        self.cache = None
+        if params.get('cache_dir', None):
+            self.cache = ArrayCache(params['cache_dir'], params.get('cache_size', 10 * 1024 ** 3))
+        # Trained models are saved in the registry and loaded instead of training them again on the same data
+        self.registry = None
+        if params.get('model_registry', None):
+            self.registry = ModelRegistry(params['model_registry'])
+        # A sweep creates the API without running the experiment and trains the classifiers itself
+        if params.get('run_experiment', True):
+            self.experiment()
 
     def experiment(self):
         """
@@ -65,6 +101,14 @@ class API_val():
                     print(clf.MODEL_NAME, " is loading the pretrained model")
                     continue
 
+            registry_key = None
+            if self.registry is not None and ModelRegistry.supports(clf):
+                registry_key = self.registry.key(clf, train=self.describe_data(d), validate=self.describe_data(d_val),
+                                                 chunk_size=self.chunk_size)
+                if self.registry.load(clf, registry_key):
+                    print(clf.MODEL_NAME, " is loading the model from the registry")
+                    continue
+
             # if user wants to train chunk wise
             if self.chunk_size:
                 # If the classifier supports chunk wise training
@@ -78,8 +122,16 @@ class API_val():
                         n_epochs = 1
                     # Training on those many chunks for those many epochs
                     print("Chunk wise training for ", clf.MODEL_NAME)
+                    if hasattr(clf, 'set_appliance_params') and len(clf.appliance_params) == 0:
+                        # The normalization is computed from all training chunks, not only from the first one
+                        self.compute_appliance_params(clf, d)
                     for i in range(n_epochs):
                         self.train_chunk_wise(clf, d, i)
+                        # The validation data is streamed in chunks as well after every epoch
+                        if hasattr(clf, 'end_epoch') and clf.end_epoch(self.validate_chunk_wise(clf, d_val)):
+                            break
+                    if hasattr(clf, 'end_training'):
+                        clf.end_training()
 
                 else:
                     print("Joint training for ", clf.MODEL_NAME)
@@ -90,9 +142,13 @@ class API_val():
                 print("Joint training for ", clf.MODEL_NAME)
                 self.train_jointly(clf, d, d_val)
 
+            if registry_key is not None:
+                self.registry.save(clf, registry_key)
+
             print("Finished training for ", clf.MODEL_NAME)
             clear_output()
 
+        self.clear_joint_data()
         d = self.test_datasets_dict
 
         if self.chunk_size:
@@ -104,110 +160,110 @@ class API_val():
             print("Joint Testing for all algorithms")
             self.test_jointly(d)
 
+        self.close_datasets()
+        if self.profiler.enabled:
+            print(self.profiler.summary())
+            if self.profile_path:
+                self.profiler.save(self.profile_path)
+
     def train_chunk_wise(self, clf, d, current_epoch):
         """
         This function loads the data from buildings and datasets with the specified chunk size and trains on each of them. 
         """
 
+        for dataset, building, train_mains, train_appliances in self.iterate_chunks(d, 'training'):
+            print("Starting enumeration..........")
+            self.train_mains = train_mains
+            self.train_submeters = train_appliances
+            # The classifier keeps its models and optimizer state from chunk to chunk, the validation is done
+            # on the streamed validation chunks after the epoch
+            with self.profiler.stage('fit', dataset, building, clf.MODEL_NAME):
+                clf.partial_fit(self.train_mains, self.train_submeters, [], [])
+
+        print("...............Finished the Training Process ...................")
+
+    def compute_appliance_params(self, clf, d):
+        """
+        Computes the normalization parameters of the appliances in one streaming pass over the training chunks.
+        """
+        moments = None
+        for dataset, building, train_mains, train_appliances in self.iterate_chunks(d, 'normalization'):
+            moments = appliance_moments(train_appliances, moments)
+        if moments is not None:
+            clf.set_appliance_params([], moments=moments)
+
+    def validate_chunk_wise(self, clf, d_val):
+        """
+        Returns the validation loss of a classifier on the validation data, which is evaluated chunk by chunk,
+        or None if there is no validation data.
+        """
+        losses = {}
+        for dataset, building, validate_mains, validate_appliances in self.iterate_chunks(d_val, 'validation'):
+            with self.profiler.stage('validate', dataset, building, clf.MODEL_NAME):
+                chunk_losses = clf.evaluate_chunk(validate_mains, validate_appliances)
+            for appliance_name, (loss_sum, count) in chunk_losses.items():
+                total_sum, total_count = losses.get(appliance_name, (0.0, 0))
+                losses[appliance_name] = (total_sum + loss_sum, total_count + count)
+        if not losses:
+            return None
+        # Like the loss of a network with several outputs, the mean losses of the appliances are added up
+        loss = sum(loss_sum / count for loss_sum, count in losses.values())
+        print("Validation loss of ", clf.MODEL_NAME, ": ", loss)
+        return loss
+
+    def iterate_chunks(self, d, purpose):
+        """
+        Yields the dataset, the building and the aligned mains and appliance readings of every chunk of the buildings
+        in d, in the lists that partial_fit expects. The next chunks are read while the current one is used.
+        """
         for dataset in d:
             # Loading the dataset
             print("Loading data for ", dataset, " dataset")
             for building in d[dataset]['buildings']:
                 # Loading the building
-                train = DataSet(d[dataset]['path'])
+                data = self.get_dataset(d[dataset]['path'])
                 print("Loading building ... ", building)
-                train.set_window(start=d[dataset]['buildings'][building]['start_time'],
-                                 end=d[dataset]['buildings'][building]['end_time'])
-                mains_iterator = train.buildings[building].elec.mains().load(chunksize=self.chunk_size,
-                                                                             physical_quantity='power',
-                                                                             ac_type=self.power['mains'],
-                                                                             sample_period=self.sample_period)
-                appliance_iterators = [
-                    train.buildings[building].elec[app_name].load(chunksize=self.chunk_size, physical_quantity='power',
-                                                                  ac_type=self.power['appliance'],
-                                                                  sample_period=self.sample_period) for app_name in
-                    self.appliances]
-                print(train.buildings[building].elec.mains())
-                for chunk_num, chunk in enumerate(train.buildings[building].elec.mains().load(chunksize=self.chunk_size,
-                                                                                              physical_quantity='power',
-                                                                                              ac_type=self.power[
-                                                                                                  'mains'],
-                                                                                              sample_period=self.sample_period)):
-                    # Loading the chunk for the specifeid building
-                    # Dummry loop for executing on outer level. Just for looping till end of a chunk
-                    print("Starting enumeration..........")
-                    train_df = next(mains_iterator)
-                    appliance_readings = []
-                    for i in appliance_iterators:
-                        try:
-                            appliance_df = next(i)
-                        except StopIteration:
-                            appliance_df = pd.DataFrame()
-                        appliance_readings.append(appliance_df)
-
-                    if self.DROP_ALL_NANS:
-                        train_df, appliance_readings = self.dropna(train_df, appliance_readings)
-
-                    if self.artificial_aggregate:
-                        print("Creating an Artificial Aggregate")
-                        train_df = pd.DataFrame(np.zeros(appliance_readings[0].shape),
-                                                index=appliance_readings[0].index,
-                                                columns=appliance_readings[0].columns)
-                        for app_reading in appliance_readings:
-                            train_df += app_reading
-                    train_appliances = []
-
+                data.set_window(start=d[dataset]['buildings'][building]['start_time'],
+                                end=d[dataset]['buildings'][building]['end_time'])
+                stream = AlignedChunkStream(data.buildings[building].elec, self.appliances, self.chunk_size,
+                                            self.power, self.sample_period, self.prefetch_depth)
+                for chunk_num, mains_df, appliance_readings in stream:
+                    with self.profiler.stage('align', dataset, building):
+                        mains_df, appliance_readings = self.align(mains_df, appliance_readings)
+                    appliances = []
                     for cnt, i in enumerate(appliance_readings):
-                        train_appliances.append((self.appliances[cnt], [i]))
-
-                    self.train_mains = [train_df]
-                    self.train_submeters = train_appliances
-                    clf.partial_fit(self.train_mains, self.train_submeters, current_epoch)
-
-        print("...............Finished the Training Process ...................")
+                        appliances.append((self.appliances[cnt], [i]))
+                    yield dataset, building, [mains_df], appliances
+                self.store_chunk_timings(stream, purpose, dataset, building)
 
     def test_chunk_wise(self, d):
 
         print("...............Started  the Testing Process ...................")
 
+        # The workers of the parallel predictions are started once for all chunks
+        pool = self.start_prediction_pool()
+        try:
+            self.test_chunks(d, pool)
+        finally:
+            if pool is not None:
+                pool.close()
+
+    def test_chunks(self, d, pool=None):
+        """
+        Predicts and evaluates the test data of the datasets in d chunk by chunk, in the pool if one is given.
+        """
         for dataset in d:
             print("Loading data for ", dataset, " dataset")
             for building in d[dataset]['buildings']:
-                test = DataSet(d[dataset]['path'])
+                test = self.get_dataset(d[dataset]['path'])
                 test.set_window(start=d[dataset]['buildings'][building]['start_time'],
                                 end=d[dataset]['buildings'][building]['end_time'])
-                mains_iterator = test.buildings[building].elec.mains().load(chunksize=self.chunk_size,
-                                                                            physical_quantity='power',
-                                                                            ac_type=self.power['mains'],
-                                                                            sample_period=self.sample_period)
-                appliance_iterators = [
-                    test.buildings[building].elec[app_name].load(chunksize=self.chunk_size, physical_quantity='power',
-                                                                 ac_type=self.power['appliance'],
-                                                                 sample_period=self.sample_period) for app_name in
-                    self.appliances]
-                for chunk_num, chunk in enumerate(
-                        test.buildings[building].elec.mains().load(chunksize=self.chunk_size, physical_quantity='power',
-                                                                   ac_type=self.power['mains'],
-                                                                   sample_period=self.sample_period)):
-                    test_df = next(mains_iterator)
-                    appliance_readings = []
-                    for i in appliance_iterators:
-                        try:
-                            appliance_df = next(i)
-                        except StopIteration:
-                            appliance_df = pd.DataFrame()
-
-                        appliance_readings.append(appliance_df)
-
-                    if self.DROP_ALL_NANS:
-                        test_df, appliance_readings = self.dropna(test_df, appliance_readings)
-
-                    if self.artificial_aggregate:
-                        print("Creating an Artificial Aggregate")
-                        test_df = pd.DataFrame(np.zeros(appliance_readings[0].shape), index=appliance_readings[0].index,
-                                               columns=appliance_readings[0].columns)
-                        for app_reading in appliance_readings:
-                            test_df += app_reading
+                stream = AlignedChunkStream(test.buildings[building].elec, self.appliances, self.chunk_size,
+                                            self.power, self.sample_period, self.prefetch_depth)
+                building_metrics = None
+                for chunk_num, test_df, appliance_readings in stream:
+                    with self.profiler.stage('align', dataset, building):
+                        test_df, appliance_readings = self.align(test_df, appliance_readings)
 
                     test_appliances = []
 
@@ -220,163 +276,270 @@ class API_val():
                                                                                                        building=building,
                                                                                                        chunk_num=chunk_num))
                     self.storing_key = str(dataset) + "_" + str(building) + "_" + str(chunk_num)
-                    self.call_predict(self.classifiers, test.metadata['timezone'])
+                    accumulator = self.call_predict(self.classifiers, test.metadata['timezone'], dataset, building,
+                                                    pool)
+                    if accumulator is not None:
+                        if building_metrics is None:
+                            building_metrics = accumulator
+                        else:
+                            building_metrics.merge(accumulator)
+
+                if building_metrics is not None:
+                    # The merged sums give the scores of the whole building
+                    print("Results for Dataset {dataset} Building {building}".format(dataset=dataset, building=building))
+                    self.storing_key = str(dataset) + "_" + str(building)
+                    for metric in self.metrics:
+                        if metric in ACCUMULATED_METRICS:
+                            self.store_error(metric, building_metrics.result(metric))
+                self.store_chunk_timings(stream, 'testing', dataset, building)
+
+    def store_chunk_timings(self, stream, purpose, dataset, building):
+        """
+        Keeps the read, wait and processing times of the chunks of a building, so it can be seen
+        whether loading or the classifiers are the bottleneck of an experiment.
+        """
+        for timing in stream.timings:
+            self.chunk_timings.append(dict(timing, purpose=purpose, dataset=dataset, building=building))
 
     def train_jointly(self, clf, d, d_val):
 
-        # This function has a few issues, which should be addressed soon
+        # The training and validation data is loaded only once per experiment and shared by all classifiers
         print("............... Loading Data for training ...................")
-        # store the train_main readings for all buildings
-        self.train_mains = []
-        self.train_submeters = [[] for i in range(len(self.appliances))]
+        train_mains, train_submeters = self.load_jointly(d, 'training')
+        validate_mains, validate_submeters = self.load_jointly(d_val, 'validation')
+
+        # Every classifier gets its own lists, the dataframes in them are shared and must be treated as read-only
+        train_mains = list(train_mains)
+        train_submeters = [(appliance_name, list(dfs)) for appliance_name, dfs in train_submeters]
+        validate_mains = list(validate_mains)
+        validate_submeters = [(appliance_name, list(dfs)) for appliance_name, dfs in validate_submeters]
+        do_preprocessing = True
+
+        if self.cache is not None and hasattr(clf, 'call_preprocessing'):
+            # The windowed and normalized data of the model is taken from the cache if it was computed before
+            if hasattr(clf, 'appliance_params') and len(clf.appliance_params) == 0:
+                clf.set_appliance_params(train_submeters)
+            train_mains, train_submeters = self.preprocess(clf, d, train_mains, train_submeters)
+            validate_mains, validate_submeters = self.preprocess(clf, d_val, validate_mains, validate_submeters)
+            do_preprocessing = False
+
+        self.train_mains, self.train_submeters = train_mains, train_submeters
+        self.validate_mains, self.validate_submeters = validate_mains, validate_submeters
+        # The local lists are passed on, so classifiers trained in parallel threads on one API_val do not mix them up
+        # The joint training is labelled with all of its datasets and buildings
+        datasets = ", ".join(str(dataset) for dataset in d)
+        buildings = ", ".join(str(building) for dataset in d for building in d[dataset]['buildings'])
+        with self.profiler.stage('fit', datasets, buildings, clf.MODEL_NAME):
+            if do_preprocessing:
+                clf.partial_fit(train_mains, train_submeters, validate_mains, validate_submeters)
+            else:
+                clf.partial_fit(train_mains, train_submeters, validate_mains, validate_submeters,
+                                do_preprocessing=False)
+        # The trained models are converted and saved once, after the training
+        if hasattr(clf, 'end_training'):
+            clf.end_training()
+
+    def preprocess(self, clf, d, mains, submeters):
+        """
+        Returns the training data of the datasets in d after the preprocessing of the classifier.
+        The result is cached on disk, keyed by the data and the preprocessing parameters of the classifier.
+        """
+        key = self.cache.key(data=self.describe_data(d), model=self.describe_preprocessing(clf), method='train')
+        frames = self.cache.get_frames(key)
+        if frames is None:
+            with self.profiler.stage('preprocess', classifier=clf.MODEL_NAME):
+                mains, submeters = clf.call_preprocessing(mains, submeters, 'train')
+            self.cache.put_frames(key, list(mains) + [df for appliance_name, dfs in submeters for df in dfs])
+            return mains, submeters
+
+        print("Using cached preprocessed data for", clf.MODEL_NAME)
+        new_mains = frames[:len(mains)]
+        new_submeters = []
+        position = len(mains)
+        for appliance_name, dfs in submeters:
+            new_submeters.append((appliance_name, frames[position:position + len(dfs)]))
+            position += len(dfs)
+        return new_mains, new_submeters
+
+    def describe_data(self, d):
+        """
+        Describes the data loaded for the datasets in d, including the state of the files.
+        """
+        buildings = []
         for dataset in d:
-            print("Loading training data for ", dataset, " dataset")
-            train = DataSet(d[dataset]['path'])
             for building in d[dataset]['buildings']:
-                print("Loading building ... ", building)
-                train.set_window(start=d[dataset]['buildings'][building]['start_time'],
-                                 end=d[dataset]['buildings'][building]['end_time'])
-                train_df = next(
-                    train.buildings[building].elec.mains().load(physical_quantity='power', ac_type=self.power['mains'],
-                                                                sample_period=self.sample_period))
-                train_df = train_df[[list(train_df.columns)[0]]]
-                appliance_readings = []
-
-                for appliance_name in self.appliances:
-                    appliance_df = next(train.buildings[building].elec[appliance_name].load(physical_quantity='power',
-                                                                                            ac_type=self.power[
-                                                                                                'appliance'],
-                                                                                            sample_period=self.sample_period))
-                    appliance_df = appliance_df[[list(appliance_df.columns)[0]]]
-                    appliance_readings.append(appliance_df)
-
-                if self.DROP_ALL_NANS:
-                    train_df, appliance_readings = self.dropna(train_df, appliance_readings)
-
-                if self.artificial_aggregate:
-                    print("Creating an Artificial Aggregate")
-                    train_df = pd.DataFrame(np.zeros(appliance_readings[0].shape), index=appliance_readings[0].index,
-                                            columns=appliance_readings[0].columns)
-                    for app_reading in appliance_readings:
-                        train_df += app_reading
-
-                self.train_mains.append(train_df)
-                for i, appliance_name in enumerate(self.appliances):
-                    self.train_submeters[i].append(appliance_readings[i])
-
-        appliance_readings = []
-        for i, appliance_name in enumerate(self.appliances):
-            appliance_readings.append((appliance_name, self.train_submeters[i]))
-
-        self.train_submeters = appliance_readings
-
-        ## ----- new for validation -----
-        self.validate_mains = []
-        self.validate_submeters = [[] for i in range(len(self.appliances))]
-        for dataset in d_val:
-            print("Loading validation data for ", dataset, " dataset")
-            validate = DataSet(d_val[dataset]['path'])
-            for building in d_val[dataset]['buildings']:
-                print("Loading building ... ", building)
-                validate.set_window(start=d_val[dataset]['buildings'][building]['start_time'],
-                                 end=d_val[dataset]['buildings'][building]['end_time'])
-                validate_df = next(
-                    validate.buildings[building].elec.mains().load(physical_quantity='power', ac_type=self.power['mains'],
-                                                                sample_period=self.sample_period))
-                validate_df = validate_df[[list(validate_df.columns)[0]]]
-                val_appliance_readings = []
-
-                for appliance_name in self.appliances:
-                    appliance_df = next(validate.buildings[building].elec[appliance_name].load(physical_quantity='power',
-                                                                                            ac_type=self.power[
-                                                                                                'appliance'],
-                                                                                            sample_period=self.sample_period))
-                    appliance_df = appliance_df[[list(appliance_df.columns)[0]]]
-                    val_appliance_readings.append(appliance_df)
-
-                if self.DROP_ALL_NANS:
-                    validate_df, val_appliance_readings = self.dropna(validate_df, val_appliance_readings)
-
-                if self.artificial_aggregate:
-                    print("Creating an Artificial Aggregate")
-                    validate_df = pd.DataFrame(np.zeros(appliance_readings[0].shape), index=appliance_readings[0].index,
-                                            columns=appliance_readings[0].columns)
-                    for app_reading in appliance_readings:
-                        validate_df += app_reading
-
-                self.validate_mains.append(validate_df)
-                for i, appliance_name in enumerate(self.appliances):
-                    self.validate_submeters[i].append(val_appliance_readings[i])
+                buildings.append([d[dataset]['path'], file_signature(d[dataset]['path']), building,
+                                  d[dataset]['buildings'][building]['start_time'],
+                                  d[dataset]['buildings'][building]['end_time']])
+        return {'buildings': buildings, 'appliances': self.appliances, 'power': self.power,
+                'sample_period': self.sample_period, 'DROP_ALL_NANS': self.DROP_ALL_NANS,
+                'artificial_aggregate': self.artificial_aggregate}
+
+    def describe_preprocessing(self, clf):
+        """
+        Returns the parameters of a classifier that its preprocessing depends on.
+        """
+        description = {'class': type(clf).__name__}
+        for attribute in ('MODEL_NAME', 'sequence_length', 'mains_mean', 'mains_std', 'max_val', 'appliance_params'):
+            if hasattr(clf, attribute):
+                description[attribute] = getattr(clf, attribute)
+        return description
 
-        val_appliance_readings = []
-        for i, appliance_name in enumerate(self.appliances):
-            val_appliance_readings.append((appliance_name, self.validate_submeters[i]))
+    def load_readings(self, path, building, start, end, appliance=None):
+        """
+        Loads the readings of the mains, or of an appliance, of a building in the given time window.
+        If a cache_dir is specified, the loaded and resampled readings are cached on disk.
+        """
+        ac_type = self.power['mains'] if appliance is None else self.power['appliance']
+        if self.cache is not None:
+            key = self.cache.key(path=path, file=file_signature(path), building=building, start=start, end=end,
+                                 sample_period=self.sample_period, ac_type=ac_type, appliance=appliance)
+            frames = self.cache.get_frames(key)
+            if frames is not None:
+                return frames[0]
+
+        data = self.get_dataset(path)
+        data.set_window(start=start, end=end)
+        elec = data.buildings[building].elec
+        meter = elec.mains() if appliance is None else elec[appliance]
+        readings = next(meter.load(physical_quantity='power', ac_type=ac_type, sample_period=self.sample_period))
+        if self.cache is not None:
+            self.cache.put_frames(key, [readings])
+        return readings
+
+    def load_jointly(self, d, purpose):
+        """
+        Loads the mains and appliance readings of all buildings of the datasets in d at once. The result is kept
+        until clear_joint_data is called, so the data is read and aligned only once for all classifiers.
+        """
+        key = (purpose, repr(d))
+        if key in self.joint_data:
+            return self.joint_data[key]
+
+        mains_list = []
+        submeters = [[] for i in range(len(self.appliances))]
+        print("Loading", purpose, "data for ", ", ".join(str(dataset) for dataset in d), " dataset")
+        # The next building is read while the current one is aligned
+        loader = BuildingPrefetcher(lambda dataset, building: self.load_building(d, dataset, building, True),
+                                    [(dataset, building) for dataset in d for building in d[dataset]['buildings']],
+                                    self.prefetch_depth)
+        for dataset, building, (mains_df, appliance_readings, timezone) in loader:
+            print("Loading building ... ", building)
+            with self.profiler.stage('align', dataset, building):
+                mains_df, appliance_readings = self.align(mains_df, appliance_readings)
+            mains_list.append(mains_df)
+            for i, appliance_name in enumerate(self.appliances):
+                submeters[i].append(appliance_readings[i])
+
+        submeters = [(appliance_name, submeters[i]) for i, appliance_name in enumerate(self.appliances)]
+        self.joint_data[key] = (mains_list, submeters)
+        return mains_list, submeters
+
+    def clear_joint_data(self):
+        """
+        Releases the data loaded by load_jointly
+        """
+        self.joint_data = {}
 
-        self.validate_submeters = val_appliance_readings
-        ## ----- new for validation -----
+    def close_datasets(self):
+        """
+        Closes the pooled DataSet handles
+        """
+        for dataset in self.datasets.values():
+            if hasattr(dataset, 'store'):
+                dataset.store.close()
+        self.datasets = {}
 
-        clf.partial_fit(self.train_mains, self.train_submeters, self.validate_mains, self.validate_submeters)
+    def get_dataset(self, path):
+        """
+        Returns an open DataSet for the given path. The handles are pooled, so every file is opened only once.
+        """
+        if path not in self.datasets:
+            self.datasets[path] = DataSet(path)
+        return self.datasets[path]
 
     def test_jointly(self, d):
-        # store the test_main readings for all buildings
-        for dataset in d:
-            print("Loading data for ", dataset, " dataset")
-            test = DataSet(d[dataset]['path'])
-            for building in d[dataset]['buildings']:
-                test.set_window(start=d[dataset]['buildings'][building]['start_time'],
-                                end=d[dataset]['buildings'][building]['end_time'])
-                test_mains = next(
-                    test.buildings[building].elec.mains().load(physical_quantity='power', ac_type=self.power['mains'],
-                                                               sample_period=self.sample_period))
+        # The predictions of at most n_jobs buildings are pending at a time, their metrics follow in order
+        pending = deque()
+        pool = self.start_prediction_pool()
+        # The next building is read while the classifiers predict the current one
+        loader = BuildingPrefetcher(lambda dataset, building: self.load_building(d, dataset, building),
+                                    [(dataset, building) for dataset in d for building in d[dataset]['buildings']],
+                                    self.prefetch_depth)
+        try:
+            for dataset, building, (test_mains, appliance_readings, timezone) in loader:
+                print("Loading data for ", dataset, " dataset, building ", building)
                 if self.DROP_ALL_NANS and self.site_only:
                     test_mains, _ = self.dropna(test_mains, [])
+                elif self.site_only:
+                    test_mains = writeable_frame(test_mains)
 
+                self.test_submeters = []
                 if self.site_only != True:
-                    appliance_readings = []
-
-                    for appliance in self.appliances:
-                        test_df = next((test.buildings[building].elec[appliance].load(physical_quantity='power',
-                                                                                      ac_type=self.power['appliance'],
-                                                                                      sample_period=self.sample_period)))
-                        appliance_readings.append(test_df)
-
-                    if self.DROP_ALL_NANS:
-                        test_mains, appliance_readings = self.dropna(test_mains, appliance_readings)
-
-                    if self.artificial_aggregate:
-                        print("Creating an Artificial Aggregate")
-                        test_mains = pd.DataFrame(np.zeros(appliance_readings[0].shape),
-                                                  index=appliance_readings[0].index,
-                                                  columns=appliance_readings[0].columns)
-                        for app_reading in appliance_readings:
-                            test_mains += app_reading
+                    with self.profiler.stage('align', dataset, building):
+                        test_mains, appliance_readings = self.align(test_mains, appliance_readings)
                     for i, appliance_name in enumerate(self.appliances):
                         self.test_submeters.append((appliance_name, [appliance_readings[i]]))
 
                 self.test_mains = [test_mains]
                 self.storing_key = str(dataset) + "_" + str(building)
-                self.call_predict(self.classifiers, test.metadata["timezone"])
+                if pool is not None:
+                    # The building is predicted while the next ones are loaded
+                    job = (self.storing_key, self.test_mains, self.test_submeters, timezone, dataset, building)
+                    pending.append((job, pool.submit(*job[1:])))
+                    while len(pending) > self.n_jobs:
+                        job, futures = pending.popleft()
+                        self.evaluate_job(self.classifiers, job, [future.result() for future in futures])
+                else:
+                    self.call_predict(self.classifiers, timezone, dataset, building)
+
+            while pending:
+                job, futures = pending.popleft()
+                self.evaluate_job(self.classifiers, job, [future.result() for future in futures])
+        finally:
+            if pool is not None:
+                pool.close()
+
+    def load_building(self, d, dataset, building, first_column=False):
+        """
+        Loads the mains and, unless site_only is set, the appliance readings of a building, and the timezone of
+        its dataset. If first_column is True, only the first column of every meter is kept.
+        """
+        path = d[dataset]['path']
+        window = (path, building, d[dataset]['buildings'][building]['start_time'],
+                  d[dataset]['buildings'][building]['end_time'])
+        with self.profiler.stage('load', dataset, building):
+            mains_df = self.load_readings(*window)
+            appliance_readings = []
+            if not self.site_only or first_column:
+                for appliance_name in self.appliances:
+                    appliance_readings.append(self.load_readings(*window, appliance=appliance_name))
+            timezone = self.get_dataset(path).metadata['timezone']
+        if first_column:
+            mains_df = mains_df[[list(mains_df.columns)[0]]]
+            appliance_readings = [appliance_df[[list(appliance_df.columns)[0]]] for appliance_df in appliance_readings]
+        return mains_df, appliance_readings, timezone
 
     def dropna(self, mains_df, appliance_dfs=[]):
         """
         Drops the missing values in the Mains reading and appliance readings and returns consistent data by copmuting the intersection
         """
         print("Dropping missing values")
+        return align_readings(mains_df, appliance_dfs)
 
-        # The below steps are for making sure that data is consistent by doing intersection across appliances
-        mains_df = mains_df.dropna()
-        ix = mains_df.index
-        mains_df = mains_df.loc[ix]
-        for i in range(len(appliance_dfs)):
-            appliance_dfs[i] = appliance_dfs[i].dropna()
-
-        for app_df in appliance_dfs:
-            ix = ix.intersection(app_df.index)
-        mains_df = mains_df.loc[ix]
-        new_appliances_list = []
-        for app_df in appliance_dfs:
-            new_appliances_list.append(app_df.loc[ix])
-        return mains_df, new_appliances_list
+    def align(self, mains_df, appliance_dfs):
+        """
+        Drops the missing values and creates the artificial aggregate, as specified in the params,
+        in a single alignment of the mains and appliance readings
+        """
+        if not (self.DROP_ALL_NANS or self.artificial_aggregate):
+            # The readings are passed on without a copy, except the read-only ones from the cache
+            return writeable_frame(mains_df), [writeable_frame(app_df) for app_df in appliance_dfs]
+        if self.DROP_ALL_NANS:
+            print("Dropping missing values")
+        if self.artificial_aggregate:
+            print("Creating an Artificial Aggregate")
+        return align_readings(mains_df, appliance_dfs, self.DROP_ALL_NANS, self.artificial_aggregate)
 
     def store_classifier_instances(self):
 
@@ -393,25 +556,83 @@ class API_val():
                 print("\n\nThe method {model_name} specied does not exist. \n\n".format(model_name=name))
                 print(e)
 
-    def call_predict(self, classifiers, timezone):
+    def start_prediction_pool(self):
+        """
+        Returns a started PredictionPool of the classifiers if n_jobs > 1, or None. It has to be closed by the caller.
+        """
+        if self.n_jobs <= 1:
+            return None
+        pool = PredictionPool(self, self.classifiers, self.n_jobs, self.parallel_backend, self.threads_per_worker)
+        pool.start()
+        return pool
+
+    def call_predict(self, classifiers, timezone, dataset=None, building=None, pool=None):
 
         """
         This functions computers the predictions on the self.test_mains using all the trained models and then compares different learn't models using the metrics specified
+        If a started PredictionPool is given, the classifiers predict in its workers.
         """
 
+        if pool is not None:
+            job = (self.storing_key, self.test_mains, self.test_submeters, timezone, dataset, building)
+            return self.evaluate_job(classifiers, job, [future.result() for future in pool.submit(*job[1:])])
+        if self.n_jobs > 1:
+            return self.call_predict_parallel(classifiers, [(self.storing_key, self.test_mains, self.test_submeters,
+                                                             timezone, dataset, building)])[0]
+
         pred_overall = {}
         gt_overall = {}
         for name, clf in classifiers:
             gt_overall, pred_overall[name] = self.predict(clf, self.test_mains, self.test_submeters, self.sample_period,
-                                                          timezone)
+                                                          timezone, dataset, building)
+        with self.profiler.stage('metrics', dataset, building):
+            return self.evaluate_predictions(classifiers, gt_overall, pred_overall)
+
+    def call_predict_parallel(self, classifiers, jobs):
+        """
+        Computes the predictions of all (test data, classifier) pairs concurrently with n_jobs workers.
+        The metrics are computed afterwards in the order of the test data and classifiers,
+        so self.errors and self.errors_keys are the same as in a sequential run.
+        jobs: list of (storing_key, test_mains, test_submeters, timezone, dataset, building) tuples
+        Returns the metric accumulators of the jobs.
+        """
+        pool = PredictionPool(self, classifiers, self.n_jobs, self.parallel_backend, self.threads_per_worker)
+        results = pool.predict([job[1:] for job in jobs])
+        return [self.evaluate_job(classifiers, job, predictions) for job, predictions in zip(jobs, results)]
 
+    def evaluate_job(self, classifiers, job, predictions):
+        """
+        Computes the metrics of the (gt_overall, pred_overall) predictions of the classifiers on the test data of a
+        (storing_key, test_mains, test_submeters, timezone, dataset, building) job and returns the metric accumulator.
+        """
+        storing_key, self.test_mains, self.test_submeters, _, dataset, building = job
+        self.storing_key = storing_key
+        pred_overall = {}
+        gt_overall = {}
+        for (name, clf), (gt, pred) in zip(classifiers, predictions):
+            gt_overall = gt
+            pred_overall[name] = pred
+        with self.profiler.stage('metrics', dataset, building):
+            return self.evaluate_predictions(classifiers, gt_overall, pred_overall)
+
+    def evaluate_predictions(self, classifiers, gt_overall, pred_overall):
+        """
+        Compares the predictions of the classifiers with the ground truth using the specified metrics
+        """
         self.gt_overall = gt_overall
         self.pred_overall = pred_overall
+        accumulator = None
         if self.site_only != True:
             if gt_overall.size == 0:
                 print("No samples found in ground truth")
                 return None
+            # All classifiers and appliances are evaluated in one pass
+            accumulator = MetricAccumulator([clf_name for clf_name, clf in classifiers], gt_overall.columns)
+            accumulator.update(gt_overall, pred_overall)
             for metric in self.metrics:
+                if metric in ACCUMULATED_METRICS:
+                    self.store_error(metric, accumulator.result(metric))
+                    continue
                 try:
                     loss_function = globals()[metric]
                 except:
@@ -421,11 +642,7 @@ class API_val():
                 computed_metric = {}
                 for clf_name, clf in classifiers:
                     computed_metric[clf_name] = self.compute_loss(gt_overall, pred_overall[clf_name], loss_function)
-                computed_metric = pd.DataFrame(computed_metric)
-                print("............ ", metric, " ..............")
-                print(computed_metric)
-                self.errors.append(computed_metric)
-                self.errors_keys.append(self.storing_key + "_" + metric)
+                self.store_error(metric, pd.DataFrame(computed_metric))
 
         if self.display_predictions:
             if self.site_only != True:
@@ -441,17 +658,30 @@ class API_val():
                     plt.xlabel('Time')
                     plt.ylabel('Power (W)')
                 plt.show()
+        return accumulator
 
-    def predict(self, clf, test_elec, test_submeters, sample_period, timezone):
+    def store_error(self, metric, computed_metric):
+        print("............ ", metric, " ..............")
+        print(computed_metric)
+        self.errors.append(computed_metric)
+        self.errors_keys.append(self.storing_key + "_" + metric)
+
+    def predict(self, clf, test_elec, test_submeters, sample_period, timezone, dataset=None, building=None):
         print("Generating predictions for :", clf.MODEL_NAME)
         """
         Generates predictions on the test dataset using the specified classifier.
+        dataset and building only label the profiled stage.
         """
 
         # "ac_type" varies according to the dataset used. 
         # Make sure to use the correct ac_type before using the default parameters in this code.   
 
-        pred_list = clf.disaggregate_chunk(test_elec)
+        with self.profiler.stage('predict', dataset, building, clf.MODEL_NAME):
+            if self.inference_chunk_size:
+                # The windows of only one chunk are held in memory at a time
+                pred_list = disaggregate_in_chunks(clf, test_elec, self.inference_chunk_size)
+            else:
+                pred_list = clf.disaggregate_chunk(test_elec)
 
         # It might not have time stamps sometimes due to neural nets
         # It has the readings for all the appliances
@@ -0,0 +1,178 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view, as_strided
+
+
+def file_signature(path):
+    """
+    Returns the modification time and size of a file, so cache entries of a changed file are not used any more.
+    """
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def window_series(array):
+    """
+    Returns the series that an array of overlapping windows is a view of, or None if the array is no such view.
+    The series shares the memory of the windows.
+    """
+    if array.ndim != 2 or len(array) == 0 or array.strides != (array.itemsize, array.itemsize):
+        return None
+    return as_strided(array, shape=(len(array) + array.shape[1] - 1,), strides=(array.itemsize,), writeable=False)
+
+
+class ArrayCache():
+    """
+    Content addressed on-disk cache of numpy arrays and dataframes. Every entry is a folder with .npy files,
+    which are memory mapped when they are read. Entries that were not used for the longest time are removed when
+    the size of the cache exceeds max_size.
+    """
+
+    def __init__(self, cache_dir, max_size=10 * 1024 ** 3):
+        """
+        cache_dir: folder of the cache
+        max_size: maximum size of the cache in bytes
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(**parts):
+        """
+        Returns the hash of the given parts, which have to be json serializable.
+        """
+        text = json.dumps(parts, sort_keys=True, default=str)
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """
+        Returns the arrays and the meta data of an entry as dictionaries, or None if the entry does not exist.
+        """
+        entry_dir = os.path.join(self.cache_dir, key)
+        meta_path = os.path.join(entry_dir, 'meta.json')
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path) as fp:
+            meta = json.load(fp)
+        arrays = {}
+        for name, window in meta['arrays'].items():
+            array = np.load(os.path.join(entry_dir, name + '.npy'), mmap_mode='r')
+            if window:
+                array = sliding_window_view(array, window)
+            arrays[name] = array
+        # The modification time of the folder is the time of the last use
+        os.utime(entry_dir)
+        return arrays, meta['meta']
+
+    def put(self, key, arrays, meta=None):
+        """
+        Stores a dictionary of arrays and json serializable meta data under the key.
+        Arrays of overlapping windows, which are views of a series where every row starts one value after
+        the previous one, are stored as the underlying series and restored as a read-only view of windows.
+        """
+        entry_dir = os.path.join(self.cache_dir, key)
+        if os.path.exists(entry_dir):
+            return
+        temp_dir = tempfile.mkdtemp(dir=self.cache_dir, prefix='.entry_')
+        try:
+            windows = {}
+            for name, array in arrays.items():
+                array = np.asarray(array)
+                windows[name] = 0
+                # The windows are recognized by their strides, without comparing their values
+                series = window_series(array) if array.ndim == 2 and array.shape[1] > 1 else None
+                if series is not None:
+                    windows[name] = array.shape[1]
+                    array = series
+                np.save(os.path.join(temp_dir, name + '.npy'), array)
+            with open(os.path.join(temp_dir, 'meta.json'), 'w') as fp:
+                json.dump({'arrays': windows, 'meta': meta}, fp, default=str)
+            os.rename(temp_dir, entry_dir)
+        except OSError:
+            # Another process stored the same entry in the meantime
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            if not os.path.exists(entry_dir):
+                raise
+        self.evict()
+
+    def get_frames(self, key):
+        """
+        Returns the list of dataframes and arrays stored with put_frames, or None if the entry does not exist.
+        """
+        entry = self.get(key)
+        if entry is None:
+            return None
+        arrays, meta = entry
+        frames = []
+        for i, frame_meta in enumerate(meta):
+            if frame_meta['index'] is None:
+                frames.append(arrays['values_%d' % i])
+                continue
+            if frame_meta['index'] == 'range':
+                index = pd.RangeIndex(frame_meta['start'], frame_meta['stop'], frame_meta['step'])
+            elif frame_meta['index'] == 'datetime':
+                index = pd.DatetimeIndex(np.asarray(arrays['index_%d' % i]).view('datetime64[ns]'))
+                if frame_meta['tz'] is not None:
+                    index = index.tz_localize('UTC').tz_convert(frame_meta['tz'])
+            else:
+                index = pd.Index(arrays['index_%d' % i])
+            columns = frame_meta['columns']
+            if frame_meta['column_levels'] > 1:
+                columns = pd.MultiIndex.from_tuples([tuple(column) for column in columns],
+                                                    names=frame_meta['column_names'])
+            else:
+                columns = pd.Index(columns, name=frame_meta['column_names'][0])
+            frames.append(pd.DataFrame(arrays['values_%d' % i], index=index, columns=columns, copy=False))
+        return frames
+
+    def put_frames(self, key, frames):
+        """
+        Stores a list of dataframes with their index and columns. Numpy arrays in the list are stored as they are.
+        """
+        arrays = {}
+        meta = []
+        for i, frame in enumerate(frames):
+            if isinstance(frame, np.ndarray):
+                arrays['values_%d' % i] = frame
+                meta.append({'index': None})
+                continue
+            arrays['values_%d' % i] = frame.values
+            if isinstance(frame.index, pd.RangeIndex):
+                meta.append({'index': 'range', 'start': frame.index.start, 'stop': frame.index.stop,
+                             'step': frame.index.step})
+            elif isinstance(frame.index, pd.DatetimeIndex):
+                arrays['index_%d' % i] = frame.index.asi8
+                meta.append({'index': 'datetime', 'tz': str(frame.index.tz) if frame.index.tz is not None else None})
+            else:
+                arrays['index_%d' % i] = frame.index.values
+                meta.append({'index': 'values'})
+            meta[-1].update({'columns': list(frame.columns), 'column_levels': frame.columns.nlevels,
+                             'column_names': list(frame.columns.names)})
+        self.put(key, arrays, meta)
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache is not larger than max_size.
+        """
+        entries = []
+        total_size = 0
+        for name in os.listdir(self.cache_dir):
+            entry_dir = os.path.join(self.cache_dir, name)
+            if name.startswith('.') or not os.path.isdir(entry_dir):
+                continue
+            size = sum(os.path.getsize(os.path.join(entry_dir, file_name)) for file_name in os.listdir(entry_dir))
+            entries.append((os.path.getmtime(entry_dir), size, entry_dir))
+            total_size += size
+        for _, size, entry_dir in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total_size -= size
@@ -0,0 +1,27 @@
+from nilmtk.prefetch import Prefetcher
+
+
+class BuildingPrefetcher(Prefetcher):
+    """
+    Loads the data of several buildings one after another on a background thread, so the next buildings are read
+    while the current one is processed. At most prefetch buildings are loaded ahead of the current one.
+    All reads happen on the background thread, so the HDF5 files are never accessed from two threads at once.
+    """
+
+    def __init__(self, load_building, buildings, prefetch=1):
+        """
+        load_building: function that is called with (dataset, building) and returns the data of the building
+        buildings: list of (dataset, building) tuples in the order they are processed
+        prefetch: number of buildings that are loaded ahead
+        """
+        super().__init__(prefetch)
+        self.load_building = load_building
+        self.buildings = list(buildings)
+        self.prefetch = self.depth
+
+    def produce(self):
+        """
+        Yields tuples (dataset, building, data) in the order of the buildings.
+        """
+        for dataset, building in self.buildings:
+            yield dataset, building, self.load_building(dataset, building)
@@ -0,0 +1,62 @@
+import time
+import pandas as pd
+from nilmtk.prefetch import Prefetcher
+
+
+class AlignedChunkStream(Prefetcher):
+    """
+    Reads the mains and appliance meters of a building chunk by chunk in a single pass.
+    The next chunks are read on a background thread while the current one is processed.
+    """
+
+    def __init__(self, elec, appliances, chunk_size, power, sample_period, queue_depth=1, site_only=False):
+        """
+        elec: the MeterGroup of the building
+        appliances: names of the appliances to be loaded along with the mains
+        chunk_size, power, sample_period: passed on to the load calls of the meters
+        queue_depth: number of chunks that are read ahead
+        site_only: if True, only the mains are read
+        """
+        super().__init__(queue_depth)
+        self.elec = elec
+        self.appliances = [] if site_only else list(appliances)
+        self.chunk_size = chunk_size
+        self.power = power
+        self.sample_period = sample_period
+        self.queue_depth = self.depth
+        self.timings = []
+
+    def __iter__(self):
+        """
+        Yields tuples (chunk_num, mains_df, appliance_dfs). Appliance meters that have no more data for
+        a chunk are returned as empty dataframes.
+        """
+        for (chunk_num, mains_df, appliance_dfs, read_time), wait_time in self.items():
+            process_start = time.perf_counter()
+            yield chunk_num, mains_df, appliance_dfs
+            self.timings.append({'chunk': chunk_num, 'read_time': read_time, 'wait_time': wait_time,
+                                 'process_time': time.perf_counter() - process_start})
+
+    def produce(self):
+        mains_iterator = self.elec.mains().load(chunksize=self.chunk_size, physical_quantity='power',
+                                                ac_type=self.power['mains'], sample_period=self.sample_period)
+        appliance_iterators = [self.elec[app_name].load(chunksize=self.chunk_size, physical_quantity='power',
+                                                        ac_type=self.power['appliance'],
+                                                        sample_period=self.sample_period)
+                               for app_name in self.appliances]
+        chunk_num = 0
+        while True:
+            read_start = time.perf_counter()
+            try:
+                mains_df = next(mains_iterator)
+            except StopIteration:
+                return
+            appliance_dfs = []
+            for appliance_iterator in appliance_iterators:
+                try:
+                    appliance_df = next(appliance_iterator)
+                except StopIteration:
+                    appliance_df = pd.DataFrame()
+                appliance_dfs.append(appliance_df)
+            yield chunk_num, mains_df, appliance_dfs, time.perf_counter() - read_start
+            chunk_num += 1
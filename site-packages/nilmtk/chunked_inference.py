@@ -0,0 +1,40 @@
+import pandas as pd
+
+
+def inference_context(clf):
+    """
+    Returns the number of past and future readings that a prediction of the classifier depends on, and the block
+    size that the chunk boundaries have to be aligned to. Classifiers can define an inference_context method,
+    otherwise one sequence_length - 1 of readings on both sides is used, which covers all sliding window models.
+    """
+    if hasattr(clf, 'inference_context'):
+        return clf.inference_context()
+    context = max(getattr(clf, 'sequence_length', 1) - 1, 0)
+    return context, context, 1
+
+
+def disaggregate_in_chunks(clf, test_main_list, chunk_size):
+    """
+    Disaggregates the mains readings in chunks of chunk_size readings. Every chunk is extended by the readings
+    the predictions at its edges depend on, and only the predictions of the chunk itself are kept,
+    so the stitched predictions are the same as those of a single disaggregate_chunk call,
+    while the windowed data of only one chunk is held in memory.
+    """
+    past, future, block = inference_context(clf)
+    chunk_size = max(block, chunk_size // block * block)
+
+    test_predictions = []
+    for test_mains in test_main_list:
+        chunk_predictions = []
+        for start in range(0, len(test_mains), chunk_size):
+            end = min(start + chunk_size, len(test_mains))
+            context_start = max(start - past, 0)
+            context_end = min(end + future, len(test_mains))
+            prediction = clf.disaggregate_chunk([test_mains.iloc[context_start:context_end]])[0]
+            offset = start - context_start
+            chunk_predictions.append(prediction.iloc[offset:offset + end - start])
+        if chunk_predictions:
+            test_predictions.append(pd.concat(chunk_predictions, axis=0, ignore_index=True))
+        else:
+            test_predictions.extend(clf.disaggregate_chunk([test_mains]))
+    return test_predictions
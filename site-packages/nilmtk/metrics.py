@@ -0,0 +1,175 @@
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+# Metrics of nilmtk.losses that can be computed from the accumulated sums
+ACCUMULATED_METRICS = ('mae', 'rmse', 'nep', 'nde', 'r2score', 'f1score', 'recall', 'precision')
+
+
+class MetricAccumulator():
+    """
+    Accumulates the sums and counts from which the metrics of nilmtk.losses are computed, for all classifiers and
+    appliances at once. Accumulators of different chunks or buildings can be merged, the merged scores are the same
+    as the scores of the concatenated predictions.
+    """
+
+    def __init__(self, classifier_names, appliance_names, threshold=10):
+        """
+        classifier_names: names of the classifiers
+        appliance_names: names of the appliances
+        threshold: power in watts from which an appliance counts as switched on, as in nilmtk.losses
+        """
+        self.classifier_names = list(classifier_names)
+        self.appliance_names = list(appliance_names)
+        self.threshold = threshold
+
+        shape = (len(self.classifier_names), len(self.appliance_names))
+        self.abs_error = np.zeros(shape)
+        self.squared_error = np.zeros(shape)
+        self.true_positives = np.zeros(shape)
+        self.false_positives = np.zeros(shape)
+        self.false_negatives = np.zeros(shape)
+        self.true_negatives = np.zeros(shape)
+        # Count, sum, mean and sum of squared deviations of the ground truth per appliance
+        self.count = 0
+        self.gt_sum = np.zeros(shape[1])
+        self.gt_squared_sum = np.zeros(shape[1])
+        self.gt_mean = np.zeros(shape[1])
+        self.gt_m2 = np.zeros(shape[1])
+
+    def update(self, gt_overall, pred_overall):
+        """
+        gt_overall: dataframe with the ground truth of the appliances
+        pred_overall: dictionary with the classifier names as keys and the prediction dataframes as values
+        """
+        gt = gt_overall[self.appliance_names].to_numpy(dtype=np.float64)
+        # (classifier x time x appliance) array of the predictions
+        pred = np.stack([pred_overall[name][self.appliance_names].to_numpy(dtype=np.float64)
+                         for name in self.classifier_names])
+        error = pred - gt
+        self.abs_error += np.abs(error).sum(axis=1)
+        self.squared_error += np.square(error).sum(axis=1)
+
+        gt_on = ~(gt < self.threshold)
+        pred_on = ~(pred < self.threshold)
+        self.true_positives += (pred_on & gt_on).sum(axis=1)
+        self.false_positives += (pred_on & ~gt_on).sum(axis=1)
+        self.false_negatives += (~pred_on & gt_on).sum(axis=1)
+        self.true_negatives += (~pred_on & ~gt_on).sum(axis=1)
+
+        n = len(gt)
+        if n:
+            mean = gt.mean(axis=0)
+            m2 = np.square(gt - mean).sum(axis=0)
+            self.merge_gt_moments(n, mean, m2)
+        self.gt_sum += gt.sum(axis=0)
+        self.gt_squared_sum += np.square(gt).sum(axis=0)
+
+    def merge(self, other):
+        """
+        Adds the sums and counts of another accumulator with the same classifiers and appliances.
+        """
+        if other.classifier_names != self.classifier_names or other.appliance_names != self.appliance_names:
+            raise ValueError("Only accumulators of the same classifiers and appliances can be merged")
+        self.abs_error += other.abs_error
+        self.squared_error += other.squared_error
+        self.true_positives += other.true_positives
+        self.false_positives += other.false_positives
+        self.false_negatives += other.false_negatives
+        self.true_negatives += other.true_negatives
+        if other.count:
+            self.merge_gt_moments(other.count, other.gt_mean, other.gt_m2)
+        self.gt_sum += other.gt_sum
+        self.gt_squared_sum += other.gt_squared_sum
+        return self
+
+    def merge_gt_moments(self, n, mean, m2):
+        # Pairwise update of the mean and the squared deviations, which stays exact for large sums
+        total = self.count + n
+        delta = mean - self.gt_mean
+        self.gt_mean = self.gt_mean + delta * n / total
+        self.gt_m2 = self.gt_m2 + m2 + np.square(delta) * self.count * n / total
+        self.count = total
+
+    def result(self, metric):
+        """
+        Returns a dataframe with the appliances as index and the classifiers as columns, like API_val.compute_loss.
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if metric == 'mae':
+                values = self.abs_error / self.count
+            elif metric == 'rmse':
+                values = np.sqrt(self.squared_error / self.count)
+            elif metric == 'nep':
+                values = self.abs_error / self.gt_sum
+            elif metric == 'nde':
+                values = np.sqrt(self.squared_error / self.gt_squared_sum)
+            elif metric == 'r2score':
+                # Constant ground truth gives 1 for a perfect prediction and 0 otherwise, as in sklearn
+                values = np.where(self.gt_m2 > 0, 1 - self.squared_error / self.gt_m2,
+                                  np.where(self.squared_error == 0, 1.0, 0.0))
+            elif metric == 'f1score':
+                values = self.ratio(2 * self.true_positives,
+                                    2 * self.true_positives + self.false_positives + self.false_negatives)
+            elif metric == 'recall':
+                values = self.ratio(self.true_positives, self.true_positives + self.false_negatives)
+            elif metric == 'precision':
+                values = self.ratio(self.true_positives, self.true_positives + self.false_positives)
+            else:
+                raise ValueError("The metric {} can not be computed from the accumulated sums".format(metric))
+        return pd.DataFrame(values.T, index=self.appliance_names, columns=self.classifier_names)
+
+    @staticmethod
+    def ratio(numerator, denominator):
+        # sklearn returns 0 if there are no positive samples
+        return np.where(denominator > 0, numerator / np.where(denominator > 0, denominator, 1), 0.0)
+
+
+class RunningMoments():
+    """
+    Count, mean and sum of squared deviations of a stream of readings. The moments are updated chunk by chunk
+    with the pairwise update of Welford, so the mean and std of data larger than the memory are computed in one pass.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64).reshape(-1)
+        if len(values) == 0:
+            return self
+        mean = values.mean()
+        return self.merge_moments(len(values), mean, np.square(values - mean).sum())
+
+    def merge(self, other):
+        if other.count:
+            self.merge_moments(other.count, other.mean, other.m2)
+        return self
+
+    def merge_moments(self, n, mean, m2):
+        total = self.count + n
+        delta = mean - self.mean
+        self.mean = self.mean + delta * n / total
+        self.m2 = self.m2 + m2 + delta ** 2 * self.count * n / total
+        self.count = total
+        return self
+
+    @property
+    def std(self):
+        # Population standard deviation, like np.std
+        return float(np.sqrt(self.m2 / self.count)) if self.count else 0.0
+
+
+def appliance_moments(appliances, moments=None):
+    """
+    Updates the moments of every appliance with its readings and returns them in an OrderedDict.
+    appliances: list of (appliance name, list of dataframes) tuples
+    """
+    moments = OrderedDict() if moments is None else moments
+    for appliance_name, dfs in appliances:
+        appliance = moments.setdefault(appliance_name, RunningMoments())
+        for df in dfs:
+            appliance.update(df.values)
+    return moments
@@ -0,0 +1,83 @@
+import os
+import shutil
+import tempfile
+from nilmtk.array_cache import ArrayCache
+
+# Attributes of a classifier that do not change what it learns
+IGNORED_ATTRIBUTES = ('models', 'inference_models', 'quantization_report', 'gating_report', 'calibration_main',
+                      'workers', 'save_model_path', 'load_model_path', 'checkpoint_path', 'training_jobs',
+                      'threads_per_job', 'inference_precision', 'calibration_windows', 'gating', 'gating_quantile',
+                      'overlapping_inference')
+
+
+def describe_model(clf):
+    """
+    Returns the class and the hyperparameters of a classifier. These are the attributes in its TRAINING_PARAMS, or
+    for classifiers without such a list, its attributes with simple values.
+    """
+    hyperparameters = {}
+    training_params = getattr(clf, 'TRAINING_PARAMS', None)
+    if training_params is not None:
+        for attribute in training_params:
+            if hasattr(clf, attribute):
+                hyperparameters[attribute] = getattr(clf, attribute)
+        return {'class': type(clf).__name__, 'hyperparameters': hyperparameters}
+    for attribute, value in vars(clf).items():
+        if attribute in IGNORED_ATTRIBUTES or attribute.startswith('_'):
+            continue
+        if isinstance(value, (bool, int, float, str, list, tuple, dict)) or value is None:
+            hyperparameters[attribute] = value
+    return {'class': type(clf).__name__, 'hyperparameters': hyperparameters}
+
+
+class ModelRegistry():
+    """
+    On-disk registry of trained models. Every entry is a folder with the weights and the normalization parameters
+    of a classifier, saved with its save_model function and keyed by the hash of the class, the hyperparameters and
+    the data the classifier was trained on.
+    """
+
+    def __init__(self, registry_dir):
+        """
+        registry_dir: folder of the registry
+        """
+        self.registry_dir = registry_dir
+        os.makedirs(registry_dir, exist_ok=True)
+
+    @staticmethod
+    def supports(clf):
+        return hasattr(clf, 'save_model') and hasattr(clf, 'load_model')
+
+    @staticmethod
+    def key(clf, **data):
+        """
+        Returns the key of a classifier before it is trained on the described data, which has to be json serializable.
+        """
+        return ArrayCache.key(model=describe_model(clf), **data)
+
+    def load(self, clf, key):
+        """
+        Loads the models of the entry into the classifier and returns True, or returns False if there is no entry.
+        """
+        entry_dir = os.path.join(self.registry_dir, key)
+        if not os.path.exists(os.path.join(entry_dir, 'model.json')):
+            return False
+        clf.load_model(entry_dir)
+        return True
+
+    def save(self, clf, key):
+        """
+        Saves the trained models of the classifier under the key.
+        """
+        entry_dir = os.path.join(self.registry_dir, key)
+        if os.path.exists(entry_dir):
+            return
+        temp_dir = tempfile.mkdtemp(dir=self.registry_dir, prefix='.entry_')
+        try:
+            clf.save_model(temp_dir)
+            os.rename(temp_dir, entry_dir)
+        except OSError:
+            # Another process stored the same entry in the meantime
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            if not os.path.exists(entry_dir):
+                raise
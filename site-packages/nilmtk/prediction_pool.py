@@ -0,0 +1,132 @@
+import os
+import pickle
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from nilmtk.profiler import StageProfiler
+
+# State of a prediction process, set once by the initializer of the pool
+_worker_state = {}
+
+
+def limit_backend_threads(intra_op_threads, inter_op_threads=None):
+    """
+    Limits the number of threads used by the numerical backends. The environment variables are read by
+    BLAS/OpenMP and TensorFlow when they start, the TensorFlow settings can only be changed before its first operation.
+    """
+    if not intra_op_threads:
+        return
+    os.environ['OMP_NUM_THREADS'] = str(intra_op_threads)
+    os.environ['TF_NUM_INTRAOP_THREADS'] = str(intra_op_threads)
+    if inter_op_threads:
+        os.environ['TF_NUM_INTEROP_THREADS'] = str(inter_op_threads)
+    try:
+        import tensorflow as tf
+    except ImportError:
+        return
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+        if inter_op_threads:
+            tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+    except RuntimeError:
+        print("TensorFlow is already initialized, its thread limits could not be changed")
+
+
+def _init_worker(api_class, api_settings, pickled_classifiers, threads_per_worker):
+    # The thread limits have to be set before the models are restored, which initializes TensorFlow
+    limit_backend_threads(threads_per_worker, 1)
+    api = api_class.__new__(api_class)
+    api.__dict__.update(api_settings)
+    # Stages in the worker processes are not recorded
+    api.profiler = StageProfiler(enabled=False)
+    _worker_state['api'] = api
+    _worker_state['classifiers'] = pickle.loads(pickled_classifiers)
+
+
+def _predict_in_worker(clf_index, test_mains, test_submeters, sample_period, timezone, dataset, building):
+    clf = _worker_state['classifiers'][clf_index][1]
+    return _worker_state['api'].predict(clf, test_mains, test_submeters, sample_period, timezone, dataset, building)
+
+
+class PredictionPool():
+    """
+    Generates the predictions of several (test data, classifier) pairs concurrently in a thread or process pool.
+    The models of a classifier are not safe to use from several threads at once, so with the thread backend every
+    classifier is pinned to its own thread and only different classifiers predict at the same time.
+    """
+
+    def __init__(self, api, classifiers, n_jobs, backend='thread', threads_per_worker=None):
+        """
+        api: the API_val instance whose predict function is used
+        classifiers: list of (name, classifier) tuples
+        n_jobs: number of predictions that run at the same time
+        backend: 'thread' shares the trained models, 'process' copies them once into every worker process
+        threads_per_worker: number of backend threads of every worker process
+        """
+        if backend not in ('thread', 'process'):
+            raise ValueError("The parallel backend has to be 'thread' or 'process', not {}".format(backend))
+        self.api = api
+        self.classifiers = classifiers
+        self.n_jobs = n_jobs
+        self.backend = backend
+        self.threads_per_worker = threads_per_worker
+        self._executors = None
+        self._slots = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def start(self):
+        if self.backend == 'process':
+            # The workers only need the settings of the API that its predict function uses
+            api_settings = {'site_only': self.api.site_only, 'inference_chunk_size': self.api.inference_chunk_size}
+            self._executors = [ProcessPoolExecutor(max_workers=self.n_jobs,
+                                                   mp_context=multiprocessing.get_context('spawn'),
+                                                   initializer=_init_worker,
+                                                   initargs=(type(self.api), api_settings,
+                                                             pickle.dumps(self.classifiers), self.threads_per_worker))]
+        else:
+            # One thread per classifier, of which at most n_jobs predict at the same time
+            self._executors = [ThreadPoolExecutor(max_workers=1, thread_name_prefix='Prediction-%d' % clf_index)
+                               for clf_index in range(len(self.classifiers))]
+            self._slots = threading.Semaphore(self.n_jobs)
+
+    def close(self):
+        if self._executors is not None:
+            for executor in self._executors:
+                executor.shutdown(wait=True)
+            self._executors = None
+
+    def predict(self, jobs):
+        """
+        jobs: list of (test_mains, test_submeters, timezone, dataset, building) tuples
+        Returns one list per job with the (gt_overall, pred_overall) tuple of every classifier,
+        in the order of the jobs and classifiers.
+        """
+        with self:
+            futures = [self.submit(*job) for job in jobs]
+            return [[future.result() for future in job_futures] for job_futures in futures]
+
+    def submit(self, test_mains, test_submeters, timezone, dataset=None, building=None):
+        """
+        Starts the predictions of all classifiers on the test data and returns their futures, in the order of the
+        classifiers. The pool has to be started. dataset and building label the profiled stages.
+        """
+        futures = []
+        for clf_index, (name, clf) in enumerate(self.classifiers):
+            if self.backend == 'process':
+                futures.append(self._executors[0].submit(_predict_in_worker, clf_index, test_mains, test_submeters,
+                                                         self.api.sample_period, timezone, dataset, building))
+            else:
+                futures.append(self._executors[clf_index].submit(self._predict_pinned, clf, test_mains,
+                                                                 test_submeters, timezone, dataset, building))
+        return futures
+
+    def _predict_pinned(self, clf, test_mains, test_submeters, timezone, dataset, building):
+        with self._slots:
+            return self.api.predict(clf, test_mains, test_submeters, self.api.sample_period, timezone, dataset,
+                                    building)
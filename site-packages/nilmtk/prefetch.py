@@ -0,0 +1,86 @@
+import queue
+import threading
+import time
+
+
+class Prefetcher():
+    """
+    Base class of the iterators whose items are produced on a background thread while the consumer processes the
+    previous ones. At most depth items are produced ahead of the one the consumer holds. Subclasses implement
+    produce, a generator of the items that runs on the background thread.
+    """
+
+    def __init__(self, depth=1):
+        """
+        depth: number of items that are produced ahead
+        """
+        self.depth = max(1, depth)
+        self.wait_time = 0.0
+
+        self._queue = queue.Queue()
+        self._slots = threading.Semaphore(self.depth)
+        self._stop_event = threading.Event()
+        self._worker = None
+
+    def produce(self):
+        raise NotImplementedError
+
+    def __iter__(self):
+        for item, wait_time in self.items():
+            yield item
+
+    def items(self):
+        """
+        Yields the produced items with the time the consumer waited for each of them.
+        A prefetcher can only be iterated once.
+        """
+        if self._worker is not None:
+            raise RuntimeError("A {} can only be iterated once".format(type(self).__name__))
+        self._worker = threading.Thread(target=self._run, name=type(self).__name__, daemon=True)
+        self._worker.start()
+        try:
+            while True:
+                wait_start = time.perf_counter()
+                kind, item = self._queue.get()
+                wait_time = time.perf_counter() - wait_start
+                self.wait_time += wait_time
+                if kind == 'error':
+                    raise item
+                if kind == 'end':
+                    break
+                # The slot of the item is free again once it is handed out
+                self._slots.release()
+                yield item, wait_time
+        finally:
+            self.close()
+
+    def close(self):
+        """
+        Stops the background thread, e.g. if the consumer stops early.
+        """
+        self._stop_event.set()
+        if self._worker is not None and self._worker is not threading.current_thread():
+            self._worker.join()
+
+    def _acquire_slot(self):
+        # Waits for a free slot, unless the consumer stops in the meantime
+        while not self._stop_event.is_set():
+            if self._slots.acquire(timeout=0.1):
+                return not self._stop_event.is_set()
+        return False
+
+    def _run(self):
+        items = self.produce()
+        try:
+            while self._acquire_slot():
+                try:
+                    item = next(items)
+                except StopIteration:
+                    self._queue.put(('end', None))
+                    return
+                self._queue.put(('item', item))
+        except BaseException as e:
+            self._queue.put(('error', e))
+        finally:
+            # A producer that is stopped early releases its resources, e.g. open files
+            items.close()
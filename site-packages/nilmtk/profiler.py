@@ -0,0 +1,118 @@
+import json
+import time
+import threading
+import tracemalloc
+from contextlib import contextmanager
+import pandas as pd
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, the memory is not recorded there
+    resource = None
+
+
+def max_rss_mb():
+    """
+    Returns the peak resident memory of the process in MB, or None if it can not be determined.
+    """
+    if resource is None:
+        return None
+    # ru_maxrss is given in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class StageProfiler():
+    """
+    Records the wall time, the CPU time and the peak memory of the stages of an experiment,
+    labelled with the dataset, building and classifier they belong to.
+    """
+
+    def __init__(self, enabled=True, trace_memory=False, sinks=None):
+        """
+        enabled: if False, stages are not recorded
+        trace_memory: if True, the peak of the memory allocated by python during every stage is traced as well,
+                      which slows down the experiment
+        sinks: list of functions that are called with every record, e.g. to send it to a monitoring system
+        """
+        self.enabled = enabled
+        self.trace_memory = trace_memory
+        self.sinks = list(sinks) if sinks else []
+        self.records = []
+        self._lock = threading.Lock()
+        # Traced memory peaks of the open stages, each is a list with one value so it can be updated in place
+        self._open_peaks = []
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+
+    @contextmanager
+    def stage(self, name, dataset=None, building=None, classifier=None):
+        """
+        Context manager that records the stage it encloses. The cpu_time is the one of the calling thread, so
+        stages that run at the same time in several threads do not count each other's time. The process_cpu_time
+        also includes the threads of the numerical backends, but overlaps between concurrent stages.
+        Stages can be nested, every stage records the traced memory peak while it was open.
+        """
+        if not self.enabled:
+            yield
+            return
+        peak = None
+        if self.trace_memory:
+            with self._lock:
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                self._update_peaks()
+                peak = [tracemalloc.get_traced_memory()[0]]
+                self._open_peaks.append(peak)
+        rss_before = max_rss_mb()
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        process_cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            record = {'stage': name, 'dataset': dataset, 'building': building, 'classifier': classifier,
+                      'wall_time': time.perf_counter() - wall_start, 'cpu_time': time.thread_time() - cpu_start,
+                      'process_cpu_time': time.process_time() - process_cpu_start, 'max_rss_mb': max_rss_mb()}
+            record['max_rss_increase_mb'] = None if rss_before is None else record['max_rss_mb'] - rss_before
+            with self._lock:
+                if peak is not None:
+                    self._update_peaks()
+                    self._open_peaks.remove(peak)
+                    record['traced_peak_mb'] = peak[0] / 1024 ** 2
+                self.records.append(record)
+            for sink in self.sinks:
+                sink(record)
+
+    def _update_peaks(self):
+        # The peak since the last update is added to all open stages, before it is reset for the next one
+        traced_peak = tracemalloc.get_traced_memory()[1]
+        for peak in self._open_peaks:
+            peak[0] = max(peak[0], traced_peak)
+        tracemalloc.reset_peak()
+
+    def report(self):
+        """
+        Returns a dataframe with one row per recorded stage.
+        """
+        return pd.DataFrame(self.records)
+
+    def summary(self):
+        """
+        Returns the total times and the highest memory per stage and classifier.
+        """
+        report = self.report()
+        if report.empty:
+            return report
+        return report.fillna({'classifier': ''}).groupby(['stage', 'classifier'], sort=False).agg(
+            count=('wall_time', 'size'), wall_time=('wall_time', 'sum'), cpu_time=('cpu_time', 'sum'),
+            process_cpu_time=('process_cpu_time', 'sum'), max_rss_mb=('max_rss_mb', 'max'))
+
+    def save(self, path):
+        """
+        Saves the records to path + '.json' and path + '.csv'.
+        """
+        with open(path + '.json', 'w') as fp:
+            json.dump(self.records, fp, indent=1, default=str)
+        self.report().to_csv(path + '.csv', index=False)
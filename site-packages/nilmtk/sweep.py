@@ -0,0 +1,176 @@
+import copy
+import json
+import time
+import random
+import itertools
+import pandas as pd
+from nilmtk.api_val import API_val
+from nilmtk.metrics import MetricAccumulator
+
+
+class Sweep():
+    """
+    Runs many API_val configurations as a grid or random search. The trials of one data configuration share the loaded
+    data, the trials of a round are trained one after another, and successive halving on the validation error stops
+    the weak configurations after a few epochs. Keras models must not be trained from several threads of a process,
+    so the parallelism is left to the classifiers, which train the models of their appliances in processes.
+    """
+
+    def __init__(self, params, search_space, search='grid', n_trials=10, n_jobs=1, reduction_factor=3, min_epochs=1,
+                 results_path=None, seed=10):
+        """
+        params: API_val params, but 'methods' maps the method names to (classifier class, model params) tuples,
+                because every trial needs new classifier instances
+        search_space: dictionary with a list of values (or, for the random search, a function of a random.Random)
+                      for each searched parameter. The keys are API_val params, e.g. 'sample_rate' or 'appliances',
+                      or 'model.<name>' for a model param, e.g. 'model.sequence_length'
+        search: 'grid' for all combinations or 'random' for n_trials random combinations
+        n_jobs: number of processes in which every trial trains the models of its appliances, passed to the
+                classifiers as training_jobs unless their params set it
+        reduction_factor: after every round only the best 1 / reduction_factor of the trials are trained further,
+                          for reduction_factor times as many epochs
+        min_epochs: number of epochs of the first round
+        results_path: optional path of a csv file, which is written after every round
+        """
+        if search not in ('grid', 'random'):
+            raise ValueError("The search has to be 'grid' or 'random', not {}".format(search))
+        if not params.get('validate', {}).get('datasets'):
+            raise ValueError("The sweep ranks the trials on the validation data, params['validate']['datasets'] "
+                             "must not be empty")
+        self.params = params
+        self.search_space = search_space
+        self.search = search
+        self.n_trials = n_trials
+        self.n_jobs = n_jobs
+        self.reduction_factor = reduction_factor
+        self.min_epochs = min_epochs
+        self.results_path = results_path
+        self.seed = seed
+
+        self.apis = {}
+        self.trials = []
+        self.results = pd.DataFrame()
+
+    def configurations(self):
+        """
+        Returns the list of searched configurations, as dictionaries of the search space keys and the chosen values.
+        """
+        keys = list(self.search_space)
+        if self.search == 'grid':
+            return [dict(zip(keys, values)) for values in itertools.product(*[self.search_space[key] for key in keys])]
+
+        rng = random.Random(self.seed)
+        configurations = []
+        for i in range(self.n_trials):
+            configuration = {}
+            for key in keys:
+                values = self.search_space[key]
+                configuration[key] = values(rng) if callable(values) else rng.choice(values)
+            if configuration not in configurations:
+                configurations.append(configuration)
+        return configurations
+
+    def create_trials(self):
+        """
+        Creates one trial for every method and configuration. Trials with the same API_val params share one API_val,
+        whose data is loaded only once.
+        """
+        self.trials = []
+        for configuration in self.configurations():
+            api_params = copy.deepcopy({key: value for key, value in self.params.items() if key != 'methods'})
+            model_params = {}
+            for key, value in configuration.items():
+                if key.startswith('model.'):
+                    model_params[key[len('model.'):]] = value
+                else:
+                    api_params[key] = value
+            api_key = json.dumps(api_params, sort_keys=True, default=str)
+            if api_key not in self.apis:
+                api_params.update({'methods': {}, 'run_experiment': False})
+                self.apis[api_key] = API_val(api_params)
+
+            for method_name, (classifier_class, method_params) in self.params['methods'].items():
+                trial_params = dict(method_params, **model_params)
+                if self.n_jobs > 1 and not trial_params.get('chunk_wise_training', False):
+                    trial_params.setdefault('training_jobs', self.n_jobs)
+                clf = classifier_class(trial_params)
+                self.trials.append({'trial': len(self.trials), 'method': method_name, 'configuration': configuration,
+                                    'api': self.apis[api_key], 'clf': clf, 'max_epochs': getattr(clf, 'n_epochs', 1),
+                                    'epochs': 0, 'train_time': 0.0})
+
+    def run(self):
+        """
+        Runs the sweep and returns the results table with one row per trial and round.
+        """
+        self.create_trials()
+        for api in self.apis.values():
+            # Every data configuration is loaded once for all of its trials
+            api.load_jointly(api.train_datasets_dict, 'training')
+            validate_mains, validate_submeters = api.load_jointly(api.validate_datasets_dict, 'validation')
+            if len(validate_mains) == 0:
+                raise ValueError("The validation datasets of the sweep contain no buildings")
+
+        rows = []
+        survivors = list(self.trials)
+        epochs = self.min_epochs
+        round_number = 0
+        while survivors:
+            print("Sweep round {} with {} trials for {} epochs".format(round_number, len(survivors), epochs))
+            errors = [self.train_and_validate(trial, epochs) for trial in survivors]
+
+            # Trials without a valid error are ranked last
+            ranking = sorted(zip(errors, [trial['trial'] for trial in survivors], survivors),
+                             key=lambda x: (x[0] if x[0] == x[0] else float('inf'), x[1]))
+            finished = all(trial['epochs'] >= trial['max_epochs'] for trial in survivors)
+            n_promoted = 0 if finished else max(1, len(survivors) // self.reduction_factor)
+            for rank, (error, _, trial) in enumerate(ranking):
+                row = {'trial': trial['trial'], 'method': trial['method'], 'round': round_number,
+                       'epochs': trial['epochs'], 'validation_mae': error, 'train_time': trial['train_time'],
+                       'promoted': rank < n_promoted}
+                row.update(trial['configuration'])
+                rows.append(row)
+            self.results = pd.DataFrame(rows)
+            if self.results_path is not None:
+                self.results.to_csv(self.results_path, index=False)
+
+            survivors = [trial for _, _, trial in ranking[:n_promoted]]
+            epochs = epochs * self.reduction_factor
+            round_number += 1
+
+        for api in self.apis.values():
+            api.clear_joint_data()
+        return self.results
+
+    def best_trial(self):
+        """
+        Returns the trial with the lowest validation error in the last round it was trained.
+        """
+        last_rounds = self.results.sort_values('round').groupby('trial').tail(1)
+        best = last_rounds.sort_values(['round', 'validation_mae'], ascending=[False, True]).iloc[0]
+        return self.trials[int(best['trial'])]
+
+    def train_and_validate(self, trial, epochs):
+        """
+        Trains a trial until it has been trained for the given number of epochs, and returns its mean
+        absolute error on the validation data, averaged over the appliances.
+        """
+        api, clf = trial['api'], trial['clf']
+        target_epochs = min(epochs, trial['max_epochs'])
+        start = time.perf_counter()
+        if target_epochs > trial['epochs']:
+            if hasattr(clf, 'n_epochs'):
+                # The models are kept between the rounds, so only the missing epochs are trained
+                clf.n_epochs = target_epochs - trial['epochs']
+            api.train_jointly(clf, api.train_datasets_dict, api.validate_datasets_dict)
+            trial['epochs'] = target_epochs
+        trial['train_time'] += time.perf_counter() - start
+
+        validate_mains, validate_submeters = api.load_jointly(api.validate_datasets_dict, 'validation')
+        accumulator = None
+        for i, mains in enumerate(validate_mains):
+            gt_overall, pred_overall = api.predict(clf, [mains], [(appliance_name, [dfs[i]]) for appliance_name, dfs
+                                                                  in validate_submeters], api.sample_period, None)
+            building_metrics = MetricAccumulator([trial['method']], gt_overall.columns)
+            building_metrics.update(gt_overall, {trial['method']: pred_overall})
+            accumulator = building_metrics if accumulator is None else accumulator.merge(building_metrics)
+        return float(accumulator.result('mae').values.mean())
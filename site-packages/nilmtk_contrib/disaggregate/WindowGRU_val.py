@@ -12,21 +12,25 @@ import h5py
 import os
 import pickle
 
-from keras.models import Sequential
-from keras.layers import Dense, Conv1D, GRU, Bidirectional, Dropout
+from keras.models import Sequential, Model
+from keras.layers import Dense, Conv1D, GRU, Bidirectional, Dropout, Input
 from keras.utils import plot_model
-from sklearn.model_selection import train_test_split
-from keras.callbacks import ModelCheckpoint
 import keras.backend as K
 from nilmtk.utils import find_nearest
 from nilmtk.feature_detectors import cluster
 from nilmtk.disaggregate import Disaggregator
+from .windowing import normalized_series, windows, WindowSequence
+from .multi_output import output_name, predict_appliances, fit_multi_output
+from .quantization import inference_models
+from .persistence import ValModel
+from .training import training_callbacks
+from .parallel_training import fit_in_processes
 from nilmtk.datastore import HDFDataStore
 
 import random
 random.seed(10)
 np.random.seed(10)
-class WindowGRU_val(Disaggregator):
+class WindowGRU_val(ValModel, Disaggregator):
 
     def __init__(self, params):
 
@@ -39,64 +43,63 @@ class WindowGRU_val(Disaggregator):
         self.models = OrderedDict()
         self.max_val = 800
         self.batch_size = params.get('batch_size',512)
+        self.init_val_params(params)
+        if self.load_model_path:
+            self.load_model()
 
     def partial_fit(self,train_main,train_appliances,validate_main,validate_appliances,do_preprocessing=True,**load_kwargs):
+        # The converted models of the previous weights are stale, end_training converts the retrained models
+        self.inference_models = OrderedDict()
 
 
         if do_preprocessing:
             train_main, train_appliances = self.call_preprocessing(train_main, train_appliances, 'train')
 
-        train_main = pd.concat(train_main,axis=0).values
-        train_main = train_main.reshape((-1,self.sequence_length,1))
-
-        new_train_appliances  = []
-        for app_name, app_df in train_appliances:
-            app_df = pd.concat(app_df,axis=0).values
-            app_df = app_df.reshape((-1,1))
-            new_train_appliances.append((app_name, app_df))
-
-        train_appliances = new_train_appliances
-
         ## ----- new for validation -----
         if do_preprocessing:
             validate_main, validate_appliances = self.call_preprocessing(validate_main, validate_appliances, 'train')
-        validate_main = pd.concat(validate_main,axis=0).values
-        validate_main = validate_main.reshape((-1,self.sequence_length,1))
-
-        new_validate_appliances  = []
-        for app_name, app_df in validate_appliances:
-            val_app_df = pd.concat(app_df,axis=0).values
-            val_app_df = val_app_df.reshape((-1,1))
-            new_validate_appliances.append((app_name, val_app_df))
-        validate_appliances = new_validate_appliances
+        validate_appliances = dict(validate_appliances)
         ## ----- new for validation -----
 
-        for app_name, app_df in train_appliances:
-            if app_name not in self.models:
-                print("First model training for ", app_name)
-                self.models[app_name] = self.return_network()
-            else:
-                print("Started re-training model for ", app_name)
-
-            model = self.models[app_name]
-            mains = train_main.reshape((-1,self.sequence_length,1))
-            app_reading = app_df.reshape((-1,1))
-            filepath = 'windowgru-temp-weights-'+str(random.randint(0,100000))+'.h5'
-            checkpoint = ModelCheckpoint(filepath,monitor='val_loss',verbose=1,save_best_only=True,mode='min')
-            train_x, v_x, train_y, v_y = train_test_split(mains, app_reading, test_size=0.000001,random_state=10)
-            ## ----- new for validation -----
-            for validate_appliance_name, val_app_df in validate_appliances:
-                if validate_appliance_name == app_name:
-                    v_x, val_x, v_y, val_y = train_test_split(validate_main, val_app_df, test_size=0.000001,random_state=10)
-            ## ----- new for validation -----
-            model.fit(train_x,train_y,validation_data=[v_x,v_y],epochs=self.n_epochs,callbacks=[checkpoint],shuffle=True,batch_size=self.batch_size)
-            model.load_weights(filepath)
-
+        if self.multi_output:
+            fit_multi_output(self, train_main, train_appliances, validate_main, validate_appliances,
+                             (self.sequence_length, 1), (1,))
+        elif self.training_jobs > 1:
+            fit_in_processes(self, train_main, train_appliances, validate_main, validate_appliances,
+                             (self.sequence_length, 1), (1,))
+        else:
+            for app_name, app_df in train_appliances:
+                if app_name not in self.models:
+                    print("First model training for ", app_name)
+                    self.models[app_name] = self.return_network()
+                else:
+                    print("Started re-training model for ", app_name)
+
+                model = self.models[app_name]
+                # The shuffled batches of windows are gathered while the model trains
+                train_data = WindowSequence(train_main, app_df, (self.sequence_length, 1), (1,), self.batch_size)
+                ## ----- new for validation -----
+                validation_data = None
+                if app_name in validate_appliances:
+                    validation_data = WindowSequence(validate_main, validate_appliances[app_name],
+                                                     (self.sequence_length, 1), (1,), self.batch_size, shuffle=False)
+                ## ----- new for validation -----
+                # The best weights are kept in memory and restored when the training ends
+                callbacks = training_callbacks(self, app_name, validation_data is not None)
+                model.fit(train_data,validation_data=validation_data,epochs=self.n_epochs,callbacks=callbacks,
+                          workers=self.workers)
+
+        if self.gate is not None:
+            # The thresholds only depend on the data, so they are learned from every training call
+            self.gate.fit(self, train_main, train_appliances)
+        # The models are converted and saved by end_training, after the best weights are restored
+        self.calibration_main = train_main
 
     def disaggregate_chunk(self,test_main_list,model=None,do_preprocessing=True):
 
         if model is not None:
             self.models = model
+            self.inference_models = OrderedDict()
 
         if do_preprocessing:
             test_main_list = self.call_preprocessing(
@@ -105,9 +108,10 @@ class WindowGRU_val(Disaggregator):
         test_predictions = []
         for mains in test_main_list:
             disggregation_dict = {}
-            mains = mains.values.reshape((-1,self.sequence_length,1))
-            for appliance in self.models:
-                prediction = self.models[appliance].predict(mains,batch_size=self.batch_size)
+            mains = np.asarray(mains).reshape((-1,self.sequence_length,1))
+            predictions = predict_appliances(inference_models(self), mains, self.batch_size, self.multi_output,
+                                             self.gate)
+            for appliance, prediction in predictions.items():
                 prediction = np.reshape(prediction, len(prediction))
                 valid_predictions = prediction.flatten()
                 valid_predictions = np.where(valid_predictions > 0, valid_predictions, 0)
@@ -125,60 +129,42 @@ class WindowGRU_val(Disaggregator):
             processed_mains = []
 
             for mains in mains_lst:
-                # add padding values
-                padding = [0 for i in range(0, self.sequence_length - 1)]
-                paddf = pd.DataFrame({mains.columns.values[0]: padding})
-                mains = mains.append(paddf)
                 mainsarray = self.preprocess_train_mains(mains)
-                processed_mains.append(pd.DataFrame(mainsarray))
+                processed_mains.append(mainsarray)
 
             tuples_of_appliances = []
             for (appliance_name, app_dfs_list) in submeters_lst:
                 processed_app_dfs = []
                 for app_df in app_dfs_list:                    
                     data = self.preprocess_train_appliances(app_df)
-                    processed_app_dfs.append(pd.DataFrame(data))
+                    processed_app_dfs.append(data)
                 tuples_of_appliances.append((appliance_name, processed_app_dfs))
 
             return processed_mains , tuples_of_appliances
 
         if method == 'test':
             processed_mains = []
-            for mains in mains_lst:                
-                # add padding values
-                padding = [0 for i in range(0, self.sequence_length - 1)]
-                paddf = pd.DataFrame({mains.columns.values[0]: padding})
-                mains = mains.append(paddf)
+            for mains in mains_lst:
                 mainsarray = self.preprocess_test_mains(mains)
-                processed_mains.append(pd.DataFrame(mainsarray))
+                processed_mains.append(mainsarray)
 
             return processed_mains
 
     def preprocess_test_mains(self, mains):
 
-        mains = self._normalize(mains, self.max_val)
-        mainsarray = np.array(mains)
-        indexer = np.arange(self.sequence_length)[
-            None, :] + np.arange(len(mainsarray) - self.sequence_length + 1)[:, None]
-        mainsarray = mainsarray[indexer]
-        mainsarray = mainsarray.reshape((-1,self.sequence_length))
-        return pd.DataFrame(mainsarray)
+        # The mains are padded with zeros, so there is one window for every reading
+        mainsarray = normalized_series(mains.values, 0, self.max_val, pad_after=self.sequence_length - 1)
+        return windows(mainsarray, self.sequence_length)
 
     def preprocess_train_appliances(self, appliance):
 
-        appliance = self._normalize(appliance, self.max_val)
-        appliancearray = np.array(appliance)
-        appliancearray = appliancearray.reshape((-1,1))
-        return pd.DataFrame(appliancearray)
+        appliancearray = normalized_series(appliance.values, 0, self.max_val)
+        return appliancearray.reshape((-1,1))
 
     def preprocess_train_mains(self, mains):
 
-        mains = self._normalize(mains, self.max_val)
-        mainsarray = np.array(mains)
-        indexer = np.arange(self.sequence_length)[None, :] + np.arange(len(mainsarray) - self.sequence_length + 1)[:, None]
-        mainsarray = mainsarray[indexer]
-        mainsarray = mainsarray.reshape((-1,self.sequence_length))
-        return pd.DataFrame(mainsarray)
+        mainsarray = normalized_series(mains.values, 0, self.max_val, pad_after=self.sequence_length - 1)
+        return windows(mainsarray, self.sequence_length)
 
     def _normalize(self, chunk, mmax):
 
@@ -208,4 +194,22 @@ class WindowGRU_val(Disaggregator):
         model.add(Dropout(0.5))
         model.add(Dense(1, activation='linear'))
         model.compile(loss='mse', optimizer='adam')
-        return model
\ No newline at end of file
+        return model
+
+    def return_multi_output_network(self, n_outputs):
+        '''Creates the GRU architecture with a shared trunk and a fully connected head for every appliance
+        '''
+        inputs = Input(shape=(self.sequence_length,1))
+        x = Conv1D(16,4,activation='relu',padding="same",strides=1)(inputs)
+        x = Bidirectional(GRU(64, activation='relu', return_sequences=True), merge_mode='concat')(x)
+        x = Dropout(0.5)(x)
+        x = Bidirectional(GRU(128, activation='relu', return_sequences=False), merge_mode='concat')(x)
+        x = Dropout(0.5)(x)
+        outputs = []
+        for i in range(n_outputs):
+            head = Dense(128, activation='relu')(x)
+            head = Dropout(0.5)(head)
+            outputs.append(Dense(1, activation='linear', name=output_name(i))(head))
+        model = Model(inputs=inputs, outputs=outputs)
+        model.compile(loss='mse', optimizer='adam')
+        return model
@@ -1,15 +1,20 @@
 from __future__ import print_function, division
 from warnings import warn
 from nilmtk.disaggregate import Disaggregator
-from keras.layers import Conv1D, Dense, Dropout, Reshape, Flatten
+from nilmtk.metrics import appliance_moments
+from .windowing import normalized_series, windows, WindowSequence, predict_overlap_add
+from .multi_output import output_name, predict_appliances, fit_multi_output
+from .quantization import inference_models
+from .persistence import ValModel
+from .training import training_callbacks
+from .parallel_training import fit_in_processes
+from keras.layers import Conv1D, Dense, Dropout, Reshape, Flatten, Input
 import pandas as pd
 import numpy as np
 from collections import OrderedDict 
 from keras.optimizers import SGD
-from keras.models import Sequential
+from keras.models import Sequential, Model
 import matplotlib.pyplot as  plt
-from sklearn.model_selection import train_test_split
-from keras.callbacks import ModelCheckpoint
 import keras.backend as K
 from statistics import mean
 import os
@@ -19,7 +24,7 @@ import json
 
 random.seed(10)
 np.random.seed(10)
-class DAE_val(Disaggregator):
+class DAE_val(ValModel, Disaggregator):
     
     def __init__(self, params):
         """
@@ -30,9 +35,12 @@ class DAE_val(Disaggregator):
         self.sequence_length = params.get('sequence_length',99)
         self.n_epochs = params.get('n_epochs', 10)
         self.batch_size = params.get('batch_size',512)
+        self.init_val_params(params)
         self.mains_mean = params.get('mains_mean',1000)
         self.mains_std = params.get('mains_std',600)
         self.appliance_params = params.get('appliance_params',{})
+        # If True, the mains are predicted with overlapping windows, whose predictions are averaged
+        self.overlapping_inference = params.get('overlapping_inference', False)
         self.save_model_path = params.get('save-model-path', None)
         self.load_model_path = params.get('pretrained-model-path',None)
         self.models = OrderedDict()
@@ -45,6 +53,8 @@ class DAE_val(Disaggregator):
         """
         The partial fit function
         """
+        # The converted models of the previous weights are stale, end_training converts the retrained models
+        self.inference_models = OrderedDict()
 
         # If no appliance wise parameters are specified, then they are computed from the data
         if len(self.appliance_params) == 0:
@@ -54,83 +64,51 @@ class DAE_val(Disaggregator):
         if do_preprocessing:
             print ("Doing Preprocessing")
             train_main,train_appliances = self.call_preprocessing(train_main,train_appliances,'train')
-        train_main = pd.concat(train_main,axis=0).values
-        train_main = train_main.reshape((-1,self.sequence_length,1))
-        new_train_appliances  = []
-        for app_name, app_df in train_appliances:
-            app_df = pd.concat(app_df,axis=0).values
-            app_df = app_df.reshape((-1,self.sequence_length,1))
-            new_train_appliances.append((app_name, app_df))
-        train_appliances = new_train_appliances
 
         ## ----- new for validation -----
         if do_preprocessing:
             validate_main,validate_appliances = self.call_preprocessing(validate_main,validate_appliances,'train')
-        validate_main = pd.concat(validate_main,axis=0).values
-        validate_main = validate_main.reshape((-1,self.sequence_length,1))
-        new_validate_appliances  = []
-        for app_name, app_df in validate_appliances:
-            val_app_df = pd.concat(app_df,axis=0).values
-            val_app_df = val_app_df.reshape((-1,self.sequence_length,1))
-            new_validate_appliances.append((app_name, val_app_df))
-        validate_appliances = new_validate_appliances
+        validate_appliances = dict(validate_appliances)
         ## ----- new for validation -----
 
-        for appliance_name, power in train_appliances:
-            if appliance_name not in self.models:
-                print ("First model training for ",appliance_name)
-                self.models[appliance_name] = self.return_network()
-                print (self.models[appliance_name].summary())
-            print ("Started Retraining model for ",appliance_name)    
-            model = self.models[appliance_name]
-            filepath = 'dae-temp-weights-'+str(random.randint(0,100000))+'.h5'
-            checkpoint = ModelCheckpoint(filepath, monitor='val_loss', verbose=1, save_best_only=True, mode='min')
-            train_x,v_x,train_y,v_y = train_test_split(train_main,power,test_size=0.000001,random_state=10)
-            ## ----- new for validation -----
-            for validate_appliance_name, power_validate in validate_appliances:
-                if validate_appliance_name == appliance_name:
-                    v_x, val_x, v_y, val_y = train_test_split(validate_main, power_validate, test_size=0.000001,random_state=10)
-            ## ----- new for validation -----
-            model.fit(train_x,train_y,validation_data = [v_x,v_y],epochs = self.n_epochs, callbacks = [checkpoint],shuffle=True,batch_size=self.batch_size)
-            model.load_weights(filepath)
-
-        if self.save_model_path:
-            self.save_model()
-
-    def load_model(self):
-        print ("Loading the model using the pretrained-weights")        
-        model_folder = self.load_model_path
-        with open(os.path.join(model_folder, "model.json"), "r") as f:
-            model_string = f.read().strip()
-            params_to_load = json.loads(model_string)
-
-
-        self.sequence_length = int(params_to_load['sequence_length'])
-        self.mains_mean = params_to_load['mains_mean']
-        self.mains_std = params_to_load['mains_std']
-        self.appliance_params = params_to_load['appliance_params']
-
-        for appliance_name in self.appliance_params:
-            self.models[appliance_name] = self.return_network()
-            self.models[appliance_name].load_weights(os.path.join(model_folder,appliance_name+".h5"))
-
-
-    def save_model(self):
-        
-        os.makedirs(self.save_model_path)    
-        params_to_save = {}
-        params_to_save['appliance_params'] = self.appliance_params
-        params_to_save['sequence_length'] = self.sequence_length
-        params_to_save['mains_mean'] = self.mains_mean
-        params_to_save['mains_std'] = self.mains_std
-        for appliance_name in self.models:
-            print ("Saving model for ", appliance_name)
-            self.models[appliance_name].save_weights(os.path.join(self.save_model_path,appliance_name+".h5"))
-
-        with open(os.path.join(self.save_model_path,'model.json'),'w') as file:
-            file.write(json.dumps(params_to_save))
-
-
+        if self.multi_output:
+            window_shape = (self.sequence_length, 1)
+            fit_multi_output(self, train_main, train_appliances, validate_main, validate_appliances, window_shape,
+                             window_shape)
+        elif self.training_jobs > 1:
+            window_shape = (self.sequence_length, 1)
+            fit_in_processes(self, train_main, train_appliances, validate_main, validate_appliances, window_shape,
+                             window_shape)
+        else:
+            for appliance_name, power in train_appliances:
+                if appliance_name not in self.models:
+                    print ("First model training for ",appliance_name)
+                    self.models[appliance_name] = self.return_network()
+                    print (self.models[appliance_name].summary())
+                print ("Started Retraining model for ",appliance_name)    
+                model = self.models[appliance_name]
+                # The shuffled batches of windows are gathered while the model trains
+                window_shape = (self.sequence_length, 1)
+                train_data = WindowSequence(train_main, power, window_shape, window_shape, self.batch_size)
+                ## ----- new for validation -----
+                validation_data = None
+                if appliance_name in validate_appliances:
+                    validation_data = WindowSequence(validate_main, validate_appliances[appliance_name], window_shape,
+                                                     window_shape, self.batch_size, shuffle=False)
+                ## ----- new for validation -----
+                # The best weights are kept in memory and restored when the training ends
+                callbacks = training_callbacks(self, appliance_name, validation_data is not None)
+                model.fit(train_data,validation_data=validation_data,epochs=self.n_epochs,callbacks=callbacks,
+                          workers=self.workers)
+
+        if self.gate is not None:
+            # The thresholds only depend on the data, so they are learned from every training call
+            self.gate.fit(self, train_main, train_appliances)
+        # The models are converted and saved by end_training, after the best weights are restored
+        self.calibration_main = train_main
+
+    def target_shape(self):
+        return (self.sequence_length, 1)
 
     def disaggregate_chunk(self, test_main_list, do_preprocessing=True):
         if do_preprocessing:
@@ -138,11 +116,13 @@ class DAE_val(Disaggregator):
 
         test_predictions = []
         for test_main in test_main_list:
-            test_main = test_main.values
-            test_main = test_main.reshape((-1,self.sequence_length,1))
+            test_main = np.asarray(test_main).reshape((-1,self.sequence_length,1))
             disggregation_dict = {}
-            for appliance in self.models:
-                prediction = self.models[appliance].predict(test_main,batch_size=self.batch_size)
+            if self.overlapping_inference:
+                predictions = self.predict_overlapping(test_main)
+            else:
+                predictions = self.predict_windows(test_main)
+            for appliance, prediction in predictions.items():
                 app_mean = self.appliance_params[appliance]['mean']
                 app_std = self.appliance_params[appliance]['std']
                 prediction = self.denormalize_output(prediction,app_mean,app_std)
@@ -154,6 +134,22 @@ class DAE_val(Disaggregator):
             test_predictions.append(results)
         return test_predictions
             
+    def predict_overlapping(self, test_main):
+        # The windows are predicted in blocks and averaged for every timestamp
+        return predict_overlap_add(self.predict_windows, test_main, self.models, self.sequence_length,
+                                   self.batch_size * 100)
+
+    def predict_windows(self, windows):
+        return predict_appliances(inference_models(self), windows, self.batch_size, self.multi_output, self.gate)
+
+    def inference_context(self):
+        if self.overlapping_inference:
+            # Every prediction depends on all windows that contain its timestamp
+            return self.sequence_length - 1, self.sequence_length - 1, 1
+        # The mains are cut into non-overlapping windows, so chunks that start at a multiple of the
+        # sequence length need no neighbouring readings
+        return 0, 0, self.sequence_length
+
     def return_network(self):
         model = Sequential()
         model.add(Conv1D(8, 4, activation="linear", input_shape=(self.sequence_length, 1), padding="same", strides=1))
@@ -166,13 +162,29 @@ class DAE_val(Disaggregator):
         model.compile(loss='mse', optimizer='adam')
         return model
 
+    def return_multi_output_network(self, n_outputs):
+        # The encoder is shared by all appliances, every appliance has its own decoder
+        inputs = Input(shape=(self.sequence_length, 1))
+        x = Conv1D(8, 4, activation="linear", padding="same", strides=1)(inputs)
+        x = Flatten()(x)
+        x = Dense((self.sequence_length)*8, activation='relu')(x)
+        x = Dense(128, activation='relu')(x)
+        outputs = []
+        for i in range(n_outputs):
+            head = Dense((self.sequence_length)*8, activation='relu')(x)
+            head = Reshape(((self.sequence_length), 8))(head)
+            outputs.append(Conv1D(1, 4, activation="linear", padding="same", strides=1, name=output_name(i))(head))
+        model = Model(inputs=inputs, outputs=outputs)
+        model.compile(loss='mse', optimizer='adam')
+        return model
+
     def call_preprocessing(self, mains_lst, submeters_lst, method):
         sequence_length  = self.sequence_length
         if method=='train':
             processed_mains = []
             for mains in mains_lst:                
                 mains = self.normalize_input(mains.values,sequence_length,self.mains_mean,self.mains_std,True)
-                processed_mains.append(pd.DataFrame(mains))
+                processed_mains.append(mains)
 
             tuples_of_appliances = []
             for (appliance_name,app_df_list) in submeters_lst:
@@ -181,7 +193,7 @@ class DAE_val(Disaggregator):
                 processed_app_dfs = []
                 for app_df in app_df_list:
                     data = self.normalize_output(app_df.values, sequence_length,app_mean,app_std,True)
-                    processed_app_dfs.append(pd.DataFrame(data))                    
+                    processed_app_dfs.append(data)
                 tuples_of_appliances.append((appliance_name, processed_app_dfs))
 
             return processed_mains, tuples_of_appliances
@@ -189,45 +201,34 @@ class DAE_val(Disaggregator):
         if method=='test':
             processed_mains = []
             for mains in mains_lst:                
-                mains = self.normalize_input(mains.values,sequence_length,self.mains_mean,self.mains_std,False)
-                processed_mains.append(pd.DataFrame(mains))
+                mains = self.normalize_input(mains.values,sequence_length,self.mains_mean,self.mains_std,
+                                             self.overlapping_inference)
+                processed_mains.append(mains)
             return processed_mains
     
         
     def normalize_input(self,data,sequence_length, mean, std, overlapping=False):
-        n = sequence_length
-        excess_entries =  sequence_length - (data.size % sequence_length)       
-        lst = np.array([0] * excess_entries)
-        arr = np.concatenate((data.flatten(), lst),axis=0)   
-        if overlapping:
-            windowed_x = np.array([ arr[i:i+n] for i in range(len(arr)-n+1) ])
-        else:
-            windowed_x = arr.reshape((-1,sequence_length))
-        windowed_x = windowed_x - mean
-        windowed_x = windowed_x/std
-        return (windowed_x/std).reshape((-1,sequence_length))
+        excess_entries =  sequence_length - (data.size % sequence_length)
+        arr = normalized_series(data, mean, std, pad_after=excess_entries)
+        # The mains are divided by the standard deviation twice, which the trained models expect
+        arr /= std
+        return windows(arr, sequence_length, overlapping)
 
     def normalize_output(self,data,sequence_length, mean, std, overlapping=False):
-        n = sequence_length
-        excess_entries =  sequence_length - (data.size % sequence_length)       
-        lst = np.array([0] * excess_entries)
-        arr = np.concatenate((data.flatten(), lst),axis=0) 
-        if overlapping:  
-            windowed_y = np.array([ arr[i:i+n] for i in range(len(arr)-n+1) ])
-        else:
-            windowed_y = arr.reshape((-1,sequence_length))        
-        windowed_y = windowed_y - mean
-        return (windowed_y/std).reshape((-1,sequence_length))
+        excess_entries =  sequence_length - (data.size % sequence_length)
+        arr = normalized_series(data, mean, std, pad_after=excess_entries)
+        return windows(arr, sequence_length, overlapping)
 
     def denormalize_output(self,data,mean,std):
         return mean + data*std
     
-    def set_appliance_params(self,train_appliances):
-
-        for (app_name,df_list) in train_appliances:
-            l = np.array(pd.concat(df_list,axis=0))
-            app_mean = np.mean(l)
-            app_std = np.std(l)
+    def set_appliance_params(self,train_appliances,moments=None):
+        # The moments are accumulated frame by frame, unless they were computed in a pass over the chunks
+        if moments is None:
+            moments = appliance_moments(train_appliances)
+        for app_name, app_moments in moments.items():
+            app_mean = app_moments.mean
+            app_std = app_moments.std
             if app_std<1:
                 app_std = 100
             self.appliance_params.update({app_name:{'mean':app_mean,'std':app_std}})
@@ -0,0 +1,174 @@
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from .windowing import window_series
+from .multi_output import predict_appliances
+from .quantization import sample_windows, inference_models, appliance_scale, to_watts
+
+
+def window_max(array):
+    """
+    Returns the maximum of every window, one window per row. The maxima of overlapping windows are computed
+    as a rolling maximum of their series, without going through every window.
+    """
+    array = np.asarray(array)
+    array = array.reshape((len(array), -1))
+    series = window_series(array)
+    if series is not None and array.shape[1] > 1:
+        length = array.shape[1]
+        return pd.Series(series).rolling(length).max().to_numpy()[length - 1:]
+    return array.max(axis=1) if array.shape[1] > 0 else np.zeros(len(array))
+
+
+class ActivityGate():
+    """
+    Skips the windows in which an appliance can not be on. For every appliance, the threshold is a low quantile of the
+    maxima of the normalized mains in the training windows in which the appliance is on. Windows whose mains stay
+    below it get the output of the appliance being off, the network predicts only the remaining windows.
+    """
+
+    def __init__(self, quantile=0.001, on_power=10):
+        """
+        quantile: quantile of the mains maxima of the windows with the appliance on, that is used as threshold
+        on_power: power in watts from which an appliance counts as switched on
+        """
+        self.quantile = quantile
+        self.on_power = on_power
+        # Thresholds on the normalized mains and normalized outputs of the switched off appliances
+        self.thresholds = {}
+        self.base_values = {}
+        self._lock = threading.Lock()
+        self.reset_counts()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @property
+    def fitted(self):
+        return len(self.base_values) > 0
+
+    def reset_counts(self):
+        # Number of windows and of skipped windows of every appliance since the last reset
+        self.counts = {}
+
+    def fit(self, clf, train_main, train_appliances):
+        """
+        Learns the thresholds from the preprocessed training data. Repeated fits, e.g. on several chunks,
+        keep the lower threshold.
+        """
+        mains_maxima = [window_max(mains) for mains in train_main]
+        for appliance_name, targets in train_appliances:
+            offset, factor = appliance_scale(clf, appliance_name)
+            on_level = (self.on_power - offset) / factor
+            on_maxima = [maxima[window_max(target) > on_level] for maxima, target in zip(mains_maxima, targets)
+                         if len(target) == len(maxima)]
+            on_maxima = np.concatenate(on_maxima) if on_maxima else np.zeros(0)
+            self.base_values[appliance_name] = float(-offset / factor)
+            if len(on_maxima) == 0:
+                # Without windows in which the appliance is on, no window is skipped
+                self.thresholds[appliance_name] = None
+                continue
+            threshold = float(np.quantile(on_maxima, self.quantile))
+            previous = self.thresholds.get(appliance_name, threshold)
+            self.thresholds[appliance_name] = threshold if previous is None else min(threshold, previous)
+
+    def active(self, appliance_name, maxima):
+        threshold = self.thresholds.get(appliance_name)
+        if threshold is None:
+            return np.ones(len(maxima), dtype=bool)
+        return maxima >= threshold
+
+    def predict(self, models, windows, batch_size, multi_output=False):
+        """
+        Returns an OrderedDict with the predictions of every appliance like predict_appliances, where the
+        networks only predict the windows in which the appliance may be on.
+        """
+        maxima = window_max(windows)
+        active = OrderedDict((appliance_name, self.active(appliance_name, maxima)) for appliance_name in models)
+        with self._lock:
+            for appliance_name, rows in active.items():
+                count = self.counts.setdefault(appliance_name, [0, 0])
+                count[0] += len(rows)
+                count[1] += int(len(rows) - np.count_nonzero(rows))
+
+        predictions = OrderedDict()
+        if multi_output:
+            # The shared network predicts the windows in which any appliance may be on
+            network = next(iter(models.values()))
+            rows = np.logical_or.reduce(list(active.values()))
+            outputs = self.predict_rows(network, windows, rows, batch_size)
+            if len(models) == 1:
+                outputs = [outputs]
+            for (appliance_name, appliance_rows), output in zip(active.items(), outputs):
+                prediction = self.fill(appliance_name, output, rows, len(windows))
+                prediction[~appliance_rows] = self.base_values[appliance_name]
+                predictions[appliance_name] = prediction
+            return predictions
+        for appliance_name, model in models.items():
+            output = self.predict_rows(model, windows, active[appliance_name], batch_size)
+            predictions[appliance_name] = self.fill(appliance_name, output, active[appliance_name], len(windows))
+        return predictions
+
+    @staticmethod
+    def predict_rows(model, windows, rows, batch_size):
+        if np.any(rows):
+            return model.predict(windows[rows], batch_size=batch_size)
+        # Only the shape of the output is needed
+        output = model.predict(windows[:1], batch_size=batch_size)
+        return [array[:0] for array in output] if isinstance(output, list) else output[:0]
+
+    def fill(self, appliance_name, output, rows, n_windows):
+        output = np.asarray(output)
+        prediction = np.full((n_windows,) + output.shape[1:], self.base_values[appliance_name], dtype=np.float32)
+        prediction[rows] = output
+        return prediction
+
+    def summary(self):
+        """
+        Returns the share of skipped windows of every appliance since the last reset.
+        """
+        return {appliance_name: skipped / total if total else 0.0
+                for appliance_name, (total, skipped) in self.counts.items()}
+
+
+def gating_report(clf, train_main, input_shape):
+    """
+    Compares the predictions with and without the gate of a classifier on a sample of the preprocessed mains.
+    The time of both, the share of skipped windows and the mean and max absolute difference in watts of every
+    appliance are stored in clf.gating_report and returned.
+    """
+    windows = sample_windows(train_main, clf.calibration_windows)
+    windows = windows.reshape((-1,) + tuple(input_shape)).astype(np.float32)
+    if len(windows) == 0:
+        return None
+    models = inference_models(clf)
+    start = time.perf_counter()
+    full = predict_appliances(models, windows, clf.batch_size, clf.multi_output)
+    full_time = time.perf_counter() - start
+    clf.gate.reset_counts()
+    start = time.perf_counter()
+    gated = predict_appliances(models, windows, clf.batch_size, clf.multi_output, clf.gate)
+    gated_time = time.perf_counter() - start
+    skipped = clf.gate.summary()
+    clf.gate.reset_counts()
+
+    clf.gating_report = OrderedDict()
+    for appliance_name in models:
+        difference = np.abs(to_watts(clf, appliance_name, full[appliance_name]) -
+                            to_watts(clf, appliance_name, gated[appliance_name]))
+        clf.gating_report[appliance_name] = {
+            'skipped_windows': skipped.get(appliance_name, 0.0),
+            'mean_absolute_difference': float(np.mean(difference)),
+            'max_absolute_difference': float(np.max(difference))}
+    clf.gating_report['speedup'] = full_time / gated_time if gated_time > 0 else None
+    for appliance_name, report in clf.gating_report.items():
+        print("Gating of", appliance_name, ":", report)
+    return clf.gating_report
@@ -0,0 +1,75 @@
+from collections import OrderedDict
+from .windowing import WindowSequence
+from .training import training_callbacks
+
+
+def output_name(index):
+    """
+    Returns the name of the output layer of the index-th appliance. Appliance names can not be used,
+    because they may contain characters that are not allowed in layer names.
+    """
+    return 'appliance_%d' % index
+
+
+def predict_appliances(models, windows, batch_size, multi_output=False, gate=None):
+    """
+    Returns an OrderedDict with the predictions of every appliance for the windows. In the multi-output mode,
+    all appliances share one network, which is run once for all of them. With a fitted ActivityGate, only the
+    windows in which an appliance may be on are predicted.
+    """
+    if gate is not None and gate.fitted:
+        return gate.predict(models, windows, batch_size, multi_output)
+    if not multi_output:
+        return OrderedDict((appliance, model.predict(windows, batch_size=batch_size))
+                           for appliance, model in models.items())
+    network = next(iter(models.values()))
+    predictions = network.predict(windows, batch_size=batch_size)
+    if len(models) == 1:
+        predictions = [predictions]
+    return OrderedDict(zip(models, predictions))
+
+
+def fit_multi_output(clf, train_main, train_appliances, validate_main, validate_appliances, input_shape,
+                     target_shape):
+    """
+    Trains one network with a shared trunk and a head for every appliance on all appliances at once.
+    The network is stored in clf.models under the name of every appliance, in the order of its outputs.
+    """
+    if len(clf.models) == 0:
+        appliance_names = [appliance_name for appliance_name, _ in train_appliances]
+        print("First model training for ", ", ".join(appliance_names))
+        network = clf.return_multi_output_network(len(appliance_names))
+        for appliance_name in appliance_names:
+            clf.models[appliance_name] = network
+    else:
+        print("Started Retraining model for ", ", ".join(clf.models))
+    network = next(iter(clf.models.values()))
+
+    train_appliances = dict(train_appliances)
+    validate_appliances = dict(validate_appliances)
+    missing = [appliance_name for appliance_name in clf.models if appliance_name not in train_appliances]
+    if missing:
+        raise ValueError("The multi-output network needs training data of {}".format(", ".join(missing)))
+    new = [appliance_name for appliance_name in train_appliances if appliance_name not in clf.models]
+    if new:
+        # The outputs of the network are fixed when it is built
+        raise ValueError("The multi-output network has no output for {}, it was built for {}".format(
+            ", ".join(new), ", ".join(clf.models)))
+
+    # The shuffled batches of windows are gathered while the network trains
+    train_data = WindowSequence(train_main, OrderedDict((appliance_name, train_appliances[appliance_name])
+                                                        for appliance_name in clf.models),
+                                input_shape, target_shape, clf.batch_size)
+    if train_data.n_windows <= 10:
+        # Sometimes chunks can be empty after dropping NANS
+        return
+    validation_data = None
+    if all(appliance_name in validate_appliances for appliance_name in clf.models):
+        validation_data = WindowSequence(validate_main, OrderedDict((appliance_name, validate_appliances[appliance_name])
+                                                                    for appliance_name in clf.models),
+                                         input_shape, target_shape, clf.batch_size, shuffle=False)
+
+    # The best weights are kept in memory and restored when the training ends
+    callbacks = training_callbacks(clf, 'multi_output', validation_data is not None)
+    network.fit(train_data, validation_data=validation_data, epochs=clf.n_epochs, callbacks=callbacks,
+                workers=clf.workers)
@@ -0,0 +1,117 @@
+import os
+import shutil
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from nilmtk.prediction_pool import limit_backend_threads
+from .windowing import windows, window_series, WindowSequence
+from .training import training_callbacks
+
+# Attributes of a classifier that the training processes do not need
+WORKER_EXCLUDED_ATTRIBUTES = ('models', 'inference_models', 'quantization_report', 'epoch_tracker', 'calibration_main')
+
+
+def share_arrays(folder, name, arrays):
+    """
+    Saves the arrays of every building to .npy files in the folder and returns their descriptions. Arrays of
+    overlapping windows are saved as the series they are a view of and restored as windows again.
+    """
+    descriptions = []
+    for i, array in enumerate(arrays):
+        array = np.asarray(array)
+        series = window_series(array)
+        path = os.path.join(folder, '%s_%d.npy' % (name, i))
+        if series is not None:
+            np.save(path, series)
+            descriptions.append((path, array.shape[1]))
+        else:
+            np.save(path, array)
+            descriptions.append((path, 0))
+    return descriptions
+
+
+def load_shared(descriptions):
+    """
+    Returns the arrays saved with share_arrays, memory mapped, so the processes do not copy them.
+    """
+    arrays = []
+    for path, window in descriptions:
+        array = np.load(path, mmap_mode='r')
+        arrays.append(windows(array, window) if window else array)
+    return arrays
+
+
+def _fit_appliance(clf_class, clf_state, appliance_name, weights, train_main, train_targets, validate_main,
+                   validate_targets, input_shape, target_shape, threads):
+    # The thread limits have to be set before the network is built, which initializes TensorFlow
+    limit_backend_threads(threads, 1)
+    clf = clf_class.__new__(clf_class)
+    clf.__dict__.update(clf_state)
+    model = clf.return_network()
+    model.set_weights(weights)
+
+    train_data = WindowSequence(load_shared(train_main), load_shared(train_targets), input_shape, target_shape,
+                                clf.batch_size)
+    validation_data = None
+    if validate_targets is not None:
+        validation_data = WindowSequence(load_shared(validate_main), load_shared(validate_targets), input_shape,
+                                         target_shape, clf.batch_size, shuffle=False)
+    # The best weights are kept in memory and restored when the training ends
+    callbacks = training_callbacks(clf, appliance_name, validation_data is not None)
+    model.fit(train_data, validation_data=validation_data, epochs=clf.n_epochs, callbacks=callbacks,
+              workers=clf.workers)
+    return model.get_weights()
+
+
+def check_training_jobs(clf):
+    """
+    Raises a ValueError if a classifier trains in processes and chunk-wise at the same time.
+    """
+    if clf.training_jobs > 1 and clf.chunk_wise_training:
+        raise ValueError("training_jobs > 1 can not be combined with chunk_wise_training, the processes and the "
+                         "shared data would be created again and the optimizer state would be lost for every chunk")
+
+
+def fit_in_processes(clf, train_main, train_appliances, validate_main, validate_appliances, input_shape,
+                     target_shape):
+    """
+    Trains the model of every appliance of a classifier in its own process, clf.training_jobs at a time.
+    The preprocessed data is shared with the processes through memory mapped files, in shared memory where
+    the system has it. The trained weights are set on the models in clf.models. Every call starts new processes
+    with a new optimizer, so the whole training has to be done in one call.
+    """
+    validate_appliances = dict(validate_appliances)
+    n_jobs = min(clf.training_jobs, len(train_appliances))
+    threads = clf.threads_per_job or max(1, (os.cpu_count() or 1) // max(n_jobs, 1))
+    shared_dir = tempfile.mkdtemp(prefix='nilmtk-training-', dir='/dev/shm' if os.path.isdir('/dev/shm') else None)
+    try:
+        shared_train_main = share_arrays(shared_dir, 'train_main', train_main)
+        shared_validate_main = share_arrays(shared_dir, 'validate_main', validate_main)
+        clf_state = {attribute: value for attribute, value in vars(clf).items()
+                     if attribute not in WORKER_EXCLUDED_ATTRIBUTES}
+        executor = ProcessPoolExecutor(max_workers=n_jobs, mp_context=multiprocessing.get_context('spawn'))
+        with executor:
+            futures = {}
+            for index, (appliance_name, power) in enumerate(train_appliances):
+                if sum(len(array) for array in power) <= 10:
+                    # Sometimes chunks can be empty after dropping NANS
+                    continue
+                if appliance_name not in clf.models:
+                    print("First model training for ", appliance_name)
+                    clf.models[appliance_name] = clf.return_network()
+                else:
+                    print("Started Retraining model for ", appliance_name)
+                validate_targets = None
+                if appliance_name in validate_appliances:
+                    validate_targets = share_arrays(shared_dir, 'validate_%d' % index,
+                                                    validate_appliances[appliance_name])
+                futures[appliance_name] = executor.submit(
+                    _fit_appliance, type(clf), clf_state, appliance_name, clf.models[appliance_name].get_weights(),
+                    shared_train_main, share_arrays(shared_dir, 'train_%d' % index, power), shared_validate_main,
+                    validate_targets, input_shape, target_shape, threads)
+            for appliance_name, future in futures.items():
+                clf.models[appliance_name].set_weights(future.result())
+                print("Finished training the model for ", appliance_name)
+    finally:
+        shutil.rmtree(shared_dir, ignore_errors=True)
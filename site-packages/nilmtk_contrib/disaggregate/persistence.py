@@ -0,0 +1,156 @@
+import os
+import json
+from collections import OrderedDict
+from .quantization import save_inference_models, load_inference_models, export_inference_models
+from .gating import gating_report, ActivityGate
+from .training import evaluate_models, EpochTracker
+from .parallel_training import check_training_jobs
+
+# Attributes that the networks and the pre- and postprocessing of the *_val models depend on
+STATE_ATTRIBUTES = ('sequence_length', 'mains_mean', 'mains_std', 'max_val', 'appliance_params', 'multi_output')
+
+
+def save_models(clf, folder):
+    """
+    Saves the weights of the trained models of a classifier and the parameters that are needed to use them.
+    The parameters are written to model.json, the weights of every appliance to <appliance>.h5, or to
+    multi_output.h5 for the shared network of the multi-output mode. Converted inference models are saved as well.
+    """
+    os.makedirs(folder, exist_ok=True)
+    params_to_save = OrderedDict((attribute, getattr(clf, attribute)) for attribute in STATE_ATTRIBUTES
+                                 if hasattr(clf, attribute))
+    params_to_save['model'] = clf.MODEL_NAME
+    params_to_save['appliances'] = list(clf.models)
+    if getattr(clf, 'multi_output', False):
+        print("Saving the multi-output model for ", ", ".join(clf.models))
+        next(iter(clf.models.values())).save_weights(os.path.join(folder, "multi_output.h5"))
+    else:
+        for appliance_name in clf.models:
+            print("Saving model for ", appliance_name)
+            clf.models[appliance_name].save_weights(os.path.join(folder, appliance_name + ".h5"))
+    if getattr(clf, 'inference_models', None):
+        save_inference_models(clf, folder)
+    if getattr(clf, 'gate', None) is not None and clf.gate.fitted:
+        params_to_save['gating'] = {'thresholds': clf.gate.thresholds, 'base_values': clf.gate.base_values}
+
+    # numpy numbers in the appliance parameters are written as floats
+    with open(os.path.join(folder, 'model.json'), 'w') as file:
+        file.write(json.dumps(params_to_save, default=float))
+
+
+def load_models(clf, folder):
+    """
+    Restores the models of a classifier that were saved with save_models.
+    """
+    print("Loading the model using the pretrained-weights")
+    with open(os.path.join(folder, "model.json"), "r") as file:
+        params_to_load = json.loads(file.read().strip())
+
+    for attribute in STATE_ATTRIBUTES:
+        if attribute in params_to_load and hasattr(clf, attribute):
+            setattr(clf, attribute, params_to_load[attribute])
+    clf.sequence_length = int(clf.sequence_length)
+    # Models saved before the appliances were recorded have the appliances of their parameters
+    appliances = params_to_load.get('appliances', list(params_to_load.get('appliance_params', {})))
+
+    clf.models = OrderedDict()
+    if getattr(clf, 'multi_output', False):
+        # The shared network is stored once, its outputs are in the order of the saved appliances
+        network = clf.return_multi_output_network(len(appliances))
+        network.load_weights(os.path.join(folder, "multi_output.h5"))
+        for appliance_name in appliances:
+            clf.models[appliance_name] = network
+    else:
+        for appliance_name in appliances:
+            clf.models[appliance_name] = clf.return_network()
+            clf.models[appliance_name].load_weights(os.path.join(folder, appliance_name + ".h5"))
+
+    # The converted models are used for the predictions if they were saved with the weights
+    load_inference_models(clf, folder)
+    if 'gating' in params_to_load and getattr(clf, 'gate', None) is not None:
+        clf.gate.thresholds = params_to_load['gating']['thresholds']
+        clf.gate.base_values = params_to_load['gating']['base_values']
+
+
+def finish_training(clf, input_shape):
+    """
+    Converts, reports and saves the models of a classifier once its training is over and the best weights are
+    restored. The mains of the last training call, kept in clf.calibration_main, calibrate the converted models.
+    """
+    train_main, clf.calibration_main = clf.calibration_main, None
+    if train_main is not None:
+        if clf.inference_precision:
+            export_inference_models(clf, train_main, input_shape)
+        if clf.gate is not None and clf.gate.fitted:
+            gating_report(clf, train_main, input_shape)
+
+    if clf.save_model_path and clf.models:
+        clf.save_model()
+
+
+class ValModel():
+    """
+    Parameters and methods that the *_val models share. The models call init_val_params from their __init__ and
+    override target_shape if a window of the mains is mapped to more than one reading of an appliance.
+    """
+
+    # Attributes that change what the models learn, the model registry keys the trained models on them
+    TRAINING_PARAMS = ('sequence_length', 'n_epochs', 'batch_size', 'chunk_wise_training', 'mains_mean', 'mains_std',
+                       'max_val', 'appliance_params', 'multi_output', 'patience', 'lr_patience', 'lr_factor')
+
+    def init_val_params(self, params):
+        # Number of threads that gather the training batches
+        self.workers = params.get('workers', 2)
+        # Number of processes that train the models of the appliances in parallel, 1 trains them one after another
+        self.training_jobs = params.get('training_jobs', 1)
+        # Number of backend threads of every training process, by default the cores are divided between them
+        self.threads_per_job = params.get('threads_per_job', None)
+        check_training_jobs(self)
+        # If True, all appliances share one network with an output for every appliance
+        self.multi_output = params.get('multi_output', False)
+        # If set to 'float16', 'int8' or 'dynamic', the trained models are converted for faster CPU inference
+        self.inference_precision = params.get('inference_precision', None)
+        # Number of windows of the mains for the calibration and the accuracy report of the converted models
+        self.calibration_windows = params.get('calibration_windows', 1000)
+        self.inference_models = OrderedDict()
+        # Training stops after patience epochs without improvement, if None all n_epochs are trained
+        self.patience = params.get('patience', None)
+        # The learning rate is multiplied by lr_factor after lr_patience epochs without improvement
+        self.lr_patience = params.get('lr_patience', None)
+        self.lr_factor = params.get('lr_factor', 0.5)
+        # If set, the best weights are also saved to this folder while the models train
+        self.checkpoint_path = params.get('checkpoint_path', None)
+        # Keeps the best weights over the epochs of the chunk-wise training
+        self.epoch_tracker = EpochTracker()
+        # Preprocessed mains of the last training call, used by end_training to calibrate the converted models
+        self.calibration_main = None
+        # If True, windows in which the mains stay below the learned threshold of an appliance are not predicted
+        self.gating = params.get('gating', False)
+        # Quantile of the mains maxima of the training windows with the appliance on, used as the threshold
+        self.gating_quantile = params.get('gating_quantile', 0.001)
+        self.gate = ActivityGate(self.gating_quantile) if self.gating else None
+
+    def input_shape(self):
+        return (self.sequence_length, 1)
+
+    def target_shape(self):
+        return (1,)
+
+    def load_model(self, folder=None):
+        load_models(self, folder or self.load_model_path)
+
+    def save_model(self, folder=None):
+        save_models(self, folder or self.save_model_path)
+
+    def evaluate_chunk(self, validate_main, validate_appliances, do_preprocessing=True):
+        # Sums and counts of the validation losses of every appliance on one chunk of the chunk-wise training
+        if do_preprocessing:
+            validate_main, validate_appliances = self.call_preprocessing(validate_main, validate_appliances, 'train')
+        return evaluate_models(self, validate_main, validate_appliances, self.input_shape(), self.target_shape())
+
+    def end_epoch(self, validation_loss):
+        return self.epoch_tracker.end_epoch(self, validation_loss)
+
+    def end_training(self):
+        self.epoch_tracker.end_training(self)
+        finish_training(self, self.input_shape())
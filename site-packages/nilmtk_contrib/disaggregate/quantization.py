@@ -0,0 +1,217 @@
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+
+PRECISIONS = ('float16', 'int8', 'dynamic')
+
+
+def convert_model(model, precision, calibration_windows=None):
+    """
+    Converts a trained Keras model into a TensorFlow Lite model for the CPU and returns it as bytes.
+    float16: the weights are stored as float16
+    dynamic: the weights are quantized to int8, the activations are quantized on the fly
+    int8: the weights are quantized to int8, the ranges of the activations are calibrated on the windows
+    """
+    import tensorflow as tf
+    if precision not in PRECISIONS:
+        raise ValueError("The inference precision has to be one of {}, not {}".format(", ".join(PRECISIONS),
+                                                                                   precision))
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    # Recurrent layers without a TensorFlow Lite kernel fall back to TensorFlow operations
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS, tf.lite.OpsSet.SELECT_TF_OPS]
+    if precision == 'float16':
+        converter.target_spec.supported_types = [tf.float16]
+    elif precision == 'int8':
+        if calibration_windows is None or len(calibration_windows) == 0:
+            raise ValueError("The int8 precision needs windows of the mains for the calibration")
+
+        def representative_dataset():
+            for window in calibration_windows:
+                yield [np.asarray(window, dtype=np.float32)[np.newaxis]]
+
+        converter.representative_dataset = representative_dataset
+    return converter.convert()
+
+
+class QuantizedModel():
+    """
+    TensorFlow Lite version of a trained model, which predicts like the Keras model it was converted from.
+    Every thread gets its own interpreter, because an interpreter can not be used by several threads at once.
+    """
+
+    def __init__(self, content, output_names):
+        """
+        content: the converted model as bytes
+        output_names: names of the outputs of the Keras model, in the order of its outputs
+        """
+        self.content = content
+        self.output_names = list(output_names)
+        self._local = threading.local()
+
+    def __getstate__(self):
+        # Interpreters can not be pickled, they are created again from the content
+        return {'content': self.content, 'output_names': self.output_names}
+
+    def __setstate__(self, state):
+        self.__init__(state['content'], state['output_names'])
+
+    def runner(self):
+        if not hasattr(self._local, 'runner'):
+            import tensorflow as tf
+            interpreter = tf.lite.Interpreter(model_content=self.content)
+            self._local.runner = interpreter.get_signature_runner()
+            details = self._local.runner.get_output_details()
+            # The outputs are named like the output layers of the Keras model. The order of the tensors of the
+            # converted model can differ from the order of the outputs, so only a single output is taken unnamed.
+            if set(details) == set(self.output_names):
+                self._local.output_keys = self.output_names
+            elif len(details) == 1 and len(self.output_names) <= 1:
+                self._local.output_keys = list(details)
+            else:
+                raise ValueError("The outputs {} of the converted model do not match the outputs {} of the Keras model"
+                                 .format(sorted(details), self.output_names))
+            self._local.input_key = next(iter(self._local.runner.get_input_details()))
+        return self._local.runner
+
+    def predict(self, windows, batch_size=512):
+        runner = self.runner()
+        output_keys = self._local.output_keys
+        windows = np.asarray(windows, dtype=np.float32)
+        outputs = [[] for _ in output_keys]
+        for start in range(0, len(windows), batch_size):
+            # The runner resizes the input to the size of the batch
+            batch = runner(**{self._local.input_key: windows[start:start + batch_size]})
+            for output, key in zip(outputs, output_keys):
+                output.append(batch[key])
+        outputs = [np.concatenate(output) for output in outputs]
+        return outputs[0] if len(outputs) == 1 else outputs
+
+    def save(self, path):
+        with open(path, 'wb') as file:
+            file.write(self.content)
+
+    @classmethod
+    def load(cls, path, output_names):
+        with open(path, 'rb') as file:
+            return cls(file.read(), output_names)
+
+    @property
+    def size(self):
+        return len(self.content)
+
+
+def sample_windows(mains, n_windows, seed=10):
+    """
+    Returns a random sample of n_windows windows of the preprocessed mains of all buildings.
+    """
+    mains = [np.asarray(windows) for windows in mains if len(windows) > 0]
+    if len(mains) == 0:
+        return np.zeros((0,))
+    offsets = np.cumsum([0] + [len(windows) for windows in mains])
+    positions = np.random.RandomState(seed).choice(offsets[-1], min(n_windows, offsets[-1]), replace=False)
+    positions.sort()
+    buildings = np.searchsorted(offsets, positions, side='right') - 1
+    return np.concatenate([mains[building][positions[buildings == building] - offsets[building]]
+                           for building in np.unique(buildings)])
+
+
+def appliance_scale(clf, appliance_name):
+    """
+    Returns the offset and the factor that the targets of an appliance are normalized with,
+    normalized = (power - offset) / factor.
+    """
+    appliance_params = getattr(clf, 'appliance_params', {})
+    if appliance_name in appliance_params:
+        return appliance_params[appliance_name]['mean'], appliance_params[appliance_name]['std']
+    return 0, clf.max_val
+
+
+def to_watts(clf, appliance_name, predictions):
+    """
+    Returns the normalized predictions of an appliance in watts, with negative predictions set to zero watts
+    as in disaggregate_chunk.
+    """
+    offset, factor = appliance_scale(clf, appliance_name)
+    return np.maximum(offset + np.asarray(predictions) * factor, 0)
+
+
+def export_inference_models(clf, train_main, input_shape):
+    """
+    Converts the trained models of a classifier with clf.inference_precision and stores them in
+    clf.inference_models, which disaggregate_chunk uses instead of the Keras models.
+    The windows of the preprocessed mains are used for the calibration and to compare the predictions
+    with those of the Keras models. The comparison, in watts, is stored in clf.quantization_report and returned.
+    """
+    windows = sample_windows(train_main, clf.calibration_windows)
+    windows = windows.reshape((-1,) + tuple(input_shape)).astype(np.float32)
+    clf.inference_models = OrderedDict()
+    clf.quantization_report = OrderedDict()
+    converted = {}
+    for appliance_name, model in clf.models.items():
+        # In the multi-output mode, all appliances share one network, which is converted once
+        if id(model) not in converted:
+            print("Converting the model of", appliance_name, "for", clf.inference_precision, "inference")
+            quantized = QuantizedModel(convert_model(model, clf.inference_precision, windows), model.output_names)
+            converted[id(model)] = quantized
+            if len(windows) > 0:
+                original = model.predict(windows, batch_size=clf.batch_size)
+                predicted = quantized.predict(windows, batch_size=clf.batch_size)
+                if not isinstance(original, list):
+                    original, predicted = [original], [predicted]
+                for name, original_output, predicted_output in zip(
+                        [name for name, other in clf.models.items() if other is model], original, predicted):
+                    original_watts = to_watts(clf, name, original_output)
+                    difference = np.abs(original_watts - to_watts(clf, name, predicted_output))
+                    scale = np.mean(original_watts)
+                    clf.quantization_report[name] = {
+                        'precision': clf.inference_precision,
+                        'size': quantized.size,
+                        'mean_absolute_difference': float(np.mean(difference)),
+                        'max_absolute_difference': float(np.max(difference)),
+                        'relative_difference': float(np.mean(difference) / scale) if scale > 0 else 0.0}
+        clf.inference_models[appliance_name] = converted[id(model)]
+    for appliance_name, report in clf.quantization_report.items():
+        print("Accuracy of the", report['precision'], "model of", appliance_name, ":", report)
+    return clf.quantization_report
+
+
+def save_inference_models(clf, folder):
+    """
+    Saves the converted models of a classifier as .tflite files, the shared model of the multi-output mode once.
+    """
+    saved = set()
+    for appliance_name, quantized in clf.inference_models.items():
+        filename = "multi_output.tflite" if clf.multi_output else appliance_name + ".tflite"
+        if filename not in saved:
+            quantized.save(os.path.join(folder, filename))
+            saved.add(filename)
+
+
+def load_inference_models(clf, folder):
+    """
+    Loads the converted models of a classifier that were saved with save_inference_models, if there are any.
+    """
+    clf.inference_models = OrderedDict()
+    loaded = {}
+    for appliance_name, model in clf.models.items():
+        filename = "multi_output.tflite" if clf.multi_output else appliance_name + ".tflite"
+        path = os.path.join(folder, filename)
+        if not os.path.exists(path):
+            clf.inference_models = OrderedDict()
+            return
+        if filename not in loaded:
+            loaded[filename] = QuantizedModel.load(path, model.output_names)
+        clf.inference_models[appliance_name] = loaded[filename]
+
+
+def inference_models(clf):
+    """
+    Returns the models that disaggregate_chunk predicts with: the converted models if there is one
+    for every appliance, otherwise the Keras models.
+    """
+    models = getattr(clf, 'inference_models', None)
+    if models and all(appliance_name in models for appliance_name in clf.models):
+        return OrderedDict((appliance_name, models[appliance_name]) for appliance_name in clf.models)
+    return clf.models
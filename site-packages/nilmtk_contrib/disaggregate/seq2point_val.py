@@ -1,17 +1,22 @@
 from __future__ import print_function, division
 from warnings import warn
 from nilmtk.disaggregate import Disaggregator
-from keras.layers import Conv1D, Dense, Dropout, Reshape, Flatten
+from nilmtk.metrics import appliance_moments
+from .windowing import normalized_series, windows, WindowSequence
+from .multi_output import output_name, predict_appliances, fit_multi_output
+from .quantization import inference_models
+from .persistence import ValModel
+from .training import training_callbacks
+from .parallel_training import fit_in_processes
+from keras.layers import Conv1D, Dense, Dropout, Reshape, Flatten, Input
 import os
 import pickle
 import pandas as pd
 import numpy as np
 from collections import OrderedDict
 from keras.optimizers import SGD
-from keras.models import Sequential, load_model
+from keras.models import Sequential, Model, load_model
 import matplotlib.pyplot as plt
-from sklearn.model_selection import train_test_split
-from keras.callbacks import ModelCheckpoint
 import keras.backend as K
 import random
 import sys
@@ -24,7 +29,7 @@ class SequenceLengthError(Exception):
 class ApplianceNotFoundError(Exception):
     pass
 
-class Seq2Point_val(Disaggregator):
+class Seq2Point_val(ValModel, Disaggregator):
 
     def __init__(self, params):
         """
@@ -32,19 +37,26 @@ class Seq2Point_val(Disaggregator):
         """
 
         self.MODEL_NAME = "Seq2Point_val"
+        self.save_model_path = params.get('save-model-path',None)
+        self.load_model_path = params.get('pretrained-model-path',None)
         self.models = OrderedDict()
         self.chunk_wise_training = params.get('chunk_wise_training',False)
         self.sequence_length = params.get('sequence_length',99)
         self.n_epochs = params.get('n_epochs', 10 )
         self.batch_size = params.get('batch_size',512)
+        self.init_val_params(params)
         self.appliance_params = params.get('appliance_params',{})
         self.mains_mean = params.get('mains_mean',1800)
         self.mains_std = params.get('mains_std',600)
         if self.sequence_length%2==0:
             print ("Sequence length should be odd!")
             raise (SequenceLengthError)
+        if self.load_model_path:
+            self.load_model()
 
     def partial_fit(self,train_main,train_appliances,validate_main,validate_appliances,do_preprocessing=True,**load_kwargs):
+        # The converted models of the previous weights are stale, end_training converts the retrained models
+        self.inference_models = OrderedDict()
 
         # If no appliance wise parameters are provided, then copmute them using the first chunk
         if len(self.appliance_params) == 0:
@@ -56,61 +68,60 @@ class Seq2Point_val(Disaggregator):
         if do_preprocessing:
             train_main, train_appliances = self.call_preprocessing(
                 train_main, train_appliances, 'train')
-        train_main = pd.concat(train_main,axis=0)
-        train_main = train_main.values.reshape((-1,self.sequence_length,1))
-
-        new_train_appliances = []
-        for app_name, app_df in train_appliances:
-            app_df = pd.concat(app_df,axis=0)
-            app_df_values = app_df.values.reshape((-1,1))
-            new_train_appliances.append((app_name, app_df_values))
-        train_appliances = new_train_appliances
 
         ## ----- new for validation -----
         if do_preprocessing:
             validate_main, validate_appliances = self.call_preprocessing(
                 validate_main, validate_appliances, 'train')
-        validate_main = pd.concat(validate_main,axis=0)
-        validate_main = validate_main.values.reshape((-1,self.sequence_length,1))
-
-        new_validate_appliances = []
-        for app_name, app_df in validate_appliances:
-            val_app_df = pd.concat(app_df,axis=0)
-            val_app_df_values = val_app_df.values.reshape((-1,1))
-            new_validate_appliances.append((app_name, val_app_df_values))
-        validate_appliances = new_validate_appliances
+        validate_appliances = dict(validate_appliances)
         ## ----- new for validation -----
 
-        for appliance_name, power in train_appliances:
-            # Check if the appliance was already trained. If not then create a new model for it
-            if appliance_name not in self.models:
-                print("First model training for ", appliance_name)
-                self.models[appliance_name] = self.return_network()
-                print(self.models[appliance_name].summary())
-            # Retrain the particular appliance
-            else:
-                print("Started Retraining model for ", appliance_name)
-
-            model = self.models[appliance_name]
-            if train_main.size > 0:
-                # Sometimes chunks can be empty after dropping NANS
-                if len(train_main) > 10:
-                    # Do validation when you have sufficient samples
-                    filepath = 'seq2point-temp-weights-'+str(random.randint(0,100000))+'.h5'
-                    checkpoint = ModelCheckpoint(filepath,monitor='val_loss',verbose=1,save_best_only=True,mode='min')
-                    train_x, v_x, train_y, v_y = train_test_split(train_main, power, test_size=0.000001,random_state=10)
-                    ## ----- new for validation -----
-                    for validate_appliance_name, power_validate in validate_appliances:
-                        if validate_appliance_name == appliance_name:
-                            v_x, val_x, v_y, val_y = train_test_split(validate_main, power_validate, test_size=0.000001,random_state=10)
-                    ## ----- new for validation -----
-                    model.fit(train_x,train_y,validation_data=[v_x,v_y],epochs=self.n_epochs,callbacks=[checkpoint],batch_size=self.batch_size)
-                    model.load_weights(filepath)
+        if self.multi_output:
+            fit_multi_output(self, train_main, train_appliances, validate_main, validate_appliances,
+                             (self.sequence_length, 1), (1,))
+        elif self.training_jobs > 1:
+            fit_in_processes(self, train_main, train_appliances, validate_main, validate_appliances,
+                             (self.sequence_length, 1), (1,))
+        else:
+            for appliance_name, power in train_appliances:
+                # Check if the appliance was already trained. If not then create a new model for it
+                if appliance_name not in self.models:
+                    print("First model training for ", appliance_name)
+                    self.models[appliance_name] = self.return_network()
+                    print(self.models[appliance_name].summary())
+                # Retrain the particular appliance
+                else:
+                    print("Started Retraining model for ", appliance_name)
+
+                model = self.models[appliance_name]
+                # The shuffled batches of windows are gathered while the model trains
+                train_data = WindowSequence(train_main, power, (self.sequence_length, 1), (1,), self.batch_size)
+                if train_data.n_windows > 0:
+                    # Sometimes chunks can be empty after dropping NANS
+                    if train_data.n_windows > 10:
+                        # Do validation when you have sufficient samples
+                        ## ----- new for validation -----
+                        validation_data = None
+                        if appliance_name in validate_appliances:
+                            validation_data = WindowSequence(validate_main, validate_appliances[appliance_name],
+                                                             (self.sequence_length, 1), (1,), self.batch_size, shuffle=False)
+                        ## ----- new for validation -----
+                        # The best weights are kept in memory and restored when the training ends
+                        callbacks = training_callbacks(self, appliance_name, validation_data is not None)
+                        model.fit(train_data,validation_data=validation_data,epochs=self.n_epochs,callbacks=callbacks,
+                                  workers=self.workers)
+
+        if self.gate is not None:
+            # The thresholds only depend on the data, so they are learned from every training call
+            self.gate.fit(self, train_main, train_appliances)
+        # The models are converted and saved by end_training, after the best weights are restored
+        self.calibration_main = train_main
 
     def disaggregate_chunk(self,test_main_list,model=None,do_preprocessing=True):
 
         if model is not None:
             self.models = model
+            self.inference_models = OrderedDict()
 
         # Preprocess the test mains such as windowing and normalizing
 
@@ -119,11 +130,11 @@ class Seq2Point_val(Disaggregator):
 
         test_predictions = []
         for test_main in test_main_list:
-            test_main = test_main.values
-            test_main = test_main.reshape((-1, self.sequence_length, 1))
+            test_main = np.asarray(test_main).reshape((-1, self.sequence_length, 1))
             disggregation_dict = {}
-            for appliance in self.models:
-                prediction = self.models[appliance].predict(test_main,batch_size=self.batch_size)
+            predictions = predict_appliances(inference_models(self), test_main, self.batch_size, self.multi_output,
+                                             self.gate)
+            for appliance, prediction in predictions.items():
                 prediction = self.appliance_params[appliance]['mean'] + prediction * self.appliance_params[appliance]['std']
                 valid_predictions = prediction.flatten()
                 valid_predictions = np.where(valid_predictions > 0, valid_predictions, 0)
@@ -150,19 +161,34 @@ class Seq2Point_val(Disaggregator):
         model.compile(loss='mse', optimizer='adam')  # ,metrics=[self.mse])
         return model
 
+    def return_multi_output_network(self, n_outputs):
+        # The convolutional trunk is shared by all appliances, every appliance has its own output layer
+        inputs = Input(shape=(self.sequence_length,1))
+        x = Conv1D(30,10,activation="relu",strides=1)(inputs)
+        x = Conv1D(30, 8, activation='relu', strides=1)(x)
+        x = Conv1D(40, 6, activation='relu', strides=1)(x)
+        x = Conv1D(50, 5, activation='relu', strides=1)(x)
+        x = Dropout(.2)(x)
+        x = Conv1D(50, 5, activation='relu', strides=1)(x)
+        x = Dropout(.2)(x)
+        x = Flatten()(x)
+        x = Dense(1024, activation='relu')(x)
+        x = Dropout(.2)(x)
+        outputs = [Dense(1, name=output_name(i))(x) for i in range(n_outputs)]
+        model = Model(inputs=inputs, outputs=outputs)
+        model.compile(loss='mse', optimizer='adam')
+        return model
+
     def call_preprocessing(self, mains_lst, submeters_lst, method):
 
         if method == 'train':
             # Preprocessing for the train data
-            mains_df_list = []
+            processed_mains = []
             for mains in mains_lst:
-                new_mains = mains.values.flatten()
                 n = self.sequence_length
                 units_to_pad = n // 2
-                new_mains = np.pad(new_mains,(units_to_pad,units_to_pad),'constant',constant_values=(0,0))
-                new_mains = np.array([new_mains[i:i + n] for i in range(len(new_mains) - n + 1)])
-                new_mains = (new_mains - self.mains_mean) / self.mains_std
-                mains_df_list.append(pd.DataFrame(new_mains))
+                new_mains = normalized_series(mains.values, self.mains_mean, self.mains_std, units_to_pad, units_to_pad)
+                processed_mains.append(windows(new_mains, n))
 
             appliance_list = []
             for app_index, (app_name, app_df_list) in enumerate(submeters_lst):
@@ -173,37 +199,32 @@ class Seq2Point_val(Disaggregator):
                     print ("Parameters for ", app_name ," were not found!")
                     raise ApplianceNotFoundError()
 
-                processed_appliance_dfs = []
+                processed_appliances = []
 
                 for app_df in app_df_list:
-                    new_app_readings = app_df.values.reshape((-1, 1))
-                    # This is for choosing windows
-                    new_app_readings = (new_app_readings - app_mean) / app_std  
-                    # Return as a list of dataframe
-                    processed_appliance_dfs.append(pd.DataFrame(new_app_readings))
-                appliance_list.append((app_name, processed_appliance_dfs))
-            return mains_df_list, appliance_list
+                    new_app_readings = normalized_series(app_df.values, app_mean, app_std).reshape((-1, 1))
+                    processed_appliances.append(new_app_readings)
+                appliance_list.append((app_name, processed_appliances))
+            return processed_mains, appliance_list
 
         else:
             # Preprocessing for the test data
-            mains_df_list = []
+            processed_mains = []
 
             for mains in mains_lst:
-                new_mains = mains.values.flatten()
                 n = self.sequence_length
                 units_to_pad = n // 2
-                new_mains = np.pad(new_mains,(units_to_pad,units_to_pad),'constant',constant_values=(0,0))
-                new_mains = np.array([new_mains[i:i + n] for i in range(len(new_mains) - n + 1)])
-                new_mains = (new_mains - self.mains_mean) / self.mains_std
-                mains_df_list.append(pd.DataFrame(new_mains))
-            return mains_df_list
-
-    def set_appliance_params(self,train_appliances):
-        # Find the parameters using the first
-        for (app_name,df_list) in train_appliances:
-            l = np.array(pd.concat(df_list,axis=0))
-            app_mean = np.mean(l)
-            app_std = np.std(l)
+                new_mains = normalized_series(mains.values, self.mains_mean, self.mains_std, units_to_pad, units_to_pad)
+                processed_mains.append(windows(new_mains, n))
+            return processed_mains
+
+    def set_appliance_params(self,train_appliances,moments=None):
+        # The moments are accumulated frame by frame, unless they were computed in a pass over the chunks
+        if moments is None:
+            moments = appliance_moments(train_appliances)
+        for app_name, app_moments in moments.items():
+            app_mean = app_moments.mean
+            app_std = app_moments.std
             if app_std<1:
                 app_std = 100
             self.appliance_params.update({app_name:{'mean':app_mean,'std':app_std}})
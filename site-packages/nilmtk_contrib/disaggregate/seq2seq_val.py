@@ -2,7 +2,14 @@ from __future__ import print_function, division
 from warnings import warn
 
 from nilmtk.disaggregate import Disaggregator
-from keras.layers import Conv1D, Dense, Dropout, Reshape, Flatten
+from nilmtk.metrics import appliance_moments
+from .windowing import normalized_series, windows, WindowSequence, predict_overlap_add
+from .multi_output import output_name, predict_appliances, fit_multi_output
+from .quantization import inference_models
+from .persistence import ValModel
+from .training import training_callbacks
+from .parallel_training import fit_in_processes
+from keras.layers import Conv1D, Dense, Dropout, Reshape, Flatten, Input
 
 import os
 import pandas as pd
@@ -11,10 +18,8 @@ import pickle
 from collections import OrderedDict
 
 from keras.optimizers import SGD
-from keras.models import Sequential, load_model
+from keras.models import Sequential, Model, load_model
 import matplotlib.pyplot as plt
-from sklearn.model_selection import train_test_split
-from keras.callbacks import ModelCheckpoint
 import keras.backend as K
 import random
 random.seed(10)
@@ -29,11 +34,13 @@ class ApplianceNotFoundError(Exception):
 
 
 
-class Seq2Seq_val(Disaggregator):
+class Seq2Seq_val(ValModel, Disaggregator):
 
     def __init__(self, params):
 
         self.MODEL_NAME = "Seq2Seq_val"
+        self.save_model_path = params.get('save-model-path',None)
+        self.load_model_path = params.get('pretrained-model-path',None)
         self.chunk_wise_training = params.get('chunk_wise_training',False)
         self.sequence_length = params.get('sequence_length',99)
         self.n_epochs = params.get('n_epochs', 10)
@@ -41,12 +48,17 @@ class Seq2Seq_val(Disaggregator):
         self.mains_mean = 1800
         self.mains_std = 600
         self.batch_size = params.get('batch_size',512)
+        self.init_val_params(params)
         self.appliance_params = params.get('appliance_params',{})
         if self.sequence_length%2==0:
             print ("Sequence length should be odd!")
             raise (SequenceLengthError)
+        if self.load_model_path:
+            self.load_model()
 
     def partial_fit(self,train_main,train_appliances,validate_main,validate_appliances,do_preprocessing=True,**load_kwargs):
+        # The converted models of the previous weights are stale, end_training converts the retrained models
+        self.inference_models = OrderedDict()
 
         print("...............Seq2Seq partial_fit running...............")
         if len(self.appliance_params) == 0:
@@ -56,60 +68,64 @@ class Seq2Seq_val(Disaggregator):
         if do_preprocessing:
             train_main, train_appliances = self.call_preprocessing(
                 train_main, train_appliances, 'train')
-        train_main = pd.concat(train_main,axis=0)
-        train_main = train_main.values.reshape((-1,self.sequence_length,1))
-        
-        new_train_appliances = []
-        for app_name, app_dfs in train_appliances:
-            app_df = pd.concat(app_dfs,axis=0)
-            app_df_values = app_df.values.reshape((-1,self.sequence_length))
-            new_train_appliances.append((app_name, app_df_values))
-        train_appliances = new_train_appliances
 
         ## ----- new for validation -----
         print(len(validate_main))
         if do_preprocessing:
             validate_main, validate_appliances = self.call_preprocessing(
                 validate_main, validate_appliances, 'train')
-        validate_main = pd.concat(validate_main, axis=0)
-        validate_main = validate_main.values.reshape((-1, self.sequence_length, 1))
-
-        new_validate_appliances = []
-        for app_name, app_dfs in validate_appliances:
-            val_app_df = pd.concat(app_dfs, axis=0)
-            val_app_df_values = val_app_df.values.reshape((-1, self.sequence_length))
-            new_validate_appliances.append((app_name, val_app_df_values))
-        validate_appliances = new_validate_appliances
+        validate_appliances = dict(validate_appliances)
         ## ----- new for validation -----
 
-        for appliance_name, power in train_appliances:
-            if appliance_name not in self.models:
-                print("First model training for ", appliance_name)
-                self.models[appliance_name] = self.return_network()
-                print(self.models[appliance_name].summary())
-            else:
-                print("Started Retraining model for ", appliance_name)
-
-            model = self.models[appliance_name]
-            if train_main.size > 0:
-                # Sometimes chunks can be empty after dropping NANS
-                if len(train_main) > 10:
-                    # Do validation when you have sufficient samples
-                    filepath = 'seq2seq-temp-weights-'+str(random.randint(0,100000))+'.h5'
-                    checkpoint = ModelCheckpoint(filepath,monitor='val_loss',verbose=1,save_best_only=True,mode='min')
-                    train_x, v_x, train_y, v_y = train_test_split(train_main, power, test_size=0.000001,random_state=10)
-                    ## ----- new for validation -----
-                    for validate_appliance_name, power_validate in validate_appliances:
-                        if validate_appliance_name == appliance_name:
-                            v_x, val_x, v_y, val_y = train_test_split(validate_main, power_validate, test_size=0.000001,random_state=10)
-                    ## ----- new for validation -----
-                    model.fit(train_x,train_y,validation_data=[v_x,v_y],epochs=self.n_epochs,callbacks=[checkpoint],batch_size=self.batch_size)
-                    model.load_weights(filepath)
+        if self.multi_output:
+            fit_multi_output(self, train_main, train_appliances, validate_main, validate_appliances,
+                             (self.sequence_length, 1), (self.sequence_length,))
+        elif self.training_jobs > 1:
+            fit_in_processes(self, train_main, train_appliances, validate_main, validate_appliances,
+                             (self.sequence_length, 1), (self.sequence_length,))
+        else:
+            for appliance_name, power in train_appliances:
+                if appliance_name not in self.models:
+                    print("First model training for ", appliance_name)
+                    self.models[appliance_name] = self.return_network()
+                    print(self.models[appliance_name].summary())
+                else:
+                    print("Started Retraining model for ", appliance_name)
+
+                model = self.models[appliance_name]
+                # The shuffled batches of windows are gathered while the model trains
+                train_data = WindowSequence(train_main, power, (self.sequence_length, 1), (self.sequence_length,),
+                                            self.batch_size)
+                if train_data.n_windows > 0:
+                    # Sometimes chunks can be empty after dropping NANS
+                    if train_data.n_windows > 10:
+                        # Do validation when you have sufficient samples
+                        ## ----- new for validation -----
+                        validation_data = None
+                        if appliance_name in validate_appliances:
+                            validation_data = WindowSequence(validate_main, validate_appliances[appliance_name],
+                                                             (self.sequence_length, 1), (self.sequence_length,),
+                                                             self.batch_size, shuffle=False)
+                        ## ----- new for validation -----
+                        # The best weights are kept in memory and restored when the training ends
+                        callbacks = training_callbacks(self, appliance_name, validation_data is not None)
+                        model.fit(train_data,validation_data=validation_data,epochs=self.n_epochs,callbacks=callbacks,
+                                  workers=self.workers)
+
+        if self.gate is not None:
+            # The thresholds only depend on the data, so they are learned from every training call
+            self.gate.fit(self, train_main, train_appliances)
+        # The models are converted and saved by end_training, after the best weights are restored
+        self.calibration_main = train_main
+
+    def target_shape(self):
+        return (self.sequence_length,)
 
     def disaggregate_chunk(self,test_main_list,model=None,do_preprocessing=True):
 
         if model is not None:
             self.models = model
+            self.inference_models = OrderedDict()
 
         if do_preprocessing:
             test_main_list = self.call_preprocessing(
@@ -119,32 +135,14 @@ class Seq2Seq_val(Disaggregator):
         for test_mains_df in test_main_list:
 
             disggregation_dict = {}
-            test_main_array = test_mains_df.values.reshape((-1, self.sequence_length, 1))
+            test_main_array = np.asarray(test_mains_df).reshape((-1, self.sequence_length, 1))
 
-            for appliance in self.models:
+            # The predictions of the overlapping windows are averaged for every timestamp, block by block
+            averages = predict_overlap_add(self.predict_windows, test_main_array, self.models, self.sequence_length,
+                                           self.batch_size * 100)
 
-                prediction = []
-                model = self.models[appliance]
-                prediction = model.predict(test_main_array ,batch_size=self.batch_size)
-
-                #####################
-                # This block is for creating the average of predictions over the different sequences
-                # the counts_arr keeps the number of times a particular timestamp has occured
-                # the sum_arr keeps the number of times a particular timestamp has occured
-                # the predictions are summed for  agiven time, and is divided by the number of times it has occured
-                
-                l = self.sequence_length
-                n = len(prediction) + l - 1
-                sum_arr = np.zeros((n))
-                counts_arr = np.zeros((n))
-                o = len(sum_arr)
-                for i in range(len(prediction)):
-                    sum_arr[i:i + l] += prediction[i].flatten()
-                    counts_arr[i:i + l] += 1
-                for i in range(len(sum_arr)):
-                    sum_arr[i] = sum_arr[i] / counts_arr[i]
-
-                #################
+            for appliance in self.models:
+                sum_arr = averages[appliance]
                 prediction = self.appliance_params[appliance]['mean'] + (sum_arr * self.appliance_params[appliance]['std'])
                 valid_predictions = prediction.flatten()
                 valid_predictions = np.where(valid_predictions > 0, valid_predictions, 0)
@@ -155,6 +153,9 @@ class Seq2Seq_val(Disaggregator):
 
         return test_predictions
 
+    def predict_windows(self, windows):
+        return predict_appliances(inference_models(self), windows, self.batch_size, self.multi_output, self.gate)
+
     def return_network(self):
 
         model = Sequential()
@@ -174,18 +175,35 @@ class Seq2Seq_val(Disaggregator):
 
         return model
 
+    def return_multi_output_network(self, n_outputs):
+
+        # The convolutional trunk is shared by all appliances, every appliance has its own output layer
+        inputs = Input(shape=(self.sequence_length,1))
+        x = Conv1D(30,10,activation="relu",strides=2)(inputs)
+        x = Conv1D(30, 8, activation='relu', strides=2)(x)
+        x = Conv1D(40, 6, activation='relu', strides=1)(x)
+        x = Conv1D(50, 5, activation='relu', strides=1)(x)
+        x = Dropout(.2)(x)
+        x = Conv1D(50, 5, activation='relu', strides=1)(x)
+        x = Dropout(.2)(x)
+        x = Flatten()(x)
+        x = Dense(1024, activation='relu')(x)
+        x = Dropout(.2)(x)
+        outputs = [Dense(self.sequence_length, name=output_name(i))(x) for i in range(n_outputs)]
+        model = Model(inputs=inputs, outputs=outputs)
+        model.compile(loss='mse', optimizer='adam')
+
+        return model
+
     def call_preprocessing(self, mains_lst, submeters_lst, method):
 
         if method == 'train':            
             processed_mains_lst = []
             for mains in mains_lst:
-                new_mains = mains.values.flatten()
                 n = self.sequence_length
                 units_to_pad = n // 2
-                new_mains = np.pad(new_mains, (units_to_pad,units_to_pad),'constant',constant_values = (0,0))
-                new_mains = np.array([new_mains[i:i + n] for i in range(len(new_mains) - n + 1)])
-                new_mains = (new_mains - self.mains_mean) / self.mains_std
-                processed_mains_lst.append(pd.DataFrame(new_mains))
+                new_mains = normalized_series(mains.values, self.mains_mean, self.mains_std, units_to_pad, units_to_pad)
+                processed_mains_lst.append(windows(new_mains, n))
             #new_mains = pd.DataFrame(new_mains)
             appliance_list = []
             for app_index, (app_name, app_df_lst) in enumerate(submeters_lst):
@@ -198,16 +216,11 @@ class Seq2Seq_val(Disaggregator):
                     raise ApplianceNotFoundError()
 
 
-                processed_app_dfs = []
-                for app_df in app_df_lst:                    
-                    new_app_readings = app_df.values.flatten()
-                    new_app_readings = np.pad(new_app_readings, (units_to_pad,units_to_pad),'constant',constant_values = (0,0))
-                    new_app_readings = np.array([new_app_readings[i:i + n] for i in range(len(new_app_readings) - n + 1)])                    
-                    new_app_readings = (new_app_readings - app_mean) / app_std  # /self.max_val
-                    processed_app_dfs.append(pd.DataFrame(new_app_readings))
-                    
-                    
-                appliance_list.append((app_name, processed_app_dfs))
+                processed_apps = []
+                for app_df in app_df_lst:
+                    new_app_readings = normalized_series(app_df.values, app_mean, app_std, units_to_pad, units_to_pad)
+                    processed_apps.append(windows(new_app_readings, n))
+                appliance_list.append((app_name, processed_apps))
                 #new_app_readings = np.array([ new_app_readings[i:i+n] for i in range(len(new_app_readings)-n+1) ])
                 #print (new_mains.shape, new_app_readings.shape, app_name)
 
@@ -216,22 +229,17 @@ class Seq2Seq_val(Disaggregator):
         else:
             processed_mains_lst = []
             for mains in mains_lst:
-                new_mains = mains.values.flatten()
-                n = self.sequence_length
-                units_to_pad = n // 2
-                #new_mains = np.pad(new_mains, (units_to_pad,units_to_pad),'constant',constant_values = (0,0))
-                new_mains = np.array([new_mains[i:i + n] for i in range(len(new_mains) - n + 1)])
-                new_mains = (new_mains - self.mains_mean) / self.mains_std
-                new_mains = new_mains.reshape((-1, self.sequence_length))
-                processed_mains_lst.append(pd.DataFrame(new_mains))
+                new_mains = normalized_series(mains.values, self.mains_mean, self.mains_std)
+                processed_mains_lst.append(windows(new_mains, self.sequence_length))
             return processed_mains_lst
 
-    def set_appliance_params(self,train_appliances):
-
-        for (app_name,df_list) in train_appliances:
-            l = np.array(pd.concat(df_list,axis=0))
-            app_mean = np.mean(l)
-            app_std = np.std(l)
+    def set_appliance_params(self,train_appliances,moments=None):
+        # The moments are accumulated frame by frame, unless they were computed in a pass over the chunks
+        if moments is None:
+            moments = appliance_moments(train_appliances)
+        for app_name, app_moments in moments.items():
+            app_mean = app_moments.mean
+            app_std = app_moments.std
             if app_std<1:
                 app_std = 100
             self.appliance_params.update({app_name:{'mean':app_mean,'std':app_std}})
@@ -0,0 +1,145 @@
+import os
+from collections import OrderedDict
+import numpy as np
+import keras.backend as K
+from keras.callbacks import Callback, EarlyStopping, ReduceLROnPlateau, ModelCheckpoint
+from .windowing import WindowSequence
+
+
+class BestWeights(Callback):
+    """
+    Keeps the weights of the epoch with the lowest monitored loss in memory and restores them when the training ends.
+    """
+
+    def __init__(self, monitor='val_loss'):
+        super().__init__()
+        self.monitor = monitor
+        self.best = np.inf
+        self.best_epoch = None
+        self.best_weights = None
+
+    def on_train_begin(self, logs=None):
+        # Every fit starts again, so the weights of an earlier chunk or training are not restored
+        self.best = np.inf
+        self.best_epoch = None
+        self.best_weights = None
+
+    def on_epoch_end(self, epoch, logs=None):
+        current = (logs or {}).get(self.monitor)
+        if current is None or not current < self.best:
+            return
+        self.best = current
+        self.best_epoch = epoch
+        self.best_weights = self.model.get_weights()
+
+    def on_train_end(self, logs=None):
+        if self.best_weights is not None:
+            print("Restoring the weights of epoch", self.best_epoch + 1, "with", self.monitor, self.best)
+            self.model.set_weights(self.best_weights)
+
+
+def training_callbacks(clf, name, has_validation):
+    """
+    Returns the callbacks for training the model of a classifier, name is the appliance or 'multi_output'.
+    The best weights are kept in memory. Early stopping, the learning rate schedule and the checkpoints
+    are used if the classifier has a patience, an lr_patience or a checkpoint_path.
+    """
+    monitor = 'val_loss' if has_validation else 'loss'
+    callbacks = [BestWeights(monitor)]
+    if clf.patience is not None:
+        callbacks.append(EarlyStopping(monitor=monitor, patience=clf.patience, mode='min', verbose=1))
+    if clf.lr_patience is not None:
+        callbacks.append(ReduceLROnPlateau(monitor=monitor, factor=clf.lr_factor, patience=clf.lr_patience,
+                                           mode='min', verbose=1))
+    if clf.checkpoint_path:
+        os.makedirs(clf.checkpoint_path, exist_ok=True)
+        filepath = os.path.join(clf.checkpoint_path, clf.MODEL_NAME + '-' + name + '.h5')
+        callbacks.append(ModelCheckpoint(filepath, monitor=monitor, verbose=1, save_best_only=True,
+                                         save_weights_only=True, mode='min'))
+    return callbacks
+
+
+def unique_networks(clf):
+    """
+    Returns the networks of a classifier with the appliances of each, the multi-output network once.
+    """
+    networks = OrderedDict()
+    for appliance_name, model in clf.models.items():
+        networks.setdefault(id(model), (model, []))[1].append(appliance_name)
+    return list(networks.values())
+
+
+def evaluate_models(clf, validate_main, validate_appliances, input_shape, target_shape):
+    """
+    Evaluates the models of a classifier on a chunk of preprocessed validation data. Returns an OrderedDict with
+    the sum of the losses of the windows and the number of windows of every appliance, which can be added up
+    over the chunks.
+    """
+    validate_appliances = dict(validate_appliances)
+    losses = OrderedDict()
+    for network, appliance_names in unique_networks(clf):
+        if not all(appliance_name in validate_appliances for appliance_name in appliance_names):
+            continue
+        if getattr(clf, 'multi_output', False):
+            targets = OrderedDict((appliance_name, validate_appliances[appliance_name])
+                                  for appliance_name in appliance_names)
+        else:
+            targets = validate_appliances[appliance_names[0]]
+        data = WindowSequence(validate_main, targets, input_shape, target_shape, clf.batch_size, shuffle=False)
+        if data.n_windows == 0:
+            continue
+        result = np.atleast_1d(network.evaluate(data, verbose=0, workers=clf.workers))
+        # With several outputs, the total loss comes first and the loss of every output follows
+        appliance_losses = result[1:] if len(result) > 1 else result
+        for appliance_name, loss in zip(appliance_names, appliance_losses):
+            losses[appliance_name] = (float(loss) * data.n_windows, data.n_windows)
+    return losses
+
+
+class EpochTracker():
+    """
+    Follows the validation loss of chunk-wise training over the epochs. The best weights are kept in memory,
+    the learning rate is reduced and the training is stopped with the patience settings of the classifier.
+    """
+
+    def __init__(self):
+        self.best = np.inf
+        self.best_epoch = None
+        self.best_weights = None
+        self.epoch = 0
+        self.wait = 0
+        self.lr_wait = 0
+
+    def end_epoch(self, clf, loss):
+        """
+        Records the validation loss of the epoch and returns True if the training should stop.
+        """
+        self.epoch += 1
+        if loss is None:
+            return False
+        if loss < self.best:
+            self.best = loss
+            self.best_epoch = self.epoch
+            self.best_weights = [network.get_weights() for network, _ in unique_networks(clf)]
+            self.wait = 0
+            self.lr_wait = 0
+            return False
+        self.wait += 1
+        self.lr_wait += 1
+        if clf.lr_patience is not None and self.lr_wait >= clf.lr_patience:
+            self.lr_wait = 0
+            for network, _ in unique_networks(clf):
+                learning_rate = K.get_value(network.optimizer.learning_rate) * clf.lr_factor
+                K.set_value(network.optimizer.learning_rate, learning_rate)
+            print("Reducing the learning rate of", clf.MODEL_NAME, "to", learning_rate)
+        if clf.patience is not None and self.wait >= clf.patience:
+            print("Early stopping of", clf.MODEL_NAME, "after epoch", self.epoch)
+            return True
+        return False
+
+    def end_training(self, clf):
+        if self.best_weights is not None:
+            print("Restoring the weights of epoch", self.best_epoch, "with val_loss", self.best)
+            for (network, _), weights in zip(unique_networks(clf), self.best_weights):
+                network.set_weights(weights)
+        self.__init__()
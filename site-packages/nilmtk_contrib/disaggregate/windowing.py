@@ -0,0 +1,162 @@
+from collections import OrderedDict
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from keras.utils import Sequence
+from nilmtk.array_cache import window_series
+
+
+def normalized_series(data, mean=0, std=1, pad_before=0, pad_after=0, dtype=np.float32):
+    """
+    Returns the readings of a dataframe or array as a new 1-D array, padded with zeros on both sides
+    and normalized in place. This is the only copy of the readings that the windows are taken from.
+    """
+    values = np.asarray(data).reshape(-1)
+    series = np.zeros(pad_before + len(values) + pad_after, dtype=dtype)
+    series[pad_before:pad_before + len(values)] = values
+    series -= mean
+    series /= std
+    return series
+
+
+def windows(series, sequence_length, overlapping=True):
+    """
+    Returns the windows of a 1-D series as rows of a 2-D array without copying the series.
+    Overlapping windows start at every reading and are a read-only view, others are taken one after another.
+    """
+    if overlapping:
+        return sliding_window_view(series, sequence_length)
+    return series.reshape((-1, sequence_length))
+
+
+class WindowSequence(Sequence):
+    """
+    Keras input of mini-batches of windows, which are gathered on the fly from the windows of several buildings.
+    The windows are usually views of the preprocessed series, so only one batch of windows exists as a copy.
+    """
+
+    def __init__(self, inputs, targets, input_shape, target_shape, batch_size, shuffle=True, seed=10):
+        """
+        inputs: list with the windows of the mains of every building, one window per row
+        targets: list with the targets of every building, one row per window. For models with several outputs,
+                 a dictionary with such a list for every output, the batches then contain a list of targets
+        input_shape, target_shape: shape of one input and one target as the model expects it
+        shuffle: if True, the windows are shuffled again before every epoch
+        """
+        super().__init__()
+        self.multiple_targets = isinstance(targets, dict)
+        if not self.multiple_targets:
+            targets = {None: targets}
+        self.inputs = [np.asarray(array) for array in inputs]
+        self.targets = [[np.asarray(array) for array in output_targets] for output_targets in targets.values()]
+        for output_targets in self.targets:
+            for mains, target in zip(self.inputs, output_targets):
+                if len(mains) != len(target):
+                    raise ValueError("There are {} windows of the mains, but {} targets".format(len(mains),
+                                                                                               len(target)))
+        self.input_shape = tuple(input_shape)
+        self.target_shape = tuple(target_shape)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.random_state = np.random.RandomState(seed)
+        # Position of the first window of every building
+        self.offsets = np.cumsum([0] + [len(mains) for mains in self.inputs])
+        self.n_windows = int(self.offsets[-1])
+        self.order = np.arange(self.n_windows)
+        if self.shuffle:
+            self.random_state.shuffle(self.order)
+
+    def __len__(self):
+        return int(np.ceil(self.n_windows / self.batch_size))
+
+    def __getitem__(self, index):
+        positions = self.order[index * self.batch_size:(index + 1) * self.batch_size]
+        buildings = np.searchsorted(self.offsets, positions, side='right') - 1
+        x = np.empty((len(positions), int(np.prod(self.input_shape))), dtype=np.float32)
+        ys = [np.empty((len(positions), int(np.prod(self.target_shape))), dtype=np.float32) for _ in self.targets]
+        for building in np.unique(buildings):
+            in_building = buildings == building
+            rows = positions[in_building] - self.offsets[building]
+            x[in_building] = self.inputs[building][rows].reshape((len(rows), -1))
+            for y, output_targets in zip(ys, self.targets):
+                y[in_building] = output_targets[building][rows].reshape((len(rows), -1))
+        ys = [y.reshape((-1,) + self.target_shape) for y in ys]
+        return x.reshape((-1,) + self.input_shape), ys if self.multiple_targets else ys[0]
+
+    def on_epoch_end(self):
+        if self.shuffle:
+            self.random_state.shuffle(self.order)
+
+
+def window_coverage(n_windows, sequence_length):
+    """
+    Returns for every position of a series with n_windows overlapping windows the number of windows that cover it.
+    """
+    length = n_windows + sequence_length - 1
+    positions = np.arange(length)
+    return np.minimum.reduce([positions + 1, np.full(length, min(n_windows, sequence_length)), length - positions])
+
+
+class OverlapAdd():
+    """
+    Averages the predictions of overlapping windows, where window i covers the positions i to i + sequence_length - 1.
+    The predictions can be added block by block, every block returns the positions that no later window covers.
+    """
+
+    def __init__(self, sequence_length):
+        self.sequence_length = sequence_length
+        self.n_windows = 0
+        # Sums and counts of the positions that the next windows still cover
+        self._tail_sum = np.zeros(sequence_length - 1)
+        self._tail_count = np.zeros(sequence_length - 1)
+
+    def add(self, predictions):
+        """
+        Adds the predictions of the next windows, one window per row, and returns the averages of the
+        positions that are complete.
+        """
+        l = self.sequence_length
+        predictions = np.asarray(predictions).reshape((-1, l))
+        n = len(predictions)
+        if n == 0:
+            return np.zeros(0)
+        # Window i adds its predictions to the positions i to i + l - 1, all windows are summed in one pass
+        positions = (np.arange(n)[:, np.newaxis] + np.arange(l)).ravel()
+        sums = np.bincount(positions, weights=predictions.ravel(), minlength=n + l - 1)
+        sums[:l - 1] += self._tail_sum
+        counts = window_coverage(n, l).astype(np.float64)
+        counts[:l - 1] += self._tail_count
+        self._tail_sum = sums[n:]
+        self._tail_count = counts[n:]
+        self.n_windows += n
+        return sums[:n] / counts[:n]
+
+    def finish(self):
+        """
+        Returns the averages of the last sequence_length - 1 positions after all windows were added.
+        """
+        if self.n_windows == 0:
+            return np.zeros(0)
+        return self._tail_sum / self._tail_count
+
+
+def predict_overlap_add(predict, windows, appliances, sequence_length, block_size):
+    """
+    Returns an OrderedDict with the averaged predictions of every appliance for every position of the series.
+    predict is called with blocks of at most block_size windows and returns an OrderedDict with the predictions
+    of every appliance, so only the predictions of one block are held in memory.
+    """
+    reconstructions = OrderedDict((appliance, OverlapAdd(sequence_length)) for appliance in appliances)
+    averages = OrderedDict((appliance, []) for appliance in appliances)
+    for start in range(0, len(windows), block_size):
+        for appliance, prediction in predict(windows[start:start + block_size]).items():
+            averages[appliance].append(reconstructions[appliance].add(prediction))
+    return OrderedDict((appliance, np.concatenate(averages[appliance] + [reconstructions[appliance].finish()]))
+                       for appliance in appliances)
+
+
+def overlap_add(predictions, sequence_length):
+    """
+    Returns the averaged predictions of all overlapping windows for every position of the series.
+    """
+    reconstruction = OverlapAdd(sequence_length)
+    return np.concatenate([reconstruction.add(predictions), reconstruction.finish()])
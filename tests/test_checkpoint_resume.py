@@ -0,0 +1,56 @@
+import os
+import filecmp
+
+from SynTiSeD import SynTiSeD
+from Utils.actionsequence import ActionSequenceList
+from Utils.appliance import ApplianceDictionary
+from Utils.resident import ResidentDictionary
+
+RESOURCE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                             'Resources', 'ApplianceData', 'GeLaP_Data', 'hh_04')
+APPLIANCES = {'coffee machine': 'CoffeeMachine', 'kettle': 'Kettle', 'lamp': 'Lamp', 'microwave': 'Microwave',
+              'television': 'Television', 'washing machine': 'WashingMachine'}
+SIMULATED_DAYS = 3
+
+
+def create_syntised(save_path, checkpoint_path, resume_from=None):
+    ## every simulator gets new appliances and residents, like a simulation started in a new process
+    appl_dict = ApplianceDictionary()
+    for name, folder in APPLIANCES.items():
+        appl_dict.add_appliance(name, os.path.join(RESOURCE_PATH, folder, 'df_zero_filled'))
+    perm_appl_dict = ApplianceDictionary()
+    perm_appl_dict.add_permanent_appliance('radio', os.path.join(RESOURCE_PATH, 'Radio') + '/')
+
+    action_seq_list = ActionSequenceList()
+    action_seq_list.append_action_seq_folder(os.path.join(RESOURCE_PATH, 'Activities'))
+    res_dict = ResidentDictionary()
+    res_dict.add_resident('Karl', action_seq_list, 600)
+
+    return SynTiSeD(appl_dict, perm_appl_dict, res_dict, SIMULATED_DAYS, '2022-02-01', save_path=str(save_path),
+                    checkpoint_path=str(checkpoint_path), resume_from=resume_from, output_workers=0, seed=7)
+
+
+def written_files(save_path):
+    return sorted(os.path.relpath(os.path.join(directory, filename), save_path)
+                  for directory, _, filenames in os.walk(save_path) for filename in filenames)
+
+
+def test_resumed_simulation_writes_the_same_files(tmp_path):
+    uninterrupted_path = tmp_path / 'uninterrupted'
+    for _ in create_syntised(uninterrupted_path, tmp_path / 'uninterrupted.ckpt').iter_days():
+        pass
+
+    ## the first simulation is interrupted after the first day, the second one resumes from its checkpoint
+    resumed_path = tmp_path / 'resumed'
+    days = create_syntised(resumed_path, tmp_path / 'resumed.ckpt').iter_days()
+    next(days)
+    days.close()
+    assert written_files(resumed_path) != written_files(uninterrupted_path)
+    resumed = create_syntised(resumed_path, tmp_path / 'resumed.ckpt', resume_from=str(tmp_path / 'resumed.ckpt'))
+    for _ in resumed.iter_days():
+        pass
+
+    files = written_files(uninterrupted_path)
+    assert written_files(resumed_path) == files
+    _, mismatch, errors = filecmp.cmpfiles(uninterrupted_path, resumed_path, files, shallow=False)
+    assert mismatch == [] and errors == []